@@ -4,6 +4,7 @@ Clean, modular application structure using blueprints
 """
 from flask import Flask
 from datetime import datetime
+import click
 import os
 
 # Import extensions
@@ -22,7 +23,6 @@ from blueprints.recipes import recipes_bp
 
 # Import utilities
 from utils.helpers import inject_now
-from utils.db_helpers import ensure_schema_updates
 
 
 def create_app(config_object='config.Config'):
@@ -82,11 +82,229 @@ def create_app(config_object='config.Config'):
         secondary_id = click.prompt('Secondary ingredient ID', type=int)
         show_secondary_ingredient_details(secondary_id)
     
+    @app.cli.command('refresh-costs')
+    def refresh_costs_command():
+        """Recompute the cached costs of every product, secondary ingredient and recipe"""
+        from utils.cost_cache import refresh_all_costs
+        
+        refresh_all_costs()
+        db.session.commit()
+        click.echo('✓ Cost cache refreshed')
+    
+    @app.cli.command('recost')
+    @click.option('--dry-run', is_flag=True, help='Compute and report without saving')
+    def recost_command(dry_run):
+        """Recost the whole catalog with the vectorized engine"""
+        import time
+        from utils.recost import recost_catalog
+        
+        started = time.perf_counter()
+        counts = recost_catalog()
+        if dry_run:
+            db.session.rollback()
+        else:
+            db.session.commit()
+        elapsed = time.perf_counter() - started
+        click.echo(f"{'Would update' if dry_run else 'Updated'} {counts['products']} product(s), "
+                   f"{counts['secondary']} secondary ingredient(s), {counts['recipes']} recipe(s) in {elapsed:.2f}s")
+    
+    @app.cli.command('where-used')
+    @click.argument('code')
+    def where_used_command(code):
+        """Show what uses a product, secondary ingredient or recipe, by code"""
+        from utils.where_used import where_used, find_by_code
+        
+        ingredient = find_by_code(code)
+        if not ingredient:
+            click.echo(f'✗ Nothing found with code {code}')
+            return
+        result = where_used(ingredient)
+        target = result['ingredient']
+        click.echo(f"{target['type']} {target['code']}: {target['name']}")
+        click.echo(f"\nSecondary ingredients ({len(result['secondary_ingredients'])}):")
+        for item in result['secondary_ingredients']:
+            click.echo(f"  - {item['code']} {item['name']}")
+        click.echo(f"\nRecipes ({len(result['recipes'])}):")
+        for item in result['recipes']:
+            click.echo(f"  - {item['code']} {item['title']}")
+    
+    @app.cli.command('simulate')
+    @click.option('--product', 'products', multiple=True, metavar='CODE=CHANGE',
+                  help='Product code and change, e.g. BB042=+18% or BB042=12.50')
+    @click.option('--supplier', 'suppliers', multiple=True, metavar='NAME=CHANGE',
+                  help='Supplier and change applied to all its products, e.g. "Gin Co=-5%"')
+    @click.option('--threshold', type=float, help='Only show recipes whose cost % crosses this value')
+    @click.option('--type', 'recipe_type', help='Only show recipes of this type, e.g. Cocktails')
+    @click.option('--limit', type=int, default=50, show_default=True)
+    def simulate_command(products, suppliers, threshold, recipe_type, limit):
+        """Show how hypothetical price changes would move recipe costs (nothing is saved)"""
+        import time
+        from utils.simulation import simulate, parse_change, SimulationError
+        
+        overrides = []
+        try:
+            for key, values in (('code', products), ('supplier', suppliers)):
+                for value in values:
+                    target, sep, change = value.rpartition('=')
+                    if not sep or not target.strip():
+                        raise SimulationError(f"Expected NAME=CHANGE, got '{value}'")
+                    overrides.append({key: target.strip(), **parse_change(change)})
+            started = time.perf_counter()
+            result = simulate(overrides, threshold=threshold, recipe_type=recipe_type, limit=limit)
+        except SimulationError as e:
+            raise click.ClickException(str(e))
+        elapsed = time.perf_counter() - started
+        
+        click.echo(f"{result['recipes_affected']} of {result['recipes_evaluated']} recipe(s) affected "
+                   f"({elapsed * 1000:.0f} ms)")
+        for item in result['results']:
+            before = item['cost_percentage']
+            after = item['simulated_cost_percentage']
+            pct = (f"{before:.2f}% -> {after:.2f}% ({item['cost_percentage_change']:+.2f})"
+                   if before is not None else 'no selling price')
+            click.echo(f"  {item['code'] or '-':<10} {item['title'] or '':<40} "
+                       f"{item['total_cost']:.2f} -> {item['simulated_total_cost']:.2f}  {pct}")
+    
+    @app.cli.command('search-reindex')
+    def search_reindex_command():
+        """Rebuild the full-text search index from scratch"""
+        from utils.search import rebuild_search_index
+        
+        count = rebuild_search_index()
+        db.session.commit()
+        click.echo(f'✓ Indexed {count} document(s)')
+
+    @app.cli.command('migrate')
+    @click.option('--status', is_flag=True, help='List applied and pending migrations without running them')
+    def migrate_command(status):
+        """Create missing tables and apply pending schema migrations"""
+        from utils.migrations import MIGRATIONS, applied_versions, run_migrations
+        
+        if status:
+            applied = applied_versions()
+            for item in MIGRATIONS:
+                click.echo(f"{'✓' if item.version in applied else ' '} {item.version:>3} {item.name}")
+            return
+        applied = run_migrations(log=click.echo)
+        click.echo(f'✓ Applied {len(applied)} migration(s)' if applied else '✓ Database is up to date')
+
+    @app.cli.command('process-images')
+    @click.option('--force', is_flag=True, help='Regenerate variants that already exist')
+    def process_images(force):
+        """Move earlier uploads to content-addressed paths and create missing image variants"""
+        from sqlalchemy import select, union, update
+        from utils.file_upload import is_content_addressed, store_existing_upload, remove_upload_files
+        from utils.images import pillow_available, process_image, variant_paths
+        
+        paths = list(db.session.scalars(union(
+            select(Product.image_path).where(Product.image_path.isnot(None), Product.image_path != ''),
+            select(Recipe.image_path).where(Recipe.image_path.isnot(None), Recipe.image_path != ''),
+        )))
+        moved = processed = skipped = failed = 0
+        for path in paths:
+            try:
+                if not is_content_addressed(path):
+                    new_path = store_existing_upload(path)
+                    if new_path is None:
+                        skipped += 1
+                        continue
+                    for model in (Product, Recipe):
+                        db.session.execute(update(model).where(model.image_path == path).values(image_path=new_path))
+                    db.session.commit()
+                    remove_upload_files([path])
+                    moved += 1
+                    continue
+                full_path = os.path.join(app.static_folder, path)
+                has_variants = all(os.path.exists(os.path.join(app.static_folder, variant))
+                                   for variant in variant_paths(path))
+                if not pillow_available() or not os.path.exists(full_path) or (has_variants and not force):
+                    skipped += 1
+                    continue
+                with open(full_path, 'rb') as original:
+                    # A stored original is served as immutable, so only its variants are (re)written
+                    process_image(original.read(), app.static_folder, path, keep_original=True)
+                processed += 1
+            except Exception as e:
+                db.session.rollback()
+                failed += 1
+                click.echo(f'✗ {path}: {str(e)}')
+        click.echo(f'✓ Moved {moved} upload(s) to content-addressed paths, created variants for {processed}, '
+                   f'skipped {skipped}, failed {failed}')
+        if not pillow_available():
+            click.echo('✗ Pillow is not installed, so no variants were created (pip install -r requirements.txt).')
+
+    @app.cli.command('gc-uploads')
+    @click.option('--dry-run', is_flag=True, help='Report orphaned files without removing them')
+    @click.option('--quarantine', is_flag=True, help='Move orphans to UPLOAD_QUARANTINE_FOLDER instead of deleting them')
+    @click.option('--min-age', type=float, default=1.0, show_default=True,
+                  help='Hours a file must have existed before it is collected')
+    def gc_uploads(dry_run, quarantine, min_age):
+        """Delete or quarantine uploaded files that no product or recipe refers to"""
+        import time
+        from utils.upload_gc import collect_uploads
+        
+        started = time.perf_counter()
+        report = collect_uploads(dry_run=dry_run, quarantine=quarantine, min_age=min_age * 3600)
+        for path in report.sample:
+            click.echo(f'  {path}')
+        if report.orphans > len(report.sample):
+            click.echo(f'  ... and {report.orphans - len(report.sample)} more')
+        for error in report.errors:
+            click.echo(f'✗ {error}')
+        click.echo(f'✓ {report.summary()} ({time.perf_counter() - started:.1f}s)')
+
+    @app.cli.command('clear-response-cache')
+    def clear_response_cache():
+        """Drop every cached recipe list table (entries also expire on any catalog write)"""
+        cache = app.extensions['response_cache']['cache']
+        if cache is None:
+            click.echo('✗ RESPONSE_CACHE is none; nothing to clear')
+            return
+        cache.clear()
+        click.echo(f'✓ Cleared the {app.config["RESPONSE_CACHE"]} response cache')
+
+    @app.cli.command('worker')
+    @click.option('--once', is_flag=True, help='Exit when the queue is empty instead of waiting for jobs')
+    @click.option('--poll-interval', type=float, default=1.0, show_default=True,
+                  help='Seconds to wait between checks of an empty queue')
+    def worker_command(once, poll_interval):
+        """Run queued background jobs (bulk uploads, price list updates)"""
+        import time
+        from datetime import timedelta
+        from utils.jobs import claim_next_job, run_job, enqueue_if_due
+
+        gc_interval = app.config.get('UPLOAD_GC_INTERVAL_HOURS')
+        gc_every = timedelta(hours=float(gc_interval)) if gc_interval else None
+        next_schedule_check = 0.0
+        click.echo('Worker started, waiting for jobs' + (' (exiting when the queue is empty)' if once else ''))
+        try:
+            while True:
+                if gc_every and time.monotonic() >= next_schedule_check:
+                    # Scheduled upload clean-up; the queue itself keeps workers from doubling it up
+                    enqueue_if_due('gc_uploads', {}, gc_every)
+                    next_schedule_check = time.monotonic() + 60
+                job_id = claim_next_job()
+                if job_id is None:
+                    if once:
+                        break
+                    time.sleep(poll_interval)
+                    continue
+                started = time.perf_counter()
+                status = run_job(job_id)
+                click.echo(f'Job {job_id}: {status} in {time.perf_counter() - started:.1f}s')
+        except KeyboardInterrupt:
+            click.echo('Worker stopped')
+
     # Context processor
     @app.context_processor
     def inject_context():
         return inject_now()
     
+    # Responsive <picture>/srcset markup for uploaded images
+    from utils.images import responsive_image, image_srcset
+    app.add_template_global(responsive_image)
+    app.add_template_global(image_srcset)
+    
     # Error handlers
     @app.errorhandler(404)
     def not_found_error(error):
@@ -100,23 +318,39 @@ def create_app(config_object='config.Config'):
         app.logger.error(f'Internal Server Error: {str(error)}', exc_info=True)
         return render_template('error.html', error=str(error)), 500
     
-    # Initialize database and run schema updates
     with app.app_context():
-        # Create upload directories
-        os.makedirs(os.path.join(app.config['UPLOAD_FOLDER'], 'products'), exist_ok=True)
-        os.makedirs(os.path.join(app.config['UPLOAD_FOLDER'], 'recipes'), exist_ok=True)
+        # Per-connection SQLite settings, before anything connects
+        from utils.database import configure_engine
+        configure_engine(app)
+        
+        # Create the upload directory (content-addressed shards are created as needed)
+        os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
+        from utils.images import pillow_available
+        if not pillow_available():
+            app.logger.warning('Pillow is not installed: uploads are stored unprocessed (no resized variants, '
+                               'metadata kept, non-images accepted). Run `pip install -r requirements.txt`.')
+        
+        # Schema changes are applied by `flask migrate`, not at startup
+        from utils.migrations import warn_if_outdated
+        warn_if_outdated()
+        
+        # Track catalog writes for in-memory caches
+        from utils.catalog_version import register_catalog_version_hooks
+        register_catalog_version_hooks()
         
-        # Create all tables
-        db.create_all()
+        # Cache backend for the recipe list tables
+        from utils.response_cache import init_response_cache
+        init_response_cache(app)
         
-        # Run schema updates
-        ensure_schema_updates()
+        # Full-text search index, kept current by session hooks
+        from utils.search import register_search_hooks
+        register_search_hooks()
     
     return app
 
 
-# Create the app instance
-app = create_app()
+# Create the app instance (APP_CONFIG=config.ProductionConfig under gunicorn)
+app = create_app(os.environ.get('APP_CONFIG', 'config.Config'))
 
 if __name__ == '__main__':
     app.run(debug=True, port=5001)
@@ -0,0 +1,90 @@
+"""
+Synthetic catalog for benchmarks
+Creates a throwaway SQLite database and fills it with products, secondary
+ingredients and recipes using Core executemany inserts. Import this module
+before anything that imports app.py, since the app reads DATABASE_URL once.
+"""
+import os
+import random
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+BENCH_DIR = tempfile.mkdtemp(prefix='bar_bench_')
+BENCH_DB = os.path.join(BENCH_DIR, 'bench.db')
+os.environ['DATABASE_URL'] = f'sqlite:///{BENCH_DB}'
+
+from app import app  # noqa: E402
+from extensions import db  # noqa: E402
+from models import User, Product, HomemadeIngredient, HomemadeIngredientItem, Recipe, RecipeIngredient  # noqa: E402
+from utils.migrations import run_migrations  # noqa: E402
+
+with app.app_context():
+    run_migrations()
+
+UNITS = ['ml', 'ml', 'grams', 'pieces', 'each']
+SUB_CATEGORIES = ['Alcohol', 'Juice', 'Syrup', 'Dairy', 'Fruits', 'Non-Alcohol']
+
+
+def build_catalog(products=50000, secondaries=2000, recipes=10000, lines_per_recipe=5,
+                  nested_share=0.1, seed=42):
+    """Fill the benchmark database; returns the (product, secondary, recipe) counts"""
+    rng = random.Random(seed)
+    with app.app_context():
+        db.session.execute(db.insert(User), [{'id': 1, 'username': 'bench', 'email': 'bench@example.com', 'password': 'x'}])
+        db.session.execute(db.insert(Product), [
+            {
+                'id': i,
+                'unique_item_number': f'ITEM-{i:06d}',
+                'barbuddy_code': f'BB{i:03d}',
+                'description': f'Product {i}',
+                'supplier': f'Supplier {i % 50}',
+                'category': 'Product',
+                'sub_category': rng.choice(SUB_CATEGORIES),
+                'item_level': 'Primary',
+                'selling_unit': rng.choice(UNITS),
+                'ml_in_bottle': rng.choice([None, 700.0, 750.0, 1000.0]),
+                'cost_per_unit': round(rng.uniform(0.01, 250), 2),
+            }
+            for i in range(1, products + 1)
+        ])
+        db.session.execute(db.insert(HomemadeIngredient), [
+            {'id': i, 'name': f'Secondary {i}', 'unique_code': f'SEC-{i:04d}', 'created_by': 1,
+             'total_volume_ml': rng.choice([500.0, 1000.0]), 'unit': 'ml'}
+            for i in range(1, secondaries + 1)
+        ])
+        items = []
+        for homemade_id in range(1, secondaries + 1):
+            for product_id in rng.sample(range(1, products + 1), 4):
+                qty = round(rng.uniform(10, 300), 1)
+                items.append({'homemade_id': homemade_id, 'product_id': product_id,
+                              'quantity': qty, 'quantity_ml': qty, 'unit': 'ml'})
+        db.session.execute(db.insert(HomemadeIngredientItem), items)
+        db.session.execute(db.insert(Recipe), [
+            {'id': i, 'recipe_code': f'REC-{i:04d}', 'title': f'Recipe {i}', 'user_id': 1,
+             'recipe_type': 'Beverage', 'type': rng.choice(['Cocktails', 'Mocktails', 'Beverages']),
+             'item_level': 'Primary', 'selling_price': rng.choice([0.0, 45.0, 55.0, 65.0]),
+             'vat_percentage': 5.0, 'service_charge_percentage': 10.0, 'government_fees_percentage': 0.0}
+            for i in range(1, recipes + 1)
+        ])
+        lines = []
+        for recipe_id in range(1, recipes + 1):
+            for _ in range(lines_per_recipe - 1):
+                product_id = rng.randint(1, products)
+                lines.append({'recipe_id': recipe_id, 'ingredient_type': 'Product', 'ingredient_id': product_id,
+                              'product_type': 'Product', 'product_id': product_id,
+                              'quantity': round(rng.uniform(5, 60), 1), 'unit': 'ml'})
+            if recipe_id > 1 and rng.random() < nested_share:
+                # Nest an earlier recipe so the graph stays acyclic
+                child_id = rng.randint(1, recipe_id - 1)
+                lines.append({'recipe_id': recipe_id, 'ingredient_type': 'Recipe', 'ingredient_id': child_id,
+                              'product_type': 'Recipe', 'product_id': child_id, 'quantity': 1.0, 'unit': 'each'})
+            else:
+                homemade_id = rng.randint(1, secondaries)
+                lines.append({'recipe_id': recipe_id, 'ingredient_type': 'Homemade', 'ingredient_id': homemade_id,
+                              'product_type': 'Homemade', 'product_id': homemade_id,
+                              'quantity': round(rng.uniform(5, 30), 1), 'unit': 'ml'})
+        db.session.execute(db.insert(RecipeIngredient), lines)
+        db.session.commit()
+    return products, secondaries, recipes
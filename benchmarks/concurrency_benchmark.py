@@ -0,0 +1,116 @@
+"""
+Concurrency benchmark
+Forks N worker processes against one SQLite database, as gunicorn does, and
+has each run a mix of master list page reads and product price edits for a
+fixed time. Reports throughput, p95 latency and "database is locked" errors
+for the default Config and for ProductionConfig at each worker count.
+
+    python benchmarks/concurrency_benchmark.py --workers 1 2 4 8 --seconds 10 --write-share 0.2
+"""
+import argparse
+import multiprocessing
+import random
+import sqlite3
+import time
+
+from catalog import app, db, build_catalog, BENCH_DB
+
+PROFILES = ['config.Config', 'config.ProductionConfig']
+
+
+def worker(profile, seconds, write_share, products, seed, results):
+    """One gunicorn-like worker: its own app and engine, a logged-in client and a read/write loop"""
+    from sqlalchemy.exc import OperationalError
+    from app import create_app
+    from models import Product
+    from utils.cost_cache import refresh_costs
+
+    worker_app = create_app(profile)
+    client = worker_app.test_client()
+    with client.session_transaction() as session:
+        session['_user_id'] = '1'
+    rng = random.Random(seed)
+    counts = {'reads': 0, 'writes': 0, 'locked': 0}
+    timings = []
+    deadline = time.perf_counter() + seconds
+    with worker_app.app_context():
+        while time.perf_counter() < deadline:
+            started = time.perf_counter()
+            if rng.random() < write_share:
+                try:
+                    product = db.session.get(Product, rng.randint(1, products))
+                    product.cost_per_unit = round(rng.uniform(0.01, 250), 2)
+                    refresh_costs(product_ids=[product.id])
+                    db.session.commit()
+                    counts['writes'] += 1
+                except OperationalError as exc:
+                    db.session.rollback()
+                    if 'locked' not in str(exc):
+                        raise
+                    counts['locked'] += 1
+                    continue
+            else:
+                response = client.get(f'/ingredients?page={rng.randint(1, 20)}')
+                if response.status_code != 200:
+                    # The view logs and flashes the error; locked reads surface as a non-200 page
+                    counts['locked'] += 1
+                    continue
+                counts['reads'] += 1
+            timings.append((time.perf_counter() - started) * 1000)
+    results.put((counts, timings))
+
+
+def run(profile, workers, seconds, write_share, products):
+    if profile == 'config.Config':
+        # WAL mode is stored in the database file, so undo it for the baseline
+        with sqlite3.connect(BENCH_DB) as conn:
+            conn.execute('PRAGMA journal_mode = DELETE')
+    with app.app_context():
+        # Forked workers must not share the parent's pooled connections
+        db.engine.dispose()
+    context = multiprocessing.get_context('fork')
+    results = context.Queue()
+    processes = [context.Process(target=worker, args=(profile, seconds, write_share, products, seed, results))
+                 for seed in range(workers)]
+    for process in processes:
+        process.start()
+    collected = [results.get() for _ in processes]
+    for process in processes:
+        process.join()
+
+    totals = {'reads': 0, 'writes': 0, 'locked': 0}
+    timings = []
+    for counts, worker_timings in collected:
+        for key in totals:
+            totals[key] += counts[key]
+        timings.extend(worker_timings)
+    timings.sort()
+    p95 = timings[int(len(timings) * 0.95)] if timings else 0.0
+    print(f"{profile.split('.')[-1]:<17} {workers:>7} {totals['reads'] / seconds:>9.0f} {totals['writes'] / seconds:>9.1f}"
+          f" {p95:>9.1f} {totals['locked']:>7}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--products', type=int, default=20000)
+    parser.add_argument('--secondaries', type=int, default=1000)
+    parser.add_argument('--recipes', type=int, default=5000)
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4, 8])
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--write-share', type=float, default=0.2)
+    args = parser.parse_args()
+
+    build_catalog(products=args.products, secondaries=args.secondaries, recipes=args.recipes)
+    from utils.cost_cache import backfill_cost_cache
+    with app.app_context():
+        backfill_cost_cache()
+        db.session.commit()
+
+    print(f"{'profile':<17} {'workers':>7} {'reads/s':>9} {'writes/s':>9} {'p95 ms':>9} {'locked':>7}")
+    for workers in args.workers:
+        for profile in PROFILES:
+            run(profile, workers, args.seconds, args.write_share, args.products)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,46 @@
+"""
+Export benchmark
+Builds a large catalog and streams the master list and recipe exports in
+both formats, reporting rows, bytes, time and peak Python memory, which
+should stay flat however many rows are exported.
+
+    python benchmarks/export_benchmark.py --products 100000 --recipes 20000
+"""
+import argparse
+import time
+import tracemalloc
+
+from catalog import app, build_catalog
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--products', type=int, default=100000)
+    parser.add_argument('--secondaries', type=int, default=2000)
+    parser.add_argument('--recipes', type=int, default=20000)
+    parser.add_argument('--formats', default='csv,xlsx')
+    args = parser.parse_args()
+
+    build_catalog(products=args.products, secondaries=args.secondaries, recipes=args.recipes)
+
+    from utils.exports import master_list_export, recipe_export, csv_stream, xlsx_stream
+
+    writers = {'csv': csv_stream, 'xlsx': xlsx_stream}
+    with app.app_context():
+        for name, make_dataset in (('master list', master_list_export), ('recipes', recipe_export)):
+            for fmt in args.formats.split(','):
+                dataset = make_dataset()
+                tracemalloc.start()
+                started = time.perf_counter()
+                size = 0
+                for chunk in writers[fmt](dataset):
+                    size += len(chunk)
+                elapsed = time.perf_counter() - started
+                _, peak = tracemalloc.get_traced_memory()
+                tracemalloc.stop()
+                print(f"{name:<12} {fmt:<5} {size / 1e6:>7.1f} MB in {elapsed:.1f}s, "
+                      f"peak memory {peak / 1e6:.1f} MB")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,95 @@
+"""
+Bulk product import benchmark
+Writes the same --rows products (a few duplicates and invalid rows mixed in)
+as .xlsx, .csv and .parquet, then for each format times reading the file
+alone and a full import into a catalog that already holds --existing
+products. Imported rows are deleted between formats.
+
+    python benchmarks/import_benchmark.py --rows 100000 --existing 20000 --formats xlsx,csv,parquet
+"""
+import argparse
+import csv
+import os
+import random
+import time
+
+from catalog import app, db, build_catalog, BENCH_DIR, Product, SUB_CATEGORIES
+
+HEADER = ['UNIQUE ITEM #', 'CODE', 'DESCRIPTION', 'SUPPLIER', 'CATEGORY', 'SUB CATEGORY', 'QUANTITY',
+          'COST/UNIT (AED)']
+
+
+def sample_rows(count, existing, seed=7):
+    """Spreadsheet rows; every 1000th reuses an existing code and every 5000th is invalid"""
+    rng = random.Random(seed)
+    for i in range(1, count + 1):
+        code = f'BB{rng.randint(1, existing):03d}' if existing and i % 1000 == 0 else f'SUP-{i:06d}'
+        description = '' if i % 5000 == 0 else f'Imported product {i}'
+        yield [f'U-{i:07d}', code, description, f'Supplier {i % 40}', 'Product', rng.choice(SUB_CATEGORIES),
+               rng.choice([None, 700.0, 1000.0]), round(rng.uniform(0.5, 200), 2)]
+
+
+def write_workbook(path, rows):
+    from openpyxl import Workbook
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet()
+    sheet.append(HEADER)
+    for row in rows:
+        sheet.append(row)
+    workbook.save(path)
+
+
+def write_csv(path, rows):
+    with open(path, 'w', newline='', encoding='utf-8') as handle:
+        writer = csv.writer(handle)
+        writer.writerow(HEADER)
+        writer.writerows(rows)
+
+
+def write_parquet(path, rows):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    columns = list(zip(*rows))
+    pq.write_table(pa.table({name: list(values) for name, values in zip(HEADER, columns)}), path,
+                   row_group_size=10000)
+
+
+WRITERS = {'xlsx': write_workbook, 'csv': write_csv, 'parquet': write_parquet}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=100000)
+    parser.add_argument('--existing', type=int, default=20000)
+    parser.add_argument('--formats', default='xlsx,csv,parquet')
+    args = parser.parse_args()
+
+    build_catalog(products=args.existing, secondaries=100, recipes=100)
+
+    from utils.product_import import import_products, read_sheet
+
+    for fmt in args.formats.split(','):
+        path = os.path.join(BENCH_DIR, f'import.{fmt}')
+        WRITERS[fmt](path, list(sample_rows(args.rows, args.existing)))
+
+        with app.test_request_context():
+            started = time.perf_counter()
+            with open(path, 'rb') as handle:
+                _, rows, _ = read_sheet(handle, path)
+                count = sum(1 for _ in rows)
+            read_time = time.perf_counter() - started
+
+            started = time.perf_counter()
+            with open(path, 'rb') as handle:
+                report = import_products(handle, path)
+            elapsed = time.perf_counter() - started
+            print(f"{fmt:>8}: read {count} rows in {read_time:.1f}s ({count / read_time:,.0f} rows/s); "
+                  f"import {elapsed:.1f}s ({report.created / elapsed:,.0f} rows/s), "
+                  f"{report.created} created, {report.skipped} skipped")
+
+            db.session.execute(db.delete(Product).where(Product.id > args.existing))
+            db.session.commit()
+
+
+if __name__ == '__main__':
+    main()
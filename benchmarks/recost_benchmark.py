@@ -0,0 +1,53 @@
+"""
+Whole-catalog recost benchmark
+Compares the per-object path (Recipe.calculate_total_cost / cost_percentage
+through the ORM) with the vectorized engine in utils/recost.py.
+
+    python benchmarks/recost_benchmark.py --products 50000 --recipes 10000
+"""
+import argparse
+import time
+
+from catalog import app, db, build_catalog, Recipe
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--products', type=int, default=50000)
+    parser.add_argument('--secondaries', type=int, default=2000)
+    parser.add_argument('--recipes', type=int, default=10000)
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    build_catalog(products=args.products, secondaries=args.secondaries, recipes=args.recipes)
+    print(f"Built catalog: {args.products} products, {args.secondaries} secondary, "
+          f"{args.recipes} recipes in {time.perf_counter() - started:.1f}s")
+
+    from utils.recost import recost_catalog
+
+    with app.app_context():
+        started = time.perf_counter()
+        expected = {}
+        for recipe in Recipe.query.all():
+            expected[recipe.id] = (recipe.calculate_total_cost(), recipe.cost_percentage())
+        per_object = time.perf_counter() - started
+        print(f"Per-object ORM path: {per_object:.2f}s")
+        db.session.rollback()
+        db.session.expunge_all()
+
+        started = time.perf_counter()
+        counts = recost_catalog()
+        db.session.commit()
+        vectorized = time.perf_counter() - started
+        print(f"Vectorized recost (incl. bulk write of {counts['recipes']} recipes): {vectorized:.2f}s "
+              f"({per_object / vectorized:.0f}x faster)")
+
+        mismatches = sum(
+            1 for rid, total, pct in db.session.query(Recipe.id, Recipe.cached_total_cost, Recipe.cached_cost_percentage)
+            if expected[rid] != (total, pct)
+        )
+        print(f"Recipes differing from the per-object path: {mismatches}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,54 @@
+"""
+Full-text search benchmark
+Builds a catalog of ~100k searchable documents, indexes it and reports
+latency percentiles for typical typeahead and multi-word queries.
+
+    python benchmarks/search_benchmark.py --products 80000 --secondaries 5000 --recipes 15000
+"""
+import argparse
+import random
+import time
+
+from catalog import app, db, build_catalog
+
+
+QUERIES = ['pro', 'product 12', 'product 4821', 'supplier 7', 'sec', 'secondary 31', 'recipe 99',
+           'bb012', 'item-00', 'rec-01', 'product supplier 3', 'zzz']
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--products', type=int, default=80000)
+    parser.add_argument('--secondaries', type=int, default=5000)
+    parser.add_argument('--recipes', type=int, default=15000)
+    parser.add_argument('--runs', type=int, default=200)
+    args = parser.parse_args()
+
+    build_catalog(products=args.products, secondaries=args.secondaries, recipes=args.recipes)
+
+    from utils.search import rebuild_search_index, search
+
+    with app.app_context():
+        started = time.perf_counter()
+        count = rebuild_search_index()
+        db.session.commit()
+        print(f"Indexed {count} documents in {time.perf_counter() - started:.1f}s")
+
+        rng = random.Random(1)
+        timings = []
+        for _ in range(args.runs):
+            query = rng.choice(QUERIES)
+            started = time.perf_counter()
+            search(query)
+            timings.append((time.perf_counter() - started) * 1000)
+        timings.sort()
+        print(f"{args.runs} searches: p50 {timings[len(timings) // 2]:.2f} ms, "
+              f"p95 {timings[int(len(timings) * 0.95)]:.2f} ms, max {timings[-1]:.2f} ms")
+        for query in QUERIES:
+            started = time.perf_counter()
+            results = search(query)
+            print(f"  {query!r:<22} {len(results):>3} results  {(time.perf_counter() - started) * 1000:.2f} ms")
+
+
+if __name__ == '__main__':
+    main()
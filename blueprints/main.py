@@ -1,7 +1,12 @@
 """
 Main blueprint - handles index, errors, and file uploads
 """
-from flask import Blueprint, render_template, send_from_directory, current_app
+from flask import Blueprint, render_template, send_from_directory, current_app, request, jsonify, url_for
+from flask_login import login_required, current_user
+from utils.search import search, DEFAULT_LIMIT, MAX_LIMIT
+from utils.file_upload import CONTENT_ADDRESSED
+
+IMMUTABLE_MAX_AGE = 365 * 24 * 60 * 60
 
 main_bp = Blueprint('main', __name__)
 
@@ -13,8 +18,47 @@ def index():
 
 @main_bp.route('/uploads/<path:filename>')
 def uploaded_file(filename):
-    """Serve uploaded files"""
-    return send_from_directory(current_app.config['UPLOAD_FOLDER'], filename)
+    """Serve uploaded files; content-addressed ones never change and are cached for a year"""
+    match = CONTENT_ADDRESSED.match(filename)
+    if not match:
+        return send_from_directory(current_app.config['UPLOAD_FOLDER'], filename)
+    # The hash (plus variant suffix) identifies the bytes, so it is a strong ETag
+    response = send_from_directory(current_app.config['UPLOAD_FOLDER'], filename,
+                                   etag=''.join(match.groups()), max_age=IMMUTABLE_MAX_AGE)
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    return response
+
+
+@main_bp.route('/search')
+@login_required
+def search_catalog():
+    """Ranked full-text search over products, secondary ingredients and recipes (JSON)"""
+    limit = min(max(request.args.get('limit', DEFAULT_LIMIT, type=int), 1), MAX_LIMIT)
+    results = search(request.args.get('q', ''), kind=request.args.get('type') or None, limit=limit)
+    endpoints = {
+        'Product': 'products.edit_ingredient',
+        'Secondary': 'secondary.view_secondary_ingredient',
+        'Recipe': 'recipes.view_recipe',
+    }
+    for result in results:
+        result['url'] = url_for(endpoints[result['type']], id=result['id'])
+    return jsonify({'results': results})
+
+
+@main_bp.route('/jobs/<int:id>')
+@login_required
+def job_status(id):
+    """Progress of a background job started by the current user (JSON, for polling)"""
+    from extensions import db
+    from models import Job
+    from utils.jobs import job_state
+    job = db.session.get(Job, id)
+    if not job or job.created_by != current_user.id:
+        return jsonify({'error': 'Job not found'}), 404
+    response = jsonify(job_state(job))
+    response.headers['Cache-Control'] = 'no-store'
+    return response
 
 
 @main_bp.errorhandler(404)
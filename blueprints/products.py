@@ -2,14 +2,23 @@
 Products/Ingredients Master List Blueprint
 Handles all product and ingredient master list routes
 """
-from flask import Blueprint, render_template, redirect, url_for, request, flash, current_app
-from flask_login import login_required
+from flask import Blueprint, render_template, redirect, url_for, request, flash, current_app, jsonify
+from flask_login import login_required, current_user
 from extensions import db
-from models import Product, HomemadeIngredient
-from utils.db_helpers import ensure_schema_updates
-from utils.file_upload import save_uploaded_file
+from models import Product
+from utils.file_upload import save_uploaded_file, remove_upload_files
+from utils.cost_cache import refresh_costs
+from utils.where_used import where_used
+from utils.master_list import master_list_page, SORT_COLUMNS, DEFAULT_PER_PAGE, MAX_PER_PAGE
+from utils.ingredient_catalog import ingredient_catalog, DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE
+from utils.product_import import diff_price_list, ProductImportError, SUPPORTED_EXTENSIONS
+from utils.jobs import enqueue
+from utils.exports import master_list_export, export_response
+from utils.product_delete import delete_products
+from utils.code_sequences import allocate_code
 import uuid
 import os
+import re
 
 products_bp = Blueprint('products', __name__)
 
@@ -24,7 +33,6 @@ def products():
 @login_required
 def add_product():
     if request.method == 'POST':
-        ensure_schema_updates()
         description = request.form['description']
         supplier = request.form.get('supplier', '').strip() or 'N/A'
         category = request.form['category']
@@ -42,21 +50,18 @@ def add_product():
             if Product.query.filter_by(unique_item_number=unique_item_number).first():
                 flash('Unique item number already exists. Please use a different value.')
                 return redirect(url_for('products.add_product'))
-        else:
-            unique_item_number = f"ITEM-{uuid.uuid4().hex[:8].upper()}"
-
-        latest_product = Product.query.order_by(Product.id.desc()).first()
-        if latest_product and latest_product.barbuddy_code and latest_product.barbuddy_code[2:].isdigit():
-            next_number = int(latest_product.barbuddy_code[2:]) + 1
-        else:
-            next_number = 1
-        barbuddy_code = f"BB{next_number:03d}"
 
         image_path = None
         if 'image' in request.files:
             file = request.files['image']
             if file.filename:
-                image_path = save_uploaded_file(file, 'products')
+                image_path = save_uploaded_file(file)
+
+        # Codes are reserved after the upload is stored, so the write
+        # transaction they open is not held while the file is hashed
+        if not unique_item_number:
+            unique_item_number = allocate_code('ITEM')
+        barbuddy_code = allocate_code('BB')
 
         product = Product(
             unique_item_number=unique_item_number,
@@ -76,6 +81,8 @@ def add_product():
         )
 
         db.session.add(product)
+        db.session.flush()
+        refresh_costs(product_ids=[product.id])
         db.session.commit()
         flash('Product added successfully!')
         return redirect(url_for('products.products'))
@@ -88,63 +95,49 @@ def ingredients_master():
     try:
         category_filter = request.args.get('category', '')
         level_filter = request.args.get('level', '')
-        products = Product.query.all()
-        secondary_items = HomemadeIngredient.query.all()
-
-        rows = []
-        for p in products:
-            rows.append({
-                'id': p.id,
-                'kind': 'product',
-                'image': p.image_path,
-                'unique_item_number': p.unique_item_number or 'N/A',
-                'code': p.barbuddy_code or 'N/A',
-                'description': p.description,
-                'supplier': p.supplier or 'N/A',
-                'category': p.category or 'Product',
-                'sub_category': p.sub_category or 'Other',
-                'item_level': p.item_level or 'Primary',
-                'quantity': p.ml_in_bottle,
-                'cost_per_unit': p.cost_per_unit or 0.0
-            })
-
-        for sec in secondary_items:
-            rows.append({
-                'id': sec.id,
-                'kind': 'secondary',
-                'image': None,
-                'unique_item_number': sec.unique_code or 'N/A',
-                'code': sec.unique_code or 'N/A',
-                'description': sec.name,
-                'supplier': 'In-House',
-                'category': 'Secondary',
-                'sub_category': 'Secondary Ingredient',
-                'item_level': 'Secondary',
-                'quantity': sec.total_volume_ml,
-                'cost_per_unit': sec.calculate_cost_per_unit()
-            })
-
-        if category_filter:
-            rows = [r for r in rows if (r['sub_category'] or '').lower() == category_filter.lower()]
-        if level_filter:
-            rows = [r for r in rows if (r['item_level'] or 'Primary') == level_filter]
+        search = request.args.get('q', '').strip()
+        sort = request.args.get('sort', 'description')
+        if sort not in SORT_COLUMNS:
+            sort = 'description'
+        direction = 'desc' if request.args.get('dir') == 'desc' else 'asc'
+        per_page = min(max(request.args.get('per_page', DEFAULT_PER_PAGE, type=int), 1), MAX_PER_PAGE)
+        page = master_list_page(
+            category=category_filter, level=level_filter, search=search, sort=sort, direction=direction,
+            after=request.args.get('after'), before=request.args.get('before'), per_page=per_page
+        )
 
         categories = db.session.query(Product.sub_category).distinct().all()
         categories = [c[0] for c in categories if c[0]]
         default_categories = ['Alcohol', 'Non Alcohol', 'Non-Alcohol', 'Fruits', 'Vegetables', 'Dairy', 'Syrups & Purees', 'Syrup', 'Puree', 'Juice', 'Other', 'Food', 'Beverage', 'Secondary Ingredient']
         categories = sorted(set(categories + default_categories))
-        return render_template('master_list/master.html', rows=rows, categories=categories, selected_category=category_filter, selected_level=level_filter)
+        return render_template('master_list/master.html', rows=page.rows, page=page, categories=categories,
+                               selected_category=category_filter, selected_level=level_filter,
+                               search=search, sort=sort, direction=direction, per_page=per_page,
+                               job_id=request.args.get('job', type=int))
     except Exception as e:
         flash(f'Error loading ingredients: {str(e)}')
         current_app.logger.error(f'Error in ingredients_master: {str(e)}', exc_info=True)
-        return render_template('master_list/master.html', rows=[], categories=[], selected_category='', selected_level='')
+        return render_template('master_list/master.html', rows=[], page=None, categories=[], selected_category='',
+                               selected_level='', search='', sort='description', direction='asc',
+                               per_page=DEFAULT_PER_PAGE, job_id=None)
+
+
+@products_bp.route('/ingredients/export.<any(csv, xlsx):fmt>')
+@login_required
+def export_ingredients(fmt):
+    """Download the master list, with the page's filters and sort, as CSV or XLSX"""
+    dataset = master_list_export(
+        category=request.args.get('category', ''), level=request.args.get('level', ''),
+        search=request.args.get('q', ''), sort=request.args.get('sort', 'description'),
+        direction='desc' if request.args.get('dir') == 'desc' else 'asc',
+    )
+    return export_response(dataset, fmt, 'master-list')
 
 
 @products_bp.route('/ingredients/add', methods=['GET', 'POST'])
 @login_required
 def add_ingredient():
     if request.method == 'POST':
-        ensure_schema_updates()
         unique_item_number = (request.form.get('unique_item_number', '') or '').strip()
         description = request.form['description']
         supplier = request.form.get('supplier', '').strip() or 'N/A'
@@ -162,21 +155,18 @@ def add_ingredient():
             if Product.query.filter_by(unique_item_number=unique_item_number).first():
                 flash('Unique item number already exists. Please use a different one.')
                 return redirect(url_for('products.ingredients_master'))
-        else:
-            unique_item_number = f"ITEM-{uuid.uuid4().hex[:8].upper()}"
-
-        latest_product = Product.query.order_by(Product.id.desc()).first()
-        if latest_product and latest_product.barbuddy_code and latest_product.barbuddy_code[2:].isdigit():
-            next_number = int(latest_product.barbuddy_code[2:]) + 1
-        else:
-            next_number = 1
-        barbuddy_code = f"BB{next_number:03d}"
 
         image_path = None
         if 'image' in request.files:
             file = request.files['image']
             if file.filename:
-                image_path = save_uploaded_file(file, 'products')
+                image_path = save_uploaded_file(file)
+
+        # Codes are reserved after the upload is stored, so the write
+        # transaction they open is not held while the file is hashed
+        if not unique_item_number:
+            unique_item_number = allocate_code('ITEM')
+        barbuddy_code = allocate_code('BB')
 
         product = Product(
             unique_item_number=unique_item_number,
@@ -196,6 +186,8 @@ def add_ingredient():
         )
 
         db.session.add(product)
+        db.session.flush()
+        refresh_costs(product_ids=[product.id])
         db.session.commit()
         flash('Ingredient added successfully!')
         return redirect(url_for('products.ingredients_master'))
@@ -219,43 +211,85 @@ def edit_ingredient(id):
         product.purchase_type = request.form.get('purchase_type', 'each')
         product.bottles_per_case = int(request.form.get('bottles_per_case', 1) or 1)
         
+        old_image_path = None
         if 'image' in request.files:
             file = request.files['image']
             if file.filename:
-                if product.image_path:
-                    old_path = os.path.join(current_app.config['UPLOAD_FOLDER'], product.image_path)
-                    if os.path.exists(old_path):
-                        os.remove(old_path)
-                product.image_path = save_uploaded_file(file, 'products')
+                image_path = save_uploaded_file(file)
+                if image_path:
+                    old_image_path, product.image_path = product.image_path, image_path
         
+        # Recost every secondary ingredient and recipe using this product in the same transaction
+        refresh_costs(product_ids=[product.id])
         db.session.commit()
+        if old_image_path:
+            remove_upload_files([old_image_path])
         flash('Ingredient updated successfully!')
         return redirect(url_for('products.ingredients_master'))
     return render_template('master_list/edit.html', product=product)
 
 
+@products_bp.route('/ingredients/<int:id>/where-used')
+@login_required
+def ingredient_where_used(id):
+    """Secondary ingredients and recipes affected by a change to this product"""
+    product = Product.query.get_or_404(id)
+    return jsonify(where_used(product))
+
+
+@products_bp.route('/ingredients/options')
+@login_required
+def ingredient_options():
+    """
+    Typeahead for the recipe and secondary ingredient forms: one page of
+    options whose code or description words start with ?q=, optionally only
+    ?type=Product or Secondary. Revalidates with the catalog version as ETag.
+    """
+    catalog = ingredient_catalog()
+    if request.if_none_match.contains(catalog.etag):
+        response = current_app.response_class(status=304)
+    else:
+        ingredient_type = request.args.get('type') or None
+        offset = max(request.args.get('offset', 0, type=int), 0)
+        limit = min(max(request.args.get('limit', DEFAULT_PAGE_SIZE, type=int), 1), MAX_PAGE_SIZE)
+        options, has_more = catalog.search(request.args.get('q', ''), ingredient_type, offset, limit)
+        response = jsonify({
+            'options': options,
+            'next_offset': offset + len(options) if has_more else None,
+        })
+    response.set_etag(catalog.etag)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
+
 @products_bp.route('/ingredients/<int:id>/delete', methods=['POST'])
 @login_required
 def delete_ingredient(id):
     product = Product.query.get_or_404(id)
-    db.session.delete(product)
+    report = delete_products([product.id], user_id=current_user.id)
     db.session.commit()
-    flash('Ingredient deleted successfully!')
+    if report.blocked:
+        flash(f'{product.description} was not deleted because it is still in use.', 'error')
+        _flash_blocked(report)
+    else:
+        flash('Ingredient deleted successfully!')
     return redirect(url_for('products.ingredients_master'))
 
 
+def _flash_blocked(report):
+    for line in report.blocked_lines(limit=10):
+        flash(line, 'error')
+
+
 @products_bp.route('/ingredients/delete-all', methods=['POST'])
 @login_required
 def delete_all_ingredients():
     try:
-        ensure_schema_updates()
-        # Delete all products (not secondary ingredients)
-        products = Product.query.all()
-        count = len(products)
-        for product in products:
-            db.session.delete(product)
+        # Delete all products (not secondary ingredients) that nothing uses
+        report = delete_products(user_id=current_user.id)
         db.session.commit()
-        flash(f'Successfully deleted {count} product(s) from the master list.')
+        flash(report.summary())
+        _flash_blocked(report)
     except Exception as e:
         db.session.rollback()
         current_app.logger.error(f'Error deleting all ingredients: {str(e)}', exc_info=True)
@@ -267,24 +301,20 @@ def delete_all_ingredients():
 @login_required
 def delete_selected_ingredients():
     try:
-        ensure_schema_updates()
-        selected_ids = request.form.getlist('selected_items')
-        if not selected_ids:
-            flash('No items selected for deletion.', 'error')
-            return redirect(url_for('products.ingredients_master'))
-        
-        count = 0
-        for item_id in selected_ids:
+        selected_ids = []
+        for item_id in request.form.getlist('selected_items'):
             try:
-                product = Product.query.get(int(item_id))
-                if product:
-                    db.session.delete(product)
-                    count += 1
+                selected_ids.append(int(item_id))
             except (ValueError, TypeError):
                 continue
-        
+        if not selected_ids:
+            flash('No items selected for deletion.', 'error')
+            return redirect(url_for('products.ingredients_master'))
+
+        report = delete_products(selected_ids, user_id=current_user.id)
         db.session.commit()
-        flash(f'Successfully deleted {count} selected product(s) from the master list.')
+        flash(report.summary())
+        _flash_blocked(report)
     except Exception as e:
         db.session.rollback()
         current_app.logger.error(f'Error deleting selected ingredients: {str(e)}', exc_info=True)
@@ -297,118 +327,72 @@ def delete_selected_ingredients():
 def bulk_upload_products():
     file = request.files.get('file')
     if not file or file.filename == '':
-        flash('Please choose an Excel file to upload.')
+        flash('Please choose a file to upload.')
         return redirect(url_for('products.ingredients_master'))
 
-    if not file.filename.lower().endswith(('.xlsx', '.xls')):
-        flash('Only .xlsx or .xls files are supported for bulk upload.')
+    if not file.filename.lower().endswith(SUPPORTED_EXTENSIONS):
+        flash(f'Only {", ".join(SUPPORTED_EXTENSIONS)} files are supported for bulk upload.')
         return redirect(url_for('products.ingredients_master'))
 
-    try:
-        import pandas as pd
-    except ImportError:
-        flash('Pandas is required for bulk upload. Please install it via pip install pandas openpyxl.')
-        return redirect(url_for('products.ingredients_master'))
+    # The file is kept until a worker has imported it, or the preview is confirmed or cancelled
+    extension = os.path.splitext(file.filename)[1].lower()
+    upload = f'{uuid.uuid4().hex}{extension}'
+    os.makedirs(current_app.config['IMPORT_FOLDER'], exist_ok=True)
+    file.save(_pending_upload_path(upload))
 
-    try:
-        df = pd.read_excel(file)
-    except Exception as exc:
-        flash(f'Failed to read Excel file: {exc}')
-        return redirect(url_for('products.ingredients_master'))
+    if request.form.get('mode') == 'update':
+        return _price_list_preview(upload, file.filename)
 
-    required_columns = ['DESCRIPTION', 'SUPPLIER', 'CATEGORY', 'COST/UNIT (AED)']
-    normalized_columns = {str(col).upper().strip(): col for col in df.columns}
-    missing = [col for col in required_columns if col not in normalized_columns]
-    if missing:
-        flash(f'Missing required columns: {", ".join(missing)}')
-        return redirect(url_for('products.ingredients_master'))
+    job = enqueue('import_products', {'path': _pending_upload_path(upload), 'filename': file.filename},
+                  user_id=current_user.id)
+    db.session.commit()
+    flash('Upload received. The products are being imported in the background.')
+    return redirect(url_for('products.ingredients_master', job=job.id))
 
-    def clean_str(value, default=''):
-        if pd.isna(value) or value is None:
-            return default
-        return str(value).strip()
 
-    created = 0
-    skipped = 0
-    base_count = Product.query.count()
+PENDING_UPLOAD = re.compile(r'^[0-9a-f]{32}\.(xlsx|xls|csv|parquet)$')
+PREVIEW_ROWS = 100
 
-    for idx, row in df.iterrows():
-        try:
-            description = clean_str(row[normalized_columns['DESCRIPTION']])
-            if not description:
-                skipped += 1
-                continue
 
-            supplier = clean_str(row[normalized_columns['SUPPLIER']], 'N/A') or 'N/A'
-            category = clean_str(row[normalized_columns['CATEGORY']])
-            if not category:
-                category = 'Other'
+def _pending_upload_path(upload):
+    return os.path.join(current_app.config['IMPORT_FOLDER'], upload)
 
-            sub_cat_col = normalized_columns.get('SUB CATEGORY')
-            sub_category = clean_str(row.get(sub_cat_col), 'Other') if sub_cat_col else 'Other'
 
-            item_level_col = normalized_columns.get('ITEM LEVEL')
-            item_level = clean_str(row.get(item_level_col), 'Primary') if item_level_col else 'Primary'
-            if item_level.lower() not in ('primary', 'secondary'):
-                item_level = 'Primary'
+def _discard_pending_upload(upload):
+    try:
+        os.remove(_pending_upload_path(upload))
+    except OSError:
+        pass
 
-            unit_col = normalized_columns.get('UNIT')
-            unit = clean_str(row.get(unit_col), 'each') if unit_col else 'each'
-
-            cost_per_unit = row[normalized_columns['COST/UNIT (AED)']]
-            try:
-                cost_per_unit = float(cost_per_unit or 0)
-            except (TypeError, ValueError):
-                cost_per_unit = 0.0
-
-            unique_col = normalized_columns.get('UNIQUE ITEM #')
-            unique_item_number = clean_str(row.get(unique_col)) if unique_col else ''
-            if unique_item_number and Product.query.filter_by(unique_item_number=unique_item_number).first():
-                unique_item_number = ''
-
-            code_col = normalized_columns.get('CODE')
-            barbuddy_code = clean_str(row.get(code_col)) if code_col else ''
-            if barbuddy_code and Product.query.filter_by(barbuddy_code=barbuddy_code).first():
-                barbuddy_code = ''
-
-            quantity_col = normalized_columns.get('QUANTITY')
-            quantity_value = row.get(quantity_col)
-            try:
-                ml_in_bottle = float(quantity_value) if quantity_value is not None and not pd.isna(quantity_value) else None
-            except (TypeError, ValueError):
-                ml_in_bottle = None
-
-            if not unique_item_number:
-                unique_item_number = f"ITEM-{base_count + created + 1:06d}"
-            if not barbuddy_code:
-                barbuddy_code = f"BB{base_count + created + 1:03d}"
-
-            product = Product(
-                description=description,
-                supplier=supplier,
-                category=category,
-                sub_category=sub_category,
-                selling_unit=unit,
-                cost_per_unit=cost_per_unit,
-                unique_item_number=unique_item_number,
-                barbuddy_code=barbuddy_code,
-                item_level=item_level,
-                ml_in_bottle=ml_in_bottle,
-                image_path=None
-            )
-            db.session.add(product)
-            created += 1
-        except Exception as exc:
-            skipped += 1
-            current_app.logger.error('Failed to import row %s: %s', idx, exc, exc_info=True)
-            continue
 
+def _price_list_preview(upload, filename):
+    path = _pending_upload_path(upload)
     try:
-        db.session.commit()
-        flash(f'Imported {created} products successfully. Skipped {skipped} rows.')
-    except Exception as exc:
-        db.session.rollback()
-        flash(f'Failed to save imported products: {exc}')
+        with open(path, 'rb') as handle:
+            diff = diff_price_list(handle, path)
+    except ProductImportError as exc:
+        _discard_pending_upload(upload)
+        flash(str(exc))
+        return redirect(url_for('products.ingredients_master'))
+    return render_template('master_list/import_preview.html', diff=diff, upload=upload,
+                           filename=filename, preview_rows=PREVIEW_ROWS)
 
-    return redirect(url_for('products.ingredients_master'))
+
+@products_bp.route('/ingredients/bulk-upload/apply', methods=['POST'])
+@login_required
+def apply_price_list_upload():
+    upload = request.form.get('upload', '')
+    if not PENDING_UPLOAD.match(upload) or not os.path.exists(_pending_upload_path(upload)):
+        flash('That price list preview has expired. Please upload the file again.')
+        return redirect(url_for('products.ingredients_master'))
+    if request.form.get('action') != 'apply':
+        _discard_pending_upload(upload)
+        flash('Price list update cancelled.')
+        return redirect(url_for('products.ingredients_master'))
+
+    # The worker diffs the file again, so changes made since the preview are taken into account
+    job = enqueue('apply_price_list', {'path': _pending_upload_path(upload)}, user_id=current_user.id)
+    db.session.commit()
+    flash('Applying the price list in the background.')
+    return redirect(url_for('products.ingredients_master', job=job.id))
 
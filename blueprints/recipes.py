@@ -2,62 +2,138 @@
 Recipes Blueprint
 Handles all recipe routes
 """
-from flask import Blueprint, render_template, redirect, url_for, request, flash, current_app
+from flask import Blueprint, render_template, redirect, url_for, request, flash, current_app, jsonify, make_response
 from flask_login import login_required, current_user
 from extensions import db
 from models import Product, HomemadeIngredient, Recipe, RecipeIngredient
-from utils.db_helpers import ensure_schema_updates
-from utils.file_upload import save_uploaded_file
+from utils.file_upload import save_uploaded_file, remove_upload_files
 from utils.constants import resolve_recipe_category, category_context_from_type, CATEGORY_CONFIG
+from utils.costing import CostingEngine
+from utils.cost_cache import refresh_costs, recipe_cost_map
+from utils.where_used import where_used, recipe_cycle
+from utils.simulation import simulate, SimulationError
+from utils.ingredient_catalog import ingredient_catalog
+from utils.exports import recipe_export, export_response
+from utils.product_import import SUPPORTED_EXTENSIONS
+from utils.jobs import enqueue
+from utils.code_sequences import allocate_code
+from utils.response_cache import cached_fragment, page_etag, not_modified, revalidate
+from markupsafe import Markup
+import os
+import uuid
 
 recipes_bp = Blueprint('recipes', __name__)
 
 
+def _cyclic_nesting_message(recipe_id, nested_ids):
+    """Error message if nesting these recipes would make the recipe include itself, else None"""
+    cycle_id = recipe_cycle(recipe_id, nested_ids)
+    if cycle_id is None:
+        return None
+    nested = db.session.get(Recipe, cycle_id)
+    name = nested.title if nested else f"#{cycle_id}"
+    return f'"{name}" already includes this recipe, so it cannot be used as one of its ingredients.'
+
+
+def _recipe_costing_context(engine, recipe):
+    """Template variables for recipes/view.html from a loaded CostingEngine"""
+    costs = engine.cost_map([recipe.id]).get(recipe.id, {'total_cost': 0.0, 'cost_percentage': None})
+    return {
+        'recipe_total_cost': costs['total_cost'],
+        'cost_percent': costs['cost_percentage'],
+        'line_ingredients': {line.id: engine.ingredient(line) for line in recipe.ingredients},
+        'line_costs': {line.id: engine.line_cost(line) for line in recipe.ingredients},
+    }
+
+
 @recipes_bp.route('/recipes', methods=['GET'])
 @login_required
 def recipes_list():
-    ensure_schema_updates()
+    recipe_type_filter = request.args.get('type', '')
+    category_filter = (request.args.get('category', '') or '').lower()
+    job_id = request.args.get('job', type=int)
     try:
-        from sqlalchemy.orm import joinedload
-        # Eagerly load ingredients to avoid N+1 queries and ensure cost calculation works
-        recipes = Recipe.query.options(
-            joinedload(Recipe.ingredients)
-        ).all()
-        
-        recipe_type_filter = request.args.get('type', '')
-        category_filter = (request.args.get('category', '') or '').lower()
-        
-        if recipe_type_filter:
-            recipes = [r for r in recipes if r.recipe_type == recipe_type_filter]
-        if category_filter:
-            # Map category slug to db_labels from CATEGORY_CONFIG
-            from utils.constants import resolve_recipe_category
-            canonical, config = resolve_recipe_category(category_filter)
-            if canonical and config:
-                labels = set(config['db_labels'])
-                # Prioritize type field over recipe_type since recipe_type is generic ('Beverage')
-                # and type field has specific values ('Beverages', 'Mocktails', 'Cocktails')
-                def matches_category(recipe):
-                    # First check type field (most specific)
-                    if recipe.type and recipe.type in labels:
-                        return True
-                    # Only check recipe_type if type is None or empty
-                    if not recipe.type and recipe.recipe_type and recipe.recipe_type in labels:
-                        return True
-                    return False
-                recipes = [r for r in recipes if matches_category(r)]
-        
-        # Ensure ingredients are loaded for cost calculation
-        for recipe in recipes:
-            _ = recipe.ingredients
-            for ingredient in recipe.ingredients:
-                _ = ingredient.get_product()
-        
-        return render_template('recipes/list.html', recipes=recipes, selected_type=recipe_type_filter, selected_category=category_filter)
+        etag = page_etag('recipes-list')
+        cached = not_modified(etag)
+        if cached:
+            return cached
+
+        def render_table():
+            # Costs are read from the materialized cost cache, so ingredients are not loaded here
+            recipes = Recipe.query.all()
+            
+            if recipe_type_filter:
+                recipes = [r for r in recipes if r.recipe_type == recipe_type_filter]
+            if category_filter:
+                # Map category slug to db_labels from CATEGORY_CONFIG
+                canonical, config = resolve_recipe_category(category_filter)
+                if canonical and config:
+                    labels = set(config['db_labels'])
+                    # Prioritize type field over recipe_type since recipe_type is generic ('Beverage')
+                    # and type field has specific values ('Beverages', 'Mocktails', 'Cocktails')
+                    def matches_category(recipe):
+                        # First check type field (most specific)
+                        if recipe.type and recipe.type in labels:
+                            return True
+                        # Only check recipe_type if type is None or empty
+                        if not recipe.type and recipe.recipe_type and recipe.recipe_type in labels:
+                            return True
+                        return False
+                    recipes = [r for r in recipes if matches_category(r)]
+            
+            costs = recipe_cost_map(recipes)
+            return render_template('recipes/_recipes_table.html', recipes=recipes, costs=costs)
+
+        # The table is shared by every user until the next catalog write
+        recipes_table = cached_fragment('recipes-table', render_table, recipe_type_filter, category_filter)
+        response = make_response(render_template('recipes/list.html', recipes_table=recipes_table,
+                                                 selected_type=recipe_type_filter, selected_category=category_filter,
+                                                 job_id=job_id))
+        return revalidate(response, etag)
     except Exception as e:
         current_app.logger.error(f"Error in recipes_list: {str(e)}", exc_info=True)
         flash('An error occurred while loading recipes.', 'error')
-        return render_template('recipes/list.html', recipes=[], selected_type='', selected_category='')
+        recipes_table = Markup(render_template('recipes/_recipes_table.html', recipes=[], costs={}))
+        return render_template('recipes/list.html', recipes_table=recipes_table, selected_type='', selected_category='', job_id=None)
+
+
+@recipes_bp.route('/recipes/bulk-upload', methods=['POST'])
+@login_required
+def bulk_upload_recipes():
+    file = request.files.get('file')
+    if not file or file.filename == '':
+        flash('Please choose a file to upload.')
+        return redirect(url_for('recipes.recipes_list'))
+
+    if not file.filename.lower().endswith(SUPPORTED_EXTENSIONS):
+        flash(f'Only {", ".join(SUPPORTED_EXTENSIONS)} files are supported for bulk upload.')
+        return redirect(url_for('recipes.recipes_list'))
+
+    # The worker removes the file once the recipes are imported
+    extension = os.path.splitext(file.filename)[1].lower()
+    path = os.path.join(current_app.config['IMPORT_FOLDER'], f'{uuid.uuid4().hex}{extension}')
+    os.makedirs(current_app.config['IMPORT_FOLDER'], exist_ok=True)
+    file.save(path)
+
+    job = enqueue('import_recipes', {'path': path, 'filename': file.filename, 'user_id': current_user.id},
+                  user_id=current_user.id)
+    db.session.commit()
+    flash('Upload received. The recipes are being imported in the background.')
+    return redirect(url_for('recipes.recipes_list', job=job.id))
+
+
+@recipes_bp.route('/recipes/export.<any(csv, xlsx):fmt>')
+@login_required
+def export_recipes(fmt):
+    """Download recipe costings as CSV or XLSX, narrowed by ?type= or ?category= like the lists"""
+    labels = None
+    category = request.args.get('category', '')
+    if category:
+        canonical, config = resolve_recipe_category(category)
+        if canonical and config:
+            labels = config['db_labels']
+    dataset = recipe_export(recipe_type=request.args.get('type') or None, category_labels=labels)
+    return export_response(dataset, fmt, f'recipes-{canonical}' if labels else 'recipes')
 
 
 @recipes_bp.route('/recipes/<category>', methods=['GET'])
@@ -75,35 +151,40 @@ def recipe_list(category):
             flash(f"Category '{category}' not found. Showing all recipes.")
             return redirect(url_for('recipes.recipes_list'))
 
-        from sqlalchemy.orm import joinedload
-        from sqlalchemy import or_, and_
-        # Prioritize type field over recipe_type since recipe_type is generic ('Beverage')
-        # and type field has specific values ('Beverages', 'Mocktails', 'Cocktails')
-        recipes = Recipe.query.options(
-            joinedload(Recipe.ingredients)
-        ).filter(
-            or_(
-                Recipe.type.in_(config['db_labels']),
-                and_(
-                    or_(Recipe.type.is_(None), Recipe.type == ''),
-                    Recipe.recipe_type.in_(config['db_labels'])
+        etag = page_etag(f'recipes-{canonical}')
+        cached = not_modified(etag)
+        if cached:
+            return cached
+
+        def render_table():
+            from sqlalchemy import or_, and_
+            # Prioritize type field over recipe_type since recipe_type is generic ('Beverage')
+            # and type field has specific values ('Beverages', 'Mocktails', 'Cocktails')
+            recipes = Recipe.query.filter(
+                or_(
+                    Recipe.type.in_(config['db_labels']),
+                    and_(
+                        or_(Recipe.type.is_(None), Recipe.type == ''),
+                        Recipe.recipe_type.in_(config['db_labels'])
+                    )
                 )
-            )
-        ).all()
-        
-        # Ensure ingredients are loaded for cost calculation
-        for recipe in recipes:
-            _ = recipe.ingredients
-            for ingredient in recipe.ingredients:
-                _ = ingredient.get_product()
-        
-        return render_template(
+            ).all()
+            if not recipes:
+                return ''
+            
+            costs = recipe_cost_map(recipes)
+            return render_template('recipes/_category_table.html', recipes=recipes, costs=costs)
+
+        # The table is shared by every user until the next catalog write
+        recipes_table = cached_fragment('category-table', render_table, canonical)
+        response = make_response(render_template(
             config['template'],
-            recipes=recipes,
+            recipes_table=recipes_table,
             category=config['display'],
             category_slug=canonical,
             add_label=config['add_label']
-        )
+        ))
+        return revalidate(response, etag)
     except Exception as e:
         current_app.logger.error(f"Error in recipe_list: {str(e)}", exc_info=True)
         flash('An error occurred while loading recipes.', 'error')
@@ -131,14 +212,9 @@ def view_recipe_by_code(code):
                     flash("Recipe not found")
                     return redirect(url_for('recipes.recipes_list'))
                 
-                # Ensure ingredients are loaded
-                _ = recipe.ingredients
-                for ingredient in recipe.ingredients:
-                    try:
-                        _ = ingredient.get_product()
-                    except Exception as e:
-                        current_app.logger.warning(f"Error loading product for ingredient {ingredient.id}: {str(e)}")
-                        continue
+                # Bulk-load every ingredient (and nested recipe) once
+                engine = CostingEngine().load_recipes([recipe])
+                costing = _recipe_costing_context(engine, recipe)
                 
                 try:
                     batch = recipe.batch_summary()
@@ -156,7 +232,7 @@ def view_recipe_by_code(code):
                 if not canonical_check:
                     category_slug = 'cocktails'
                     category_display = 'Cocktails'
-                return render_template('recipes/view.html', recipe=recipe, batch=batch, category_slug=category_slug, category_display=category_display)
+                return render_template('recipes/view.html', recipe=recipe, batch=batch, category_slug=category_slug, category_display=category_display, **costing)
             else:
                 # Recipe code not found
                 flash("Recipe not found")
@@ -188,38 +264,6 @@ def add_recipe(category):
             flash("Invalid recipe category")
             return redirect(url_for('main.index'))
 
-        products = Product.query.order_by(Product.description).all()
-        secondary_ingredients = HomemadeIngredient.query.order_by(HomemadeIngredient.name).all()
-        ingredient_options = []
-        for p in products:
-            description = p.description or ''
-            code = p.barbuddy_code or ''
-            label = f"{description} ({code})" if code else description
-            ingredient_options.append({
-                'label': label,
-                'description': description,
-                'code': code,
-                'id': p.id,
-                'type': 'Product',
-                'unit': p.selling_unit or 'ml',
-                'cost_per_unit': p.cost_per_unit or 0.0,
-                'container_volume': p.ml_in_bottle or (1 if (p.selling_unit or '').lower() == 'ml' else 0)
-            })
-        ingredient_options.extend([
-            {
-                'label': f"{sec.name} ({sec.unique_code})",
-                'description': sec.name,
-                'code': sec.unique_code or '',
-                'id': sec.id,
-                'type': 'Secondary',
-                'unit': sec.unit or 'ml',
-                'cost_per_unit': sec.calculate_cost_per_unit(),
-                'container_volume': 1
-            }
-            for sec in secondary_ingredients
-            if sec.unique_code
-        ])
-
         if request.method == 'POST':
             try:
                 title = request.form.get('title', '').strip()
@@ -235,31 +279,19 @@ def add_recipe(category):
                 service_charge_percentage = float(request.form.get('service_charge_percentage', 0) or 0)
                 government_fees_percentage = float(request.form.get('government_fees_percentage', 0) or 0)
                 
-                # Generate unique recipe code
-                max_attempts = 100
-                recipe_code = None
-                for attempt in range(max_attempts):
-                    candidate_code = f"REC-{Recipe.query.count() + attempt + 1:04d}"
-                    existing = Recipe.query.filter_by(recipe_code=candidate_code).first()
-                    if not existing:
-                        recipe_code = candidate_code
-                        break
-                
-                if not recipe_code:
-                    # Fallback to timestamp-based code
-                    from datetime import datetime
-                    recipe_code = f"REC-{datetime.now().strftime('%Y%m%d%H%M%S')}"
-
                 image_path = None
                 if 'image' in request.files:
                     file = request.files['image']
                     if file and file.filename:
                         try:
-                            image_path = save_uploaded_file(file, 'recipes')
+                            image_path = save_uploaded_file(file)
                         except Exception as e:
                             current_app.logger.warning(f"Error saving image: {str(e)}")
                             # Continue without image if upload fails
 
+                # Reserved after the upload is stored, so the write transaction
+                # it opens is not held while the file is hashed
+                recipe_code = allocate_code('REC')
                 recipe = Recipe(
                     recipe_code=recipe_code,
                     title=title,
@@ -393,6 +425,7 @@ def add_recipe(category):
                     db.session.rollback()
                     return redirect(url_for('recipes.add_recipe', category=canonical))
 
+                refresh_costs(recipe_ids=[recipe.id])
                 db.session.commit()
                 flash(f'{config["add_label"]} recipe added successfully!')
                 return redirect(url_for('recipes.recipe_list', category=canonical))
@@ -415,12 +448,10 @@ def add_recipe(category):
 
         return render_template(
             'recipes/add_recipe.html',
-            products=products,
-            secondary_ingredients=secondary_ingredients,
             category=config['display'],
             add_label=config['add_label'],
             category_slug=canonical,
-            ingredient_options=ingredient_options,
+            ingredient_options=[],
             edit_mode=False,
             recipe=None,
             preset_rows=[]
@@ -440,14 +471,9 @@ def view_recipe(id):
             joinedload(Recipe.ingredients)
         ).get_or_404(id)
         
-        # Ensure ingredients are loaded
-        _ = recipe.ingredients
-        for ingredient in recipe.ingredients:
-            try:
-                _ = ingredient.get_product()
-            except Exception as e:
-                current_app.logger.warning(f"Error loading product for ingredient {ingredient.id}: {str(e)}")
-                continue
+        # Bulk-load every ingredient (and nested recipe) once
+        engine = CostingEngine().load_recipes([recipe])
+        costing = _recipe_costing_context(engine, recipe)
         
         try:
             batch = recipe.batch_summary()
@@ -465,7 +491,7 @@ def view_recipe(id):
         if not canonical_check:
             category_slug = 'cocktails'
             category_display = 'Cocktails'
-        return render_template('recipes/view.html', recipe=recipe, batch=batch, category_slug=category_slug, category_display=category_display)
+        return render_template('recipes/view.html', recipe=recipe, batch=batch, category_slug=category_slug, category_display=category_display, **costing)
     except Exception as e:
         current_app.logger.error(f"Error in view_recipe: {str(e)}", exc_info=True)
         import traceback
@@ -476,62 +502,53 @@ def view_recipe(id):
 
 
 
+@recipes_bp.route('/recipe/<int:id>/where-used')
+@login_required
+def recipe_where_used(id):
+    """Recipes that nest this recipe, directly or indirectly"""
+    recipe = Recipe.query.get_or_404(id)
+    return jsonify(where_used(recipe))
+
+
+@recipes_bp.route('/recipes/simulate', methods=['POST'])
+@login_required
+def simulate_prices():
+    """
+    Reprice every recipe under hypothetical product prices without saving them.
+    JSON body: {"overrides": [{"code": "BB042", "percent": 18},
+                              {"supplier": "Gin Co", "percent": -5}],
+                "threshold": 25, "type": "Cocktails", "limit": 50}
+    """
+    data = request.get_json(silent=True) or {}
+    try:
+        threshold = data.get('threshold')
+        limit = int(data.get('limit') or 50)
+        result = simulate(
+            data.get('overrides') or [],
+            threshold=float(threshold) if threshold not in (None, '') else None,
+            recipe_type=data.get('type') or None,
+            limit=max(limit, 0),
+        )
+    except (SimulationError, TypeError, ValueError) as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify(result)
+
+
 @recipes_bp.route('/recipes/<int:id>/edit', methods=['GET', 'POST'])
 @login_required
 def edit_recipe(id):
-    ensure_schema_updates()
     try:
         from sqlalchemy.orm import joinedload
         recipe = Recipe.query.options(
             joinedload(Recipe.ingredients)
         ).get_or_404(id)
         
-        # Ensure ingredients are loaded
-        _ = recipe.ingredients
-        for ingredient in recipe.ingredients:
-            _ = ingredient.get_product()
-        
         category_slug, category_display = category_context_from_type(recipe.type or recipe.recipe_type or '')
         if not category_slug:
             category_slug = 'cocktails'
             category_display = 'Cocktails'
         config = CATEGORY_CONFIG.get(category_slug, CATEGORY_CONFIG['cocktails'])
         
-        products = Product.query.order_by(Product.description).all()
-        secondary_ingredients = HomemadeIngredient.query.order_by(HomemadeIngredient.name).all()
-        
-        ingredient_options = []
-        for p in products:
-            description = p.description or ''
-            code = p.barbuddy_code or ''
-            label = f"{description} ({code})" if code else description
-            ingredient_options.append({
-                'label': label,
-                'description': description,
-                'code': code,
-                'id': int(p.id),
-                'type': 'Product',
-                'unit': p.selling_unit or 'ml',
-                'cost_per_unit': float(p.cost_per_unit or 0.0),
-                'container_volume': float(p.ml_in_bottle or (1 if (p.selling_unit or '').lower() == 'ml' else 0))
-            })
-        for sec in secondary_ingredients:
-            if sec.unique_code:
-                try:
-                    cost_per_unit = sec.calculate_cost_per_unit()
-                except Exception:
-                    cost_per_unit = 0.0
-                ingredient_options.append({
-                    'label': f"{sec.name} ({sec.unique_code})",
-                    'description': sec.name,
-                    'code': sec.unique_code or '',
-                    'id': int(sec.id),
-                    'type': 'Secondary',
-                    'unit': sec.unit or 'ml',
-                    'cost_per_unit': float(cost_per_unit),
-                    'container_volume': 1.0
-                })
-
         if request.method == 'POST':
             try:
                 recipe.title = request.form['title']
@@ -543,10 +560,13 @@ def edit_recipe(id):
                 recipe.service_charge_percentage = float(request.form.get('service_charge_percentage', recipe.service_charge_percentage or 0))
                 recipe.government_fees_percentage = float(request.form.get('government_fees_percentage', recipe.government_fees_percentage or 0))
 
+                old_image_path = None
                 if 'image' in request.files:
                     file = request.files['image']
                     if file.filename:
-                        recipe.image_path = save_uploaded_file(file, 'recipes')
+                        image_path = save_uploaded_file(file)
+                        if image_path:
+                            old_image_path, recipe.image_path = recipe.image_path, image_path
 
                 RecipeIngredient.query.filter_by(recipe_id=recipe.id).delete()
 
@@ -555,6 +575,7 @@ def edit_recipe(id):
                 ingredient_quantities = request.form.getlist('ingredient_qty')
                 ingredient_units = request.form.getlist('ingredient_unit')
 
+                nested_recipe_ids = []
                 for idx, ing_id in enumerate(ingredient_ids):
                     if not ing_id or idx >= len(ingredient_types) or idx >= len(ingredient_quantities):
                         continue
@@ -615,8 +636,21 @@ def edit_recipe(id):
                         product_id=db_product_id
                     )
                     db.session.add(item)
+                    if db_ingredient_type == 'Recipe':
+                        nested_recipe_ids.append(ing_id_int)
+
+                # Reject nesting that would make the recipe include itself
+                cycle_message = _cyclic_nesting_message(recipe.id, nested_recipe_ids)
+                if cycle_message:
+                    db.session.rollback()
+                    flash(cycle_message, 'error')
+                    return redirect(url_for('recipes.edit_recipe', id=id))
 
+                # Recost this recipe and every recipe nesting it in the same transaction
+                refresh_costs(recipe_ids=[recipe.id])
                 db.session.commit()
+                if old_image_path:
+                    remove_upload_files([old_image_path])
                 flash('Recipe updated successfully!')
                 return redirect(url_for('recipes.recipe_list', category=category_slug))
             except Exception as e:
@@ -625,50 +659,40 @@ def edit_recipe(id):
                 flash(f'An error occurred while updating the recipe: {str(e)}', 'error')
                 return redirect(url_for('recipes.edit_recipe', id=id))
 
+        # Every ingredient on the recipe is fetched in one query per type; nested
+        # recipes and secondaries with a cached cost are not expanded further
+        engine = CostingEngine(stale_recipe_ids=[recipe.id], stale_homemade_ids=()).load_recipes([recipe])
         preset_rows = []
-        recipe_ingredients = RecipeIngredient.query.filter_by(recipe_id=recipe.id).all()
-        current_app.logger.info(f"Edit recipe {recipe.id}: Found {len(recipe_ingredients)} ingredients")
-        for ingredient in recipe_ingredients:
-            ing_type = ingredient.ingredient_type
-            if ing_type == 'Homemade':
-                ing_type = 'Secondary'
-            
-            label = ''
-            description = ''
-            code = ''
-            if ing_type == 'Product':
-                product = Product.query.get(ingredient.ingredient_id)
-                if product:
-                    description = product.description or ''
-                    code = product.barbuddy_code or ''
-                    label = f"{description} ({code})" if code else description
-            elif ing_type == 'Secondary':
-                sec = HomemadeIngredient.query.get(ingredient.ingredient_id)
-                if sec and sec.unique_code:
-                    description = sec.name or ''
-                    code = sec.unique_code or ''
-                    label = f"{description} ({code})" if code else description
-            elif ing_type == 'Recipe':
-                rec = Recipe.query.get(ingredient.ingredient_id)
-                if rec and rec.recipe_code:
-                    description = rec.title or ''
-                    code = rec.recipe_code or ''
-                    label = f"{description} ({code})" if code else description
-            
+        for ingredient in recipe.ingredients:
+            kind, ref_id = ingredient.ingredient_ref()
+            target = engine.ingredient(ingredient)
+            if target is None:
+                continue
+            if kind == 'Product':
+                ing_type, description, code = 'Product', target.description or '', target.barbuddy_code or ''
+            elif kind == 'Homemade':
+                ing_type, description, code = 'Secondary', target.name or '', target.unique_code or ''
+            else:
+                ing_type, description, code = 'Recipe', target.title or '', target.recipe_code or ''
+            # Secondaries and nested recipes without a code cannot be picked again in the form
+            if ing_type != 'Product' and not code:
+                continue
+            label = f"{description} ({code})" if code else description
             if label:
                 preset_rows.append({
                     'label': label,
                     'description': description,
                     'code': code,
-                    'id': int(ingredient.ingredient_id),
+                    'id': int(ref_id),
                     'type': ing_type,
                     'qty': float(ingredient.quantity or 0),
                     'unit': ingredient.unit or 'ml'
                 })
 
+        # Only the options already on the recipe; the form fetches the rest as the user types
+        ingredient_options = ingredient_catalog().options_for((row['type'], row['id']) for row in preset_rows)
+
         return render_template('recipes/edit.html',
-                               products=products,
-                               secondary_ingredients=secondary_ingredients,
                                category=category_display,
                                add_label=config['add_label'],
                                category_slug=category_slug,
@@ -685,7 +709,12 @@ def edit_recipe(id):
 @login_required
 def delete_recipe(id):
     recipe = Recipe.query.get_or_404(id)
+    image_path = recipe.image_path
     db.session.delete(recipe)
+    refresh_costs(recipe_ids=[id])
+    if image_path:
+        # Removed after the commit, unless another product or recipe shares it
+        enqueue('remove_upload_files', {'paths': [image_path]}, user_id=current_user.id)
     db.session.commit()
     flash('Recipe deleted successfully!')
     return redirect(url_for('recipes.recipes_list'))
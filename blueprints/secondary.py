@@ -2,86 +2,55 @@
 Secondary Ingredients Blueprint
 Handles all secondary ingredient (homemade ingredient) routes
 """
-from flask import Blueprint, render_template, redirect, url_for, request, flash, current_app
+from flask import Blueprint, render_template, redirect, url_for, request, flash, current_app, jsonify
 from flask_login import login_required, current_user
 from extensions import db
 from models import Product, HomemadeIngredient, HomemadeIngredientItem
-from utils.db_helpers import ensure_schema_updates
-import time
+from utils.cost_cache import refresh_costs, homemade_cost_map
+from utils.where_used import where_used
+from utils.ingredient_catalog import ingredient_catalog
+from utils.exports import secondary_export, export_response
+from utils.code_sequences import allocate_code
 
 secondary_bp = Blueprint('secondary', __name__)
 
 
+def _match_option(catalog, label, ingredient_id, ingredient_type):
+    """Catalog option for a submitted ingredient row, by id and type first, then by label"""
+    if ingredient_id:
+        try:
+            ingredient_id = int(ingredient_id)
+        except (ValueError, TypeError):
+            ingredient_id = None
+    if ingredient_id:
+        for option_type in ([ingredient_type] if ingredient_type else ['Product', 'Secondary']):
+            option = catalog.get(option_type, ingredient_id)
+            if option:
+                return option
+    return catalog.find_label(label)
+
+
 @secondary_bp.route('/secondary-ingredients', methods=['GET'])
 @login_required
 def secondary_ingredients():
-    ensure_schema_updates()
     try:
-        # Eagerly load ingredients and their products to ensure cost calculation works
-        from sqlalchemy.orm import joinedload
-        secondary_items = HomemadeIngredient.query.options(
-            joinedload(HomemadeIngredient.ingredients).joinedload(HomemadeIngredientItem.product)
-        ).all()
+        # Costs come from the materialized cost cache (see utils/cost_cache.py)
+        secondary_items = HomemadeIngredient.query.all()
+        costs = homemade_cost_map(secondary_items)
         
         table_rows = []
         for item in secondary_items:
-            try:
-                # Ensure ingredients are loaded
-                _ = item.ingredients
-                for ingredient_item in item.ingredients:
-                    _ = ingredient_item.product
-                
-                # Calculate total cost - sum of all ingredient costs
-                try:
-                    # Debug: Check if ingredients exist
-                    if not item.ingredients:
-                        current_app.logger.warning(f"Secondary ingredient {item.id} ({item.name}) has no ingredients")
-                        total_cost = 0.0
-                    else:
-                        # Debug: Check each ingredient
-                        for ing in item.ingredients:
-                            if not ing.product:
-                                current_app.logger.warning(f"Ingredient item {ing.id} has no product")
-                            elif ing.product.cost_per_unit is None:
-                                current_app.logger.warning(f"Product {ing.product.id} ({ing.product.description}) has no cost_per_unit")
-                        total_cost = item.calculate_cost()
-                        current_app.logger.debug(f"Calculated cost for {item.id} ({item.name}): {total_cost}, ingredients count: {len(item.ingredients)}")
-                except Exception as e:
-                    current_app.logger.error(f"Error calculating cost for {item.id}: {str(e)}", exc_info=True)
-                    total_cost = 0.0
-                
-                # Calculate cost per unit
-                try:
-                    if item.total_volume_ml and item.total_volume_ml > 0:
-                        unit_cost = item.calculate_cost_per_unit()
-                    else:
-                        unit_cost = 0.0
-                except Exception as e:
-                    current_app.logger.error(f"Error calculating unit cost for {item.id}: {str(e)}", exc_info=True)
-                    unit_cost = 0.0
-                
-                table_rows.append({
-                    'id': item.id,
-                    'code': item.unique_code or f"SEC-{item.id:04d}",
-                    'name': item.name or 'Unnamed',
-                    'unit': item.unit or 'ml',
-                    'total_volume': item.total_volume_ml or 0.0,
-                    'total_cost': total_cost,
-                    'unit_cost': unit_cost,
-                    'item_level': 'Secondary'
-                })
-            except Exception as e:
-                current_app.logger.error(f"Error processing secondary ingredient {item.id}: {str(e)}", exc_info=True)
-                table_rows.append({
-                    'id': item.id,
-                    'code': item.unique_code or f"SEC-{item.id:04d}",
-                    'name': item.name or 'Unnamed',
-                    'unit': item.unit or 'ml',
-                    'total_volume': item.total_volume_ml or 0.0,
-                    'total_cost': 0.0,
-                    'unit_cost': 0.0,
-                    'item_level': 'Secondary'
-                })
+            total_cost, unit_cost = costs[item.id]
+            table_rows.append({
+                'id': item.id,
+                'code': item.unique_code or f"SEC-{item.id:04d}",
+                'name': item.name or 'Unnamed',
+                'unit': item.unit or 'ml',
+                'total_volume': item.total_volume_ml or 0.0,
+                'total_cost': total_cost,
+                'unit_cost': unit_cost,
+                'item_level': 'Secondary'
+            })
         return render_template('secondary_ingredients/list.html', secondary_rows=table_rows)
     except Exception as e:
         current_app.logger.error(f"Error in secondary_ingredients route: {str(e)}", exc_info=True)
@@ -89,10 +58,16 @@ def secondary_ingredients():
         return render_template('secondary_ingredients/list.html', secondary_rows=[])
 
 
+@secondary_bp.route('/secondary-ingredients/export.<any(csv, xlsx):fmt>')
+@login_required
+def export_secondary_ingredients(fmt):
+    """Download secondary ingredient costings as CSV or XLSX"""
+    return export_response(secondary_export(), fmt, 'secondary-ingredients')
+
+
 @secondary_bp.route('/secondary-ingredients/<int:id>')
 @login_required
 def view_secondary_ingredient(id):
-    ensure_schema_updates()
     from sqlalchemy.orm import joinedload
     secondary = HomemadeIngredient.query.options(
         joinedload(HomemadeIngredient.ingredients).joinedload(HomemadeIngredientItem.product)
@@ -104,40 +79,17 @@ def view_secondary_ingredient(id):
     return render_template('secondary_ingredients/view.html', secondary=secondary)
 
 
+@secondary_bp.route('/secondary-ingredients/<int:id>/where-used')
+@login_required
+def secondary_where_used(id):
+    """Recipes affected by a change to this secondary ingredient"""
+    secondary = HomemadeIngredient.query.get_or_404(id)
+    return jsonify(where_used(secondary))
+
+
 @secondary_bp.route('/secondary-ingredients/add', methods=['GET', 'POST'])
 @login_required
 def add_secondary_ingredient():
-    ensure_schema_updates()
-    products = Product.query.order_by(Product.description).all()
-    existing_secondary = HomemadeIngredient.query.order_by(HomemadeIngredient.name).all()
-    ingredient_options = [
-        {
-            'label': f"{p.description} ({p.barbuddy_code})",
-            'id': p.id,
-            'type': 'Product',
-            'code': p.barbuddy_code or 'N/A',
-            'unit': p.selling_unit or 'ml',
-            'cost_per_unit': p.cost_per_unit or 0.0,
-            'container_volume': p.ml_in_bottle or (1 if (p.selling_unit or '').lower() == 'ml' else 0)
-        }
-        for p in products
-    ]
-    for sec in existing_secondary:
-        if sec.unique_code:
-            try:
-                cost_per_unit = sec.calculate_cost_per_unit()
-            except Exception:
-                cost_per_unit = 0.0
-            ingredient_options.append({
-                'label': f"{sec.name} ({sec.unique_code})",
-                'id': sec.id,
-                'type': 'Secondary',
-                'code': sec.unique_code or 'N/A',
-                'unit': sec.unit or 'ml',
-                'cost_per_unit': cost_per_unit,
-                'container_volume': sec.total_volume_ml or 1
-            })
-
     preset_rows = []
 
     if request.method == 'POST':
@@ -158,17 +110,7 @@ def add_secondary_ingredient():
                 flash('Total volume must be greater than zero.')
                 return redirect(url_for('secondary.add_secondary_ingredient'))
 
-            max_id = db.session.query(db.func.max(HomemadeIngredient.id)).scalar() or 0
-            counter = 1
-            while True:
-                unique_code = f"SEC-{max_id + counter:04d}"
-                existing = HomemadeIngredient.query.filter_by(unique_code=unique_code).first()
-                if not existing:
-                    break
-                counter += 1
-                if counter > 1000:
-                    unique_code = f"SEC-{int(time.time())}"
-                    break
+            unique_code = allocate_code('SEC')
 
             homemade = HomemadeIngredient(
                 name=name,
@@ -187,11 +129,7 @@ def add_secondary_ingredient():
             ingredient_quantities = request.form.getlist('ingredient_qty')
             ingredient_units = request.form.getlist('ingredient_unit')
 
-            lookup = {}
-            for opt in ingredient_options:
-                lookup[opt['label'].lower()] = opt
-                simple = opt['label'].split('(')[0].strip().lower()
-                lookup.setdefault(simple, opt)
+            catalog = ingredient_catalog()
 
             matched = []
             for idx, label in enumerate(ingredient_labels):
@@ -199,20 +137,11 @@ def add_secondary_ingredient():
                 if not label_clean:
                     continue
                 
-                option = None
-                if idx < len(ingredient_ids) and ingredient_ids[idx]:
-                    try:
-                        ing_id = int(ingredient_ids[idx])
-                        ing_type = ingredient_types[idx] if idx < len(ingredient_types) else None
-                        for opt in ingredient_options:
-                            if opt['id'] == ing_id and (not ing_type or opt['type'] == ing_type):
-                                option = opt
-                                break
-                    except (ValueError, TypeError):
-                        pass
-                
-                if not option:
-                    option = lookup.get(label_clean.lower())
+                option = _match_option(
+                    catalog, label_clean,
+                    ingredient_ids[idx] if idx < len(ingredient_ids) else None,
+                    ingredient_types[idx] if idx < len(ingredient_types) else None
+                )
                 
                 try:
                     qty = float(ingredient_quantities[idx] or 0)
@@ -271,6 +200,7 @@ def add_secondary_ingredient():
                     current_app.logger.error(f"Error adding ingredient item: {str(e)}", exc_info=True)
                     continue
 
+            refresh_costs(homemade_ids=[homemade.id])
             db.session.commit()
             flash('Secondary ingredient created successfully!')
             return redirect(url_for('secondary.secondary_ingredients'))
@@ -282,7 +212,7 @@ def add_secondary_ingredient():
 
     return render_template(
         'secondary_ingredients/add.html',
-        ingredient_options=ingredient_options,
+        ingredient_options=[],
         edit_mode=False,
         secondary=None,
         preset_rows=preset_rows
@@ -292,7 +222,6 @@ def add_secondary_ingredient():
 @secondary_bp.route('/secondary-ingredients/<int:id>/edit', methods=['GET', 'POST'])
 @login_required
 def edit_secondary_ingredient(id):
-    ensure_schema_updates()
     from sqlalchemy.orm import joinedload
     secondary = HomemadeIngredient.query.options(
         joinedload(HomemadeIngredient.ingredients).joinedload(HomemadeIngredientItem.product)
@@ -301,37 +230,6 @@ def edit_secondary_ingredient(id):
     _ = secondary.ingredients
     for item in secondary.ingredients:
         _ = item.product
-    products = Product.query.order_by(Product.description).all()
-    existing_secondary = HomemadeIngredient.query.filter(HomemadeIngredient.id != id).order_by(HomemadeIngredient.name).all()
-
-    ingredient_options = [
-        {
-            'label': f"{p.description} ({p.barbuddy_code})",
-            'id': p.id,
-            'type': 'Product',
-            'code': p.barbuddy_code or 'N/A',
-            'unit': p.selling_unit or 'ml',
-            'cost_per_unit': p.cost_per_unit or 0.0,
-            'container_volume': p.ml_in_bottle or (1 if (p.selling_unit or '').lower() == 'ml' else 0)
-        }
-        for p in products
-    ]
-    for sec in existing_secondary:
-        if sec.unique_code:
-            try:
-                cost_per_unit = sec.calculate_cost_per_unit()
-            except Exception:
-                cost_per_unit = 0.0
-            ingredient_options.append({
-                'label': f"{sec.name} ({sec.unique_code})",
-                'id': sec.id,
-                'type': 'Secondary',
-                'code': sec.unique_code or 'N/A',
-                'unit': sec.unit or 'ml',
-                'cost_per_unit': cost_per_unit,
-                'container_volume': sec.total_volume_ml or 1
-            })
-
     if request.method == 'POST':
         try:
             name = request.form.get('name', '').strip()
@@ -365,11 +263,7 @@ def edit_secondary_ingredient(id):
             ingredient_quantities = request.form.getlist('ingredient_qty')
             ingredient_units = request.form.getlist('ingredient_unit')
 
-            lookup = {}
-            for opt in ingredient_options:
-                lookup[opt['label'].lower()] = opt
-                simple = opt['label'].split('(')[0].strip().lower()
-                lookup.setdefault(simple, opt)
+            catalog = ingredient_catalog()
 
             matched = []
             for idx, label in enumerate(ingredient_labels):
@@ -377,20 +271,14 @@ def edit_secondary_ingredient(id):
                 if not label_clean:
                     continue
                 
-                option = None
-                if idx < len(ingredient_ids) and ingredient_ids[idx]:
-                    try:
-                        ing_id = int(ingredient_ids[idx])
-                        ing_type = ingredient_types[idx] if idx < len(ingredient_types) else None
-                        for opt in ingredient_options:
-                            if opt['id'] == ing_id and (not ing_type or opt['type'] == ing_type):
-                                option = opt
-                                break
-                    except (ValueError, TypeError):
-                        pass
-                
-                if not option:
-                    option = lookup.get(label_clean.lower())
+                option = _match_option(
+                    catalog, label_clean,
+                    ingredient_ids[idx] if idx < len(ingredient_ids) else None,
+                    ingredient_types[idx] if idx < len(ingredient_types) else None
+                )
+                if option and option['type'] == 'Secondary' and option['id'] == secondary.id:
+                    # A secondary ingredient cannot contain itself
+                    option = None
                 
                 try:
                     qty = float(ingredient_quantities[idx] or 0)
@@ -466,6 +354,8 @@ def edit_secondary_ingredient(id):
                 db.session.rollback()
                 return redirect(url_for('secondary.edit_secondary_ingredient', id=id))
 
+            # Recost this secondary ingredient and every recipe using it in the same transaction
+            refresh_costs(homemade_ids=[secondary.id])
             db.session.commit()
             # Expire and reload the secondary ingredient to ensure ingredients are loaded
             db.session.expire(secondary)
@@ -487,8 +377,8 @@ def edit_secondary_ingredient(id):
         if component.product:
             # Match the exact label format used in ingredient_options
             description = component.product.description or ''
-            code = component.product.barbuddy_code or 'N/A'
-            label = f"{description} ({code})"
+            code = component.product.barbuddy_code or ''
+            label = f"{description} ({code})" if code else description
             preset_rows.append({
                 'label': label.strip(),
                 'id': component.product_id,
@@ -498,6 +388,8 @@ def edit_secondary_ingredient(id):
                 'code': code
             })
 
+    # Only the options already in use; the form fetches the rest as the user types
+    ingredient_options = ingredient_catalog().options_for((row['type'], row['id']) for row in preset_rows)
     return render_template('secondary_ingredients/edit.html', ingredient_options=ingredient_options, secondary=secondary, preset_rows=preset_rows)
 
 
@@ -506,6 +398,7 @@ def edit_secondary_ingredient(id):
 def delete_secondary_ingredient(id):
     secondary = HomemadeIngredient.query.get_or_404(id)
     db.session.delete(secondary)
+    refresh_costs(homemade_ids=[id])
     db.session.commit()
     flash('Secondary ingredient deleted successfully!')
     return redirect(url_for('secondary.secondary_ingredients'))
@@ -554,6 +447,7 @@ def link_ingredient_to_secondary(id):
                 db.session.add(item)
                 flash(f'Successfully linked: {product.description} ({quantity} {unit})')
             
+            refresh_costs(homemade_ids=[id])
             db.session.commit()
             return redirect(url_for('secondary.view_secondary_ingredient', id=id))
         except Exception as e:
@@ -579,6 +473,7 @@ def delete_ingredient_item(id):
     item = HomemadeIngredientItem.query.get_or_404(id)
     secondary_id = item.homemade_id
     db.session.delete(item)
+    refresh_costs(homemade_ids=[secondary_id])
     db.session.commit()
     flash('Ingredient removed successfully!')
     return redirect(url_for('secondary.link_ingredient_to_secondary', id=secondary_id))
@@ -13,5 +13,50 @@ class Config:
     
     SQLALCHEMY_TRACK_MODIFICATIONS = False
     UPLOAD_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static', 'uploads')
+    # Price lists waiting for confirmation after an upsert preview (not web-served)
+    IMPORT_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'instance', 'imports')
+    # Orphaned uploads moved aside by `flask gc-uploads --quarantine` (not web-served)
+    UPLOAD_QUARANTINE_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'instance', 'upload_quarantine')
+    # Hours between upload clean-ups queued by `flask worker`; unset means only run by hand
+    UPLOAD_GC_INTERVAL_HOURS = os.environ.get('UPLOAD_GC_INTERVAL_HOURS')
     MAX_CONTENT_LENGTH = 16 * 1024 * 1024  # 16MB max file size
     ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif', 'webp'}
+    # Rendered recipe list tables, keyed on the catalog version (see utils/response_cache.py):
+    # memory (per worker process), filesystem (shared by the workers on a host) or none
+    RESPONSE_CACHE = os.environ.get('RESPONSE_CACHE', 'memory')
+    RESPONSE_CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'instance', 'response_cache')
+    RESPONSE_CACHE_MAX_BYTES = int(os.environ.get('RESPONSE_CACHE_MAX_MB', 32)) * 1024 * 1024
+    # PRAGMAs run on every new SQLite connection (see utils/database.py); none in development
+    SQLITE_PRAGMAS = {}
+
+
+class ProductionConfig(Config):
+    """
+    Settings for several gunicorn workers sharing one database. Selected with
+    APP_CONFIG=config.ProductionConfig.
+    """
+    SQLITE_PRAGMAS = {
+        # Readers no longer block the writer (or the writer the readers)
+        'journal_mode': 'WAL',
+        # Safe with WAL: a power cut can lose the last commits but not corrupt the file
+        'synchronous': 'NORMAL',
+        # Wait for the write lock instead of failing with "database is locked"
+        'busy_timeout': int(os.environ.get('SQLITE_BUSY_TIMEOUT_MS', 10000)),
+        'mmap_size': int(os.environ.get('SQLITE_MMAP_SIZE', 256 * 1024 * 1024)),
+        # Negative means KiB: 64 MB of page cache per connection
+        'cache_size': -int(os.environ.get('SQLITE_CACHE_KB', 64000)),
+    }
+
+    # One copy of each rendered table for all workers instead of one per process
+    RESPONSE_CACHE = os.environ.get('RESPONSE_CACHE', 'filesystem')
+
+    if Config.SQLALCHEMY_DATABASE_URI.startswith('postgresql'):
+        # Per worker process; size so workers * (pool_size + max_overflow) stays under max_connections
+        SQLALCHEMY_ENGINE_OPTIONS = {
+            'pool_size': int(os.environ.get('DB_POOL_SIZE', 5)),
+            'max_overflow': int(os.environ.get('DB_MAX_OVERFLOW', 5)),
+            'pool_timeout': int(os.environ.get('DB_POOL_TIMEOUT', 30)),
+            # Drop connections the server or a proxy closed while idle
+            'pool_pre_ping': True,
+            'pool_recycle': int(os.environ.get('DB_POOL_RECYCLE', 1800)),
+        }
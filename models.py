@@ -4,6 +4,27 @@ from datetime import datetime
 # Import db from extensions (will be initialized in app factory)
 from extensions import db
 
+
+def cost_memo():
+    """
+    Memo of resolved recipe and secondary costs for the current request, so a
+    sub-recipe shared by many recipes is costed once. Outside a request each
+    call gets a fresh dict. Cleared by utils.cost_cache.refresh_costs on writes.
+    """
+    from flask import g, has_request_context
+    if not has_request_context():
+        return {}
+    if 'cost_memo' not in g:
+        g.cost_memo = {}
+    return g.cost_memo
+
+
+def clear_cost_memo():
+    from flask import g, has_request_context
+    if has_request_context():
+        g.pop('cost_memo', None)
+
+
 # -------------------------
 # USER MODEL
 # -------------------------
@@ -18,13 +39,18 @@ class User(db.Model, UserMixin):
 # PRODUCT MODEL
 # -------------------------
 class Product(db.Model):
+    # The master list sorts and pages on lower(description)
+    __table_args__ = (
+        db.Index('ix_product_description', db.text('lower(description)')),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     unique_item_number = db.Column(db.String(50), unique=True)
     supplier = db.Column(db.String(120))
     barbuddy_code = db.Column(db.String(20), unique=True, nullable=False)
     description = db.Column(db.String(200), nullable=False)
     category = db.Column(db.String(50))
-    sub_category = db.Column(db.String(50))
+    sub_category = db.Column(db.String(50), index=True)
     item_level = db.Column(db.String(20), default='Primary')
     ml_in_bottle = db.Column(db.Float)
     abv = db.Column(db.Float)
@@ -35,6 +61,8 @@ class Product(db.Model):
     bottles_per_case = db.Column(db.Integer, default=1)
     case_cost = db.Column(db.Float, default=0.0)
     image_path = db.Column(db.String(255))
+    # Materialized cost layer, maintained by utils.cost_cache.refresh_costs
+    cached_unit_cost = db.Column(db.Float)
 
     def calculate_case_cost(self):
         if self.purchase_type == "case":
@@ -55,6 +83,9 @@ class HomemadeIngredient(db.Model):
     unit = db.Column(db.String(20), default="ml")
     method = db.Column(db.Text)
     ingredients = db.relationship('HomemadeIngredientItem', backref='homemade', cascade='all, delete-orphan')
+    # Materialized cost layer, maintained by utils.cost_cache.refresh_costs
+    cached_cost = db.Column(db.Float)
+    cached_cost_per_unit = db.Column(db.Float)
 
     def calculate_cost(self):
         return round(sum(i.calculate_cost() for i in self.ingredients), 2)
@@ -67,8 +98,8 @@ class HomemadeIngredient(db.Model):
 
 class HomemadeIngredientItem(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    homemade_id = db.Column(db.Integer, db.ForeignKey('homemade_ingredient.id'), nullable=False)
-    product_id = db.Column(db.Integer, db.ForeignKey('product.id'), nullable=False)
+    homemade_id = db.Column(db.Integer, db.ForeignKey('homemade_ingredient.id'), nullable=False, index=True)
+    product_id = db.Column(db.Integer, db.ForeignKey('product.id'), nullable=False, index=True)
     quantity_ml = db.Column(db.Float, nullable=False)
     quantity = db.Column(db.Float, default=0)
     unit = db.Column(db.String(20), default="ml")
@@ -118,8 +149,8 @@ class Recipe(db.Model):
     recipe_code = db.Column(db.String(50), unique=True)
     title = db.Column(db.String(150), nullable=False)
     method = db.Column(db.Text)
-    recipe_type = db.Column(db.String(20))
-    type = db.Column(db.String(20))
+    recipe_type = db.Column(db.String(20), index=True)
+    type = db.Column(db.String(20), index=True)
     item_level = db.Column(db.String(20), default='Primary')
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
@@ -131,22 +162,39 @@ class Recipe(db.Model):
     service_charge_percentage = db.Column(db.Float, default=0.0)
     government_fees_percentage = db.Column(db.Float, default=0.0)
     garnish = db.Column(db.Text)
+    # Materialized cost layer, maintained by utils.cost_cache.refresh_costs
+    cached_total_cost = db.Column(db.Float)
+    cached_cost_percentage = db.Column(db.Float)
 
-    def calculate_total_cost(self):
-        """Calculate total cost including nested recipes"""
+    def calculate_total_cost(self, _memo=None, _visiting=None):
+        """Calculate total cost including nested recipes (memoized per request, cycle-safe)"""
+        memo = cost_memo() if _memo is None else _memo
+        key = ('Recipe', self.id)
+        if key in memo:
+            return memo[key]
+        visiting = set() if _visiting is None else _visiting
+        if self.id in visiting:
+            import logging
+            logging.error(f"Recipe {self.id} includes itself; costing the nested copy as 0.0")
+            return 0.0
+        visiting.add(self.id)
         try:
             total = 0.0
             for i in self.ingredients:
-                cost = i.calculate_cost()
+                cost = i.calculate_cost(_memo=memo, _visiting=visiting)
                 total += cost
-            return round(total, 2)
+            memo[key] = round(total, 2)
+            return memo[key]
         except Exception as e:
             import logging
             logging.error(f"Error calculating total cost for Recipe {self.id}: {str(e)}")
             return 0.0
+        finally:
+            visiting.discard(self.id)
 
-    def cost_percentage(self):
-        total_cost = self.calculate_total_cost()
+    def cost_percentage(self, total_cost=None):
+        if total_cost is None:
+            total_cost = self.calculate_total_cost()
         # Selling price is inclusive of VAT, Service Charge, and Government Fees
         # Calculate base selling price by deducting fees
         if self.selling_price and self.selling_price > 0:
@@ -225,8 +273,13 @@ class Recipe(db.Model):
             return {"Alcohol":0,"Syrups & Purees":0,"Juices":0,"Fruits":0,"Vegetables":0,"Dairy":0,"Non-Alcohol":0,"Other":0}
 
 class RecipeIngredient(db.Model):
+    # Reverse lookups for the where-used graph (utils/where_used.py)
+    __table_args__ = (
+        db.Index('ix_recipe_ingredient_ingredient', 'ingredient_type', 'ingredient_id'),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
-    recipe_id = db.Column(db.Integer, db.ForeignKey('recipe.id'), nullable=False)
+    recipe_id = db.Column(db.Integer, db.ForeignKey('recipe.id'), nullable=False, index=True)
     ingredient_type = db.Column(db.String(20))
     ingredient_id = db.Column(db.Integer)
     quantity = db.Column(db.Float)
@@ -235,20 +288,25 @@ class RecipeIngredient(db.Model):
     product_type = db.Column(db.String(20))
     product_id = db.Column(db.Integer)
 
-    def get_product(self):
-        """Get the ingredient (Product, HomemadeIngredient, or Recipe)"""
+    def ingredient_ref(self):
+        """Return (type, id) of the ingredient, handling legacy product_type/product_id rows"""
         if self.ingredient_type:
-            if self.ingredient_type == "Product":
-                return Product.query.get(self.ingredient_id)
-            elif self.ingredient_type == "Homemade":
-                return HomemadeIngredient.query.get(self.ingredient_id)
-            elif self.ingredient_type == "Recipe":
-                return Recipe.query.get(self.ingredient_id)
+            return self.ingredient_type, self.ingredient_id
         elif self.product_type:
             if self.product_type == "Product":
-                return Product.query.get(self.product_id)
-            else:
-                return HomemadeIngredient.query.get(self.product_id)
+                return "Product", self.product_id
+            return "Homemade", self.product_id
+        return None, None
+
+    def get_product(self):
+        """Get the ingredient (Product, HomemadeIngredient, or Recipe)"""
+        kind, ref_id = self.ingredient_ref()
+        if kind == "Product":
+            return Product.query.get(ref_id)
+        elif kind == "Homemade":
+            return HomemadeIngredient.query.get(ref_id)
+        elif kind == "Recipe":
+            return Recipe.query.get(ref_id)
         return None
     
     def get_quantity(self):
@@ -259,7 +317,7 @@ class RecipeIngredient(db.Model):
             return self.quantity_ml
         return 0.0
 
-    def calculate_cost(self):
+    def calculate_cost(self, _memo=None, _visiting=None):
         """Calculate cost based on ingredient type"""
         try:
             ingredient = self.get_product()
@@ -286,11 +344,14 @@ class RecipeIngredient(db.Model):
                     return round(ingredient.cost_per_unit * qty, 2)
             
             elif isinstance(ingredient, HomemadeIngredient):
-                cost_per_unit = ingredient.calculate_cost_per_unit()
-                return round(cost_per_unit * qty, 2)
+                memo = cost_memo() if _memo is None else _memo
+                key = ('Homemade', ingredient.id)
+                if key not in memo:
+                    memo[key] = ingredient.calculate_cost_per_unit()
+                return round(memo[key] * qty, 2)
             
             elif isinstance(ingredient, Recipe):
-                recipe_cost = ingredient.calculate_total_cost()
+                recipe_cost = ingredient.calculate_total_cost(_memo=_memo, _visiting=_visiting)
                 return round(recipe_cost * qty, 2)
             
             return 0.0
@@ -299,3 +360,65 @@ class RecipeIngredient(db.Model):
             import logging
             logging.error(f"Error calculating cost for RecipeIngredient {self.id}: {str(e)}")
             return 0.0
+
+
+# -------------------------
+# CATALOG VERSION
+# -------------------------
+class CatalogVersion(db.Model):
+    """
+    Single-row counter bumped in the same transaction as every write to
+    products, secondary ingredients or recipes (see utils.catalog_version),
+    so in-process caches of catalog data can tell when they are stale.
+    """
+    id = db.Column(db.Integer, primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+
+
+# -------------------------
+# CODE SEQUENCES
+# -------------------------
+class CodeSequence(db.Model):
+    """
+    Next number to hand out per code namespace (BB, ITEM, REC, SEC); see
+    utils.code_sequences.
+    """
+    __tablename__ = 'code_sequence'
+
+    namespace = db.Column(db.String(10), primary_key=True)
+    next_value = db.Column(db.Integer, nullable=False, default=1)
+
+
+# -------------------------
+# BACKGROUND JOBS
+# -------------------------
+class Job(db.Model):
+    """
+    A unit of work for the `flask worker` process (see utils.jobs). payload
+    and result hold JSON; progress counts rows or steps done out of total.
+    """
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(50), nullable=False)
+    status = db.Column(db.String(20), nullable=False, default='queued', index=True)
+    payload = db.Column(db.Text)
+    result = db.Column(db.Text)
+    message = db.Column(db.Text)
+    progress = db.Column(db.Integer, nullable=False, default=0)
+    total = db.Column(db.Integer)
+    created_by = db.Column(db.Integer, db.ForeignKey('user.id'))
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    started_at = db.Column(db.DateTime)
+    updated_at = db.Column(db.DateTime)
+    finished_at = db.Column(db.DateTime)
+
+
+# -------------------------
+# SCHEMA VERSIONS
+# -------------------------
+class SchemaVersion(db.Model):
+    """One row per migration applied by `flask migrate` (see utils.migrations)"""
+    __tablename__ = 'schema_version'
+
+    version = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    name = db.Column(db.String(100), nullable=False)
+    applied_at = db.Column(db.DateTime, default=datetime.utcnow)
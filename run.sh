@@ -21,5 +21,6 @@ fi
 
 export FLASK_APP=app.py
 export FLASK_ENV=development
+python -m flask migrate
 python -m flask run --host=127.0.0.1 --port=5001
 
@@ -0,0 +1,82 @@
+// Ingredient typeahead for the recipe and secondary ingredient forms.
+// Options are fetched a page at a time from /ingredients/options as the user
+// types and kept in a local map, so rows can still be costed by label.
+function IngredientOptions(url, datalistId, initialOptions) {
+    this.url = url;
+    this.datalist = document.getElementById(datalistId);
+    this.map = {};
+    this.byRef = {};
+    this.pending = null;
+    this.lastQuery = null;
+    this.add(initialOptions || []);
+}
+
+IngredientOptions.prototype.add = function(options) {
+    const map = this.map;
+    const byRef = this.byRef;
+    options.forEach(function(opt) {
+        byRef[opt.type + ':' + opt.id] = opt;
+        const labelKey = (opt.label || '').toLowerCase();
+        if (labelKey) {
+            map[labelKey] = opt;
+            const simple = labelKey.split('(')[0].trim();
+            if (simple && !map[simple]) {
+                map[simple] = opt;
+            }
+        }
+        const descriptionKey = (opt.description || '').toLowerCase();
+        if (descriptionKey && !map[descriptionKey]) {
+            map[descriptionKey] = opt;
+        }
+        if (opt.code) {
+            map[String(opt.code).toLowerCase()] = opt;
+        }
+    });
+};
+
+IngredientOptions.prototype.find = function(label) {
+    if (!label) return null;
+    const key = label.trim().toLowerCase();
+    if (this.map[key]) return this.map[key];
+    const simple = key.split('(')[0].trim();
+    return (simple && this.map[simple]) || null;
+};
+
+IngredientOptions.prototype.get = function(id, type) {
+    return this.byRef[type + ':' + id] || null;
+};
+
+// Fetch suggestions for what has been typed; resolves once they are in the map
+IngredientOptions.prototype.search = function(text) {
+    const self = this;
+    const query = (text || '').split('(')[0].trim();
+    if (!query || query === self.lastQuery) {
+        return Promise.resolve();
+    }
+    self.lastQuery = query;
+    clearTimeout(self.pending);
+    return new Promise(function(resolve) {
+        self.pending = setTimeout(function() {
+            // Default browser caching revalidates with the ETag, so repeats are a 304
+            fetch(self.url + '?q=' + encodeURIComponent(query), {credentials: 'same-origin'})
+                .then(function(response) { return response.ok ? response.json() : {options: []}; })
+                .then(function(data) {
+                    self.add(data.options);
+                    self.showSuggestions(data.options);
+                    resolve();
+                })
+                .catch(function() { resolve(); });
+        }, 150);
+    });
+};
+
+IngredientOptions.prototype.showSuggestions = function(options) {
+    if (!this.datalist) return;
+    const fragment = document.createDocumentFragment();
+    options.forEach(function(opt) {
+        const option = document.createElement('option');
+        option.value = opt.label;
+        fragment.appendChild(option);
+    });
+    this.datalist.replaceChildren(fragment);
+};
@@ -0,0 +1,41 @@
+// Background upload progress: polls the #jobStatus box's data-url until the job finishes
+(function pollJobStatus() {
+    const box = document.getElementById('jobStatus');
+    if (!box) return;
+    const text = document.getElementById('jobStatusText');
+    const bar = document.getElementById('jobProgress');
+    fetch(box.dataset.url, { headers: { 'Accept': 'application/json' } })
+        .then(function(response) { return response.ok ? response.json() : null; })
+        .then(function(job) {
+            if (!job) {
+                text.textContent = 'This upload could not be found.';
+                return;
+            }
+            if (job.status === 'queued') {
+                text.textContent = 'Waiting for a worker to pick up the upload (flask worker)...';
+            } else if (job.status === 'running') {
+                text.textContent = (job.message || 'Importing') + (job.total ? ` (${job.progress} of ${job.total})` : '...');
+                if (job.total) {
+                    bar.max = job.total;
+                    bar.value = job.progress;
+                }
+            } else {
+                bar.max = 1;
+                bar.value = job.status === 'done' ? 1 : 0;
+                text.textContent = job.status === 'done' ? job.message : `Upload failed: ${job.message}`;
+                const errors = document.getElementById('jobErrors');
+                const result = job.result || {};
+                (result.errors || []).concat((result.unresolved || []).map(function(code) {
+                    return `Unknown ingredient code: ${code}`;
+                })).forEach(function(line) {
+                    const item = document.createElement('li');
+                    item.textContent = line;
+                    errors.appendChild(item);
+                });
+                document.getElementById('jobDone').hidden = false;
+                return;
+            }
+            setTimeout(pollJobStatus, 1500);
+        })
+        .catch(function() { setTimeout(pollJobStatus, 5000); });
+})();
@@ -0,0 +1,44 @@
+"""
+Shared fixtures: an app on a temporary SQLite database built with the
+migrations, holding one user, and a test client logged in as that user.
+"""
+import os
+
+# The module-level app in app.py must not open the development database
+os.environ.setdefault('DATABASE_URL', 'sqlite://')
+
+import pytest
+from werkzeug.security import generate_password_hash
+
+from app import create_app
+from config import Config
+from extensions import db
+from models import User
+
+
+@pytest.fixture
+def app(tmp_path):
+    config = type('TestConfig', (Config,), {
+        'SQLALCHEMY_DATABASE_URI': f"sqlite:///{tmp_path / 'test.db'}",
+        'RESPONSE_CACHE': 'none',
+    })
+    app = create_app(config)
+    with app.app_context():
+        from utils.migrations import run_migrations
+        run_migrations()
+        user = User(username='bartender', email='bartender@example.com', password=generate_password_hash('secret'))
+        db.session.add(user)
+        db.session.commit()
+        app.config['USER_ID'] = user.id
+    yield app
+    with app.app_context():
+        db.session.remove()
+        db.engine.dispose()
+
+
+@pytest.fixture
+def client(app):
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session['_user_id'] = str(app.config['USER_ID'])
+    return client
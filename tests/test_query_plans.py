@@ -0,0 +1,107 @@
+"""
+Query plans
+Requests the recipe list, master list, secondary ingredient list and recipe
+code lookup pages, records every SELECT they issue and runs EXPLAIN QUERY
+PLAN on it. A plan step that reads one of the page's checked tables from
+start to end without an index (SCAN <table>) fails the test, so a query
+change that loses its index is caught before it reaches a large catalog.
+
+    python -m pytest tests/test_query_plans.py
+"""
+import re
+
+import pytest
+from sqlalchemy import event
+
+from extensions import db
+from models import Product, HomemadeIngredient, HomemadeIngredientItem, Recipe, RecipeIngredient
+
+FULL_SCAN = re.compile(r'^SCAN (?:TABLE )?(\w+)(?: AS \w+)?$')
+
+INGREDIENT_TABLES = {'recipe_ingredient', 'homemade_ingredient_item', 'product', 'homemade_ingredient'}
+
+# Page URL -> tables its queries must reach through an index
+PAGES = {
+    'recipe_list': ('/recipes/cocktails', {'recipe'} | INGREDIENT_TABLES),
+    'recipes_list by category': ('/recipes?category=mocktails', INGREDIENT_TABLES),
+    'ingredients_master': ('/ingredients', {'product'}),
+    'ingredients_master by category': ('/ingredients?category=Juice', {'product'}),
+    'secondary_ingredients': ('/secondary-ingredients', {'homemade_ingredient_item', 'product'}),
+    'recipe code lookup': ('/recipes/REC-0001', {'recipe'} | INGREDIENT_TABLES),
+}
+
+
+@pytest.fixture
+def catalog(app):
+    """A few products, secondary ingredients and recipes of every category, some nested"""
+    with app.app_context():
+        user_id = app.config['USER_ID']
+        products = [Product(barbuddy_code=f'BB{i:03d}', unique_item_number=f'ITEM-{i:06d}', description=f'Product {i}',
+                            sub_category=('Alcohol', 'Juice', 'Dairy')[i % 3], supplier='Supplier',
+                            selling_unit='ml', cost_per_unit=1 + i, ml_in_bottle=700)
+                    for i in range(1, 13)]
+        db.session.add_all(products)
+        db.session.flush()
+        secondaries = []
+        for i in range(1, 4):
+            secondary = HomemadeIngredient(name=f'Syrup {i}', unique_code=f'SEC-{i:04d}', total_volume_ml=1000,
+                                           created_by=user_id)
+            db.session.add(secondary)
+            db.session.flush()
+            for product in products[i:i + 3]:
+                db.session.add(HomemadeIngredientItem(homemade_id=secondary.id, product_id=product.id,
+                                                      quantity=50, quantity_ml=50))
+            secondaries.append(secondary)
+        recipes = []
+        for i, category in enumerate(['Cocktails', 'Mocktails', 'Beverages'] * 2, start=1):
+            recipe = Recipe(recipe_code=f'REC-{i:04d}', title=f'Recipe {i}', type=category, recipe_type='Beverage',
+                            user_id=user_id, selling_price=45)
+            db.session.add(recipe)
+            db.session.flush()
+            lines = [('Product', products[i].id), ('Product', products[i + 1].id),
+                     ('Homemade', secondaries[i % 3].id)]
+            if recipes:
+                lines.append(('Recipe', recipes[0].id))
+            for kind, ingredient_id in lines:
+                db.session.add(RecipeIngredient(recipe_id=recipe.id, ingredient_type=kind, ingredient_id=ingredient_id,
+                                                quantity=20, unit='ml', quantity_ml=20, product_type=kind,
+                                                product_id=ingredient_id))
+            recipes.append(recipe)
+        from utils.cost_cache import refresh_all_costs
+        refresh_all_costs()
+        db.session.commit()
+
+
+def full_scans(conn, statement, parameters):
+    """Tables EXPLAIN QUERY PLAN reads without an index, with the plan lines"""
+    plan = [row[-1] for row in conn.exec_driver_sql(f'EXPLAIN QUERY PLAN {statement}', parameters)]
+    tables = {match.group(1) for match in map(FULL_SCAN.match, plan) if match}
+    return tables, plan
+
+
+@pytest.mark.parametrize('page', list(PAGES))
+def test_page_queries_use_indexes(app, client, catalog, page):
+    url, tables = PAGES[page]
+    captured = []
+
+    def capture(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith(('SELECT', 'WITH')):
+            captured.append((statement, parameters))
+
+    with app.app_context():
+        engine = db.engine
+    event.listen(engine, 'before_cursor_execute', capture)
+    try:
+        response = client.get(url)
+    finally:
+        event.remove(engine, 'before_cursor_execute', capture)
+    assert response.status_code == 200
+    assert captured
+
+    violations = []
+    with engine.connect() as conn:
+        for statement, parameters in dict.fromkeys(captured):
+            scanned, plan = full_scans(conn, statement, parameters)
+            if scanned & tables:
+                violations.append((' '.join(statement.split()), plan))
+    assert violations == []
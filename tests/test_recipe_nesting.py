@@ -0,0 +1,82 @@
+"""
+Recipe nesting
+Editing a recipe so that it includes itself, directly or through another
+recipe, is rejected and leaves the recipe's ingredient lines unchanged.
+
+    python -m pytest tests
+"""
+import pytest
+
+from extensions import db
+from models import Product, Recipe, RecipeIngredient
+
+
+def _line(recipe, kind, ingredient_id):
+    return RecipeIngredient(recipe_id=recipe.id, ingredient_type=kind, ingredient_id=ingredient_id, quantity=1,
+                            unit='ml', quantity_ml=1, product_type=kind, product_id=ingredient_id)
+
+
+@pytest.fixture
+def ids(app):
+    with app.app_context():
+        user_id = app.config['USER_ID']
+        product = Product(barbuddy_code='BB001', description='Gin', cost_per_unit=0.1, selling_unit='ml')
+        outer = Recipe(title='Outer', recipe_code='REC-0001', type='Cocktails', user_id=user_id)
+        inner = Recipe(title='Inner', recipe_code='REC-0002', type='Cocktails', user_id=user_id)
+        db.session.add_all([product, outer, inner])
+        db.session.flush()
+        # Outer already includes Inner
+        db.session.add_all([_line(outer, 'Product', product.id), _line(outer, 'Recipe', inner.id),
+                            _line(inner, 'Product', product.id)])
+        db.session.commit()
+        return {'user': user_id, 'product': product.id, 'outer': outer.id, 'inner': inner.id}
+
+
+def _edit(client, recipe_id, lines):
+    return client.post(f'/recipes/{recipe_id}/edit', data={
+        'title': 'Edited',
+        'ingredient_id': [str(ingredient_id) for _, ingredient_id in lines],
+        'ingredient_type': [kind for kind, _ in lines],
+        'ingredient_qty': ['1'] * len(lines),
+        'ingredient_unit': ['ml'] * len(lines),
+    })
+
+
+def _lines(app, recipe_id):
+    with app.app_context():
+        return sorted((line.ingredient_type, line.ingredient_id)
+                      for line in RecipeIngredient.query.filter_by(recipe_id=recipe_id))
+
+
+@pytest.mark.parametrize('case', ['itself', 'through another recipe'])
+def test_edit_rejects_cyclic_nesting(app, client, ids, case):
+    if case == 'itself':
+        recipe_id, nested_id = ids['outer'], ids['outer']
+    else:
+        recipe_id, nested_id = ids['inner'], ids['outer']
+    before = _lines(app, recipe_id)
+
+    response = _edit(client, recipe_id, [('Product', ids['product']), ('Recipe', nested_id)])
+
+    assert response.status_code == 302
+    assert response.headers['Location'].endswith(f'/recipes/{recipe_id}/edit')
+    with client.session_transaction() as session:
+        messages = [message for _, message in session.get('_flashes', [])]
+    assert any('cannot be used as one of its ingredients' in message for message in messages)
+    assert _lines(app, recipe_id) == before
+    with app.app_context():
+        assert db.session.get(Recipe, recipe_id).title != 'Edited'
+
+
+def test_edit_accepts_acyclic_nesting(app, client, ids):
+    with app.app_context():
+        standalone = Recipe(title='Standalone', recipe_code='REC-0003', type='Cocktails', user_id=ids['user'])
+        db.session.add(standalone)
+        db.session.commit()
+        standalone_id = standalone.id
+
+    response = _edit(client, standalone_id, [('Product', ids['product']), ('Recipe', ids['inner'])])
+
+    assert response.status_code == 302
+    assert '/edit' not in response.headers['Location']
+    assert _lines(app, standalone_id) == sorted([('Product', ids['product']), ('Recipe', ids['inner'])])
@@ -0,0 +1,69 @@
+"""
+Catalog version
+A single counter that changes whenever any Product, HomemadeIngredient,
+Recipe or their ingredient lines are written. Session hooks bump it inside
+the writing transaction, covering both unit-of-work flushes and ORM bulk
+insert/update/delete statements, so it is correct across worker processes.
+"""
+from sqlalchemy import event, select, update
+from extensions import db
+from models import (
+    Product, HomemadeIngredient, HomemadeIngredientItem, Recipe, RecipeIngredient, CatalogVersion
+)
+
+CATALOG_MODELS = (Product, HomemadeIngredient, HomemadeIngredientItem, Recipe, RecipeIngredient)
+
+_BUMP = update(CatalogVersion.__table__).values(version=CatalogVersion.__table__.c.version + 1)
+
+
+def current_version():
+    """The current catalog version (0 before anything has been written)"""
+    version = db.session.execute(
+        select(CatalogVersion.__table__.c.version).where(CatalogVersion.__table__.c.id == 1)
+    ).scalar()
+    return version or 0
+
+
+def bump_catalog_version(session=None):
+    """Increment the catalog version in the session's current transaction"""
+    (session or db.session).connection().execute(_BUMP)
+
+
+def ensure_catalog_version():
+    """Create the counter row if it does not exist yet"""
+    if db.session.get(CatalogVersion, 1) is None:
+        db.session.add(CatalogVersion(id=1, version=0))
+        db.session.commit()
+
+
+def _writes_catalog(session):
+    for obj in session.new:
+        if isinstance(obj, CATALOG_MODELS):
+            return True
+    for obj in session.deleted:
+        if isinstance(obj, CATALOG_MODELS):
+            return True
+    for obj in session.dirty:
+        if isinstance(obj, CATALOG_MODELS) and session.is_modified(obj, include_collections=False):
+            return True
+    return False
+
+
+def _bump_on_flush(session, flush_context, instances):
+    if _writes_catalog(session):
+        bump_catalog_version(session)
+
+
+def _bump_on_bulk_statement(orm_execute_state):
+    if not (orm_execute_state.is_insert or orm_execute_state.is_update or orm_execute_state.is_delete):
+        return
+    mapper = orm_execute_state.bind_mapper
+    if mapper is not None and issubclass(mapper.class_, CATALOG_MODELS):
+        bump_catalog_version(orm_execute_state.session)
+
+
+def register_catalog_version_hooks():
+    """Attach the bump hooks to db.session (idempotent)"""
+    if not event.contains(db.session, 'before_flush', _bump_on_flush):
+        event.listen(db.session, 'before_flush', _bump_on_flush)
+        event.listen(db.session, 'do_orm_execute', _bump_on_bulk_statement)
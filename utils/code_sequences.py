@@ -0,0 +1,95 @@
+"""
+Code sequences
+Hands out product codes (BB001), unique item numbers (ITEM-000001), recipe
+codes (REC-0001) and secondary ingredient codes (SEC-0001) from the
+code_sequence table. A block of any size is reserved with one
+UPDATE ... RETURNING in the caller's transaction, so concurrent workers
+never get the same numbers and a rolled back transaction gives its numbers
+back. Numbers whose code is already taken (typed in by hand or imported
+from a spreadsheet) are skipped.
+"""
+import re
+from sqlalchemy import select, update
+from sqlalchemy.exc import IntegrityError
+from extensions import db
+from models import CodeSequence, Product, HomemadeIngredient, Recipe
+from utils.costing import chunked
+
+# Namespace -> (prefix, digits, column holding the codes)
+NAMESPACES = {
+    'BB': ('BB', 3, Product.barbuddy_code),
+    'ITEM': ('ITEM-', 6, Product.unique_item_number),
+    'REC': ('REC-', 4, Recipe.recipe_code),
+    'SEC': ('SEC-', 4, HomemadeIngredient.unique_code),
+}
+
+# Longer suffixes are timestamp codes from old fallbacks, not part of the sequence
+MAX_SEQUENCE_DIGITS = 8
+
+_sequence = CodeSequence.__table__
+
+
+def _highest_number(namespace):
+    prefix, _, column = NAMESPACES[namespace]
+    pattern = re.compile(re.escape(prefix) + r'(\d{1,%d})$' % MAX_SEQUENCE_DIGITS)
+    codes = db.session.scalars(select(column).where(column.like(f'{prefix}%')))
+    return max((int(match.group(1)) for match in map(pattern.match, codes) if match), default=0)
+
+
+def seed_code_sequence(namespace):
+    """Create the namespace's row, starting after the highest code in use (no-op if it exists)"""
+    if db.session.get(CodeSequence, namespace) is not None:
+        return
+    try:
+        # Savepoint, so losing a race with another worker leaves the caller's transaction intact
+        with db.session.begin_nested():
+            db.session.add(CodeSequence(namespace=namespace, next_value=_highest_number(namespace) + 1))
+    except IntegrityError:
+        pass
+
+
+def _reserve(namespace, count):
+    """Advance the namespace by count and return the first number of the reserved block"""
+    statement = (
+        update(_sequence)
+        .where(_sequence.c.namespace == namespace)
+        .values(next_value=_sequence.c.next_value + count)
+        .returning(_sequence.c.next_value)
+    )
+    next_value = db.session.execute(statement).scalar()
+    if next_value is None:
+        seed_code_sequence(namespace)
+        next_value = db.session.execute(statement).scalar()
+    return next_value - count
+
+
+def allocate_codes(namespace, count, taken=None):
+    """
+    Return count new codes of namespace (e.g. 'REC'). Codes already in the
+    table or in the optional taken set are skipped, and the returned codes
+    are added to taken. The reservation commits or rolls back with the
+    caller's transaction.
+    """
+    prefix, width, column = NAMESPACES[namespace]
+    codes = []
+    while len(codes) < count:
+        needed = count - len(codes)
+        start = _reserve(namespace, needed)
+        block = [f'{prefix}{number:0{width}d}' for number in range(start, start + needed)]
+        used = set()
+        for chunk in chunked(block):
+            used.update(db.session.scalars(select(column).where(column.in_(chunk))))
+        codes.extend(code for code in block if code not in used and not (taken and code in taken))
+    if taken is not None:
+        taken.update(codes)
+    return codes
+
+
+def allocate_code(namespace):
+    """One new code of namespace"""
+    return allocate_codes(namespace, 1)[0]
+
+
+def seed_code_sequences():
+    for namespace in NAMESPACES:
+        seed_code_sequence(namespace)
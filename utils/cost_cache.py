@@ -0,0 +1,111 @@
+"""
+Materialized cost cache
+Stores the per-unit cost of every Product, the batch cost and cost per unit of
+every HomemadeIngredient, and the total cost and cost % of every Recipe.
+Write paths call refresh_costs() before committing, so cached values always
+change in the same transaction as the prices they are derived from.
+"""
+from extensions import db
+from models import Product, HomemadeIngredient, Recipe, clear_cost_memo
+from utils.costing import CostingEngine, cost_percentage, product_unit_cost, build_cost_map
+from utils.where_used import dependency_plan
+
+
+def _store(engine, product_ids, homemade_ids, recipe_ids):
+    """Write engine results to the cache columns; recipe_ids should be nested-first"""
+    for product_id in product_ids:
+        product = engine.products.get(product_id)
+        if product:
+            product.cached_unit_cost = product_unit_cost(product)
+    for homemade_id in homemade_ids:
+        homemade = engine.homemades.get(homemade_id)
+        if homemade:
+            homemade.cached_cost, homemade.cached_cost_per_unit = engine.homemade_cost(homemade_id)
+    for recipe_id in recipe_ids:
+        recipe = engine.recipes.get(recipe_id)
+        if recipe:
+            total = engine.recipe_cost(recipe_id)
+            recipe.cached_total_cost = total
+            recipe.cached_cost_percentage = cost_percentage(recipe, total)
+
+
+def refresh_costs(product_ids=(), homemade_ids=(), recipe_ids=()):
+    """
+    Recompute cached costs for the given rows and everything that uses them.
+    Call after making changes and before db.session.commit(); ids of rows
+    deleted in the same transaction are fine and refresh their dependents.
+    """
+    db.session.flush()
+    # Collections edited through bulk deletes or raw foreign keys are stale until reloaded
+    db.session.expire_all()
+    clear_cost_memo()
+    plan = dependency_plan(product_ids, homemade_ids, recipe_ids)
+    # Only affected nodes are recomputed; everything else is priced from its cached cost
+    engine = CostingEngine(stale_recipe_ids=plan.recipe_ids, stale_homemade_ids=plan.homemade_ids)
+    engine.load(plan.recipe_ids)
+    engine.load_homemades(plan.homemade_ids)
+    engine.load_products(plan.product_ids)
+    _store(engine, plan.product_ids, plan.homemade_ids, plan.recipe_order)
+
+
+def refresh_all_costs():
+    """Recompute the cached costs of the whole catalog"""
+    db.session.flush()
+    db.session.expire_all()
+    clear_cost_memo()
+    product_ids = {row[0] for row in db.session.query(Product.id)}
+    homemade_ids = {row[0] for row in db.session.query(HomemadeIngredient.id)}
+    recipe_ids = {row[0] for row in db.session.query(Recipe.id)}
+    engine = CostingEngine()
+    engine.load(recipe_ids)
+    engine.load_homemades(homemade_ids)
+    engine.load_products(product_ids)
+    _store(engine, product_ids, homemade_ids, recipe_ids)
+
+
+def backfill_cost_cache():
+    """Fill cached costs for rows created before the cache existed. Returns the number of rows filled."""
+    product_ids = [row[0] for row in db.session.query(Product.id).filter(Product.cached_unit_cost.is_(None))]
+    homemade_ids = [row[0] for row in db.session.query(HomemadeIngredient.id).filter(HomemadeIngredient.cached_cost.is_(None))]
+    recipe_ids = [row[0] for row in db.session.query(Recipe.id).filter(Recipe.cached_total_cost.is_(None))]
+    count = len(product_ids) + len(homemade_ids) + len(recipe_ids)
+    if count:
+        refresh_costs(product_ids, homemade_ids, recipe_ids)
+        db.session.commit()
+    return count
+
+
+# -------------------------
+# Reads
+# -------------------------
+def recipe_cost_map(recipes):
+    """{recipe_id: {'total_cost', 'cost_percentage'}} from the cache, computing any uncached rows"""
+    costs = {}
+    uncached = []
+    for recipe in recipes:
+        if recipe.cached_total_cost is None:
+            uncached.append(recipe)
+        else:
+            costs[recipe.id] = {
+                'total_cost': recipe.cached_total_cost,
+                'cost_percentage': recipe.cached_cost_percentage,
+            }
+    if uncached:
+        costs.update(build_cost_map(uncached))
+    return costs
+
+
+def homemade_cost_map(homemades):
+    """{homemade_id: (batch cost, cost per unit)} from the cache, computing any uncached rows"""
+    costs = {}
+    uncached = []
+    for homemade in homemades:
+        if homemade.cached_cost is None or homemade.cached_cost_per_unit is None:
+            uncached.append(homemade.id)
+        else:
+            costs[homemade.id] = (homemade.cached_cost, homemade.cached_cost_per_unit)
+    if uncached:
+        engine = CostingEngine().load_homemades(uncached)
+        for homemade_id in uncached:
+            costs[homemade_id] = engine.homemade_cost(homemade_id)
+    return costs
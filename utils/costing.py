@@ -0,0 +1,250 @@
+"""
+Recipe costing engine
+Bulk-loads every Product, HomemadeIngredient and nested Recipe referenced by a
+set of recipes and computes their costs in memory, so list and view pages run
+a fixed number of queries instead of one per ingredient row.
+"""
+import logging
+from sqlalchemy.orm import selectinload
+from models import Product, HomemadeIngredient, Recipe
+
+# Keep IN (...) lists below SQLite's bound-parameter limit
+QUERY_CHUNK_SIZE = 500
+
+
+def chunked(values, size=QUERY_CHUNK_SIZE):
+    """Yield successive lists of at most `size` items"""
+    values = list(values)
+    for start in range(0, len(values), size):
+        yield values[start:start + size]
+
+
+def product_unit_cost(product):
+    """Cost of one recipe unit (ml, gram or piece) of a product"""
+    cost = product.cost_per_unit
+    if not cost:
+        return 0.0
+    if product.selling_unit in ('ml', 'grams', 'pieces'):
+        return cost
+    if product.ml_in_bottle and product.ml_in_bottle > 0:
+        # cost_per_unit is the cost of the whole bottle
+        return cost / product.ml_in_bottle
+    return cost
+
+
+def base_selling_price(recipe):
+    """Selling price with VAT, service charge and government fees deducted"""
+    if not recipe.selling_price or recipe.selling_price <= 0:
+        return None
+    total_fees_percentage = (
+        (recipe.vat_percentage or 0.0)
+        + (recipe.service_charge_percentage or 0.0)
+        + (recipe.government_fees_percentage or 0.0)
+    )
+    if total_fees_percentage > 0:
+        return recipe.selling_price / (1 + total_fees_percentage / 100)
+    return recipe.selling_price
+
+
+def cost_percentage(recipe, total_cost):
+    """Cost as a percentage of the fee-exclusive selling price"""
+    base_price = base_selling_price(recipe)
+    if base_price is None:
+        return None
+    return round((total_cost / base_price) * 100, 2)
+
+
+class CostingEngine:
+    """
+    Resolves recipe costs from bulk-loaded ingredients.
+
+    Load recipes with `load()` (ids) or `load_recipes()` (already-fetched
+    objects); every referenced ingredient is fetched in one query per type
+    and nesting level. Costs are computed with the same rounding as the
+    `calculate_*` methods in models.py and memoized per engine instance.
+
+    When `stale_recipe_ids`/`stale_homemade_ids` are given, every other
+    recipe or secondary ingredient with a cached cost is treated as a leaf
+    priced from its cache, so only the stale part of the graph is loaded.
+    """
+
+    def __init__(self, stale_recipe_ids=None, stale_homemade_ids=None):
+        self.recipes = {}
+        self.homemades = {}
+        self.products = {}
+        self._recipe_costs = {}
+        self._homemade_costs = {}
+        self.stale_recipe_ids = None if stale_recipe_ids is None else set(stale_recipe_ids)
+        self.stale_homemade_ids = None if stale_homemade_ids is None else set(stale_homemade_ids)
+
+    def _cached_recipe_cost(self, recipe):
+        if self.stale_recipe_ids is None or recipe.id in self.stale_recipe_ids:
+            return None
+        return recipe.cached_total_cost
+
+    def _cached_homemade_cost(self, homemade):
+        if self.stale_homemade_ids is None or homemade.id in self.stale_homemade_ids:
+            return None
+        if homemade.cached_cost is None or homemade.cached_cost_per_unit is None:
+            return None
+        return homemade.cached_cost, homemade.cached_cost_per_unit
+
+    # -------------------------
+    # Loading
+    # -------------------------
+    def load(self, recipe_ids):
+        pending = set(recipe_ids) - self.recipes.keys()
+        recipes = []
+        for chunk in chunked(pending):
+            recipes.extend(
+                Recipe.query.options(selectinload(Recipe.ingredients))
+                .filter(Recipe.id.in_(chunk))
+                .all()
+            )
+        return self.load_recipes(recipes)
+
+    def load_recipes(self, recipes):
+        product_ids = set()
+        homemade_ids = set()
+        batch = list(recipes)
+        while batch:
+            nested_ids = set()
+            for recipe in batch:
+                self.recipes[recipe.id] = recipe
+                cached = self._cached_recipe_cost(recipe)
+                if cached is not None:
+                    self._recipe_costs[recipe.id] = cached
+                    continue
+                for line in recipe.ingredients:
+                    kind, ref_id = line.ingredient_ref()
+                    if ref_id is None:
+                        continue
+                    if kind == 'Product':
+                        product_ids.add(ref_id)
+                    elif kind == 'Homemade':
+                        homemade_ids.add(ref_id)
+                    elif kind == 'Recipe':
+                        nested_ids.add(ref_id)
+            nested_ids -= self.recipes.keys()
+            batch = []
+            for chunk in chunked(nested_ids):
+                batch.extend(
+                    Recipe.query.options(selectinload(Recipe.ingredients))
+                    .filter(Recipe.id.in_(chunk))
+                    .all()
+                )
+
+        self.load_homemades(homemade_ids)
+        return self.load_products(product_ids)
+
+    def load_homemades(self, homemade_ids):
+        product_ids = set()
+        for chunk in chunked(set(homemade_ids) - self.homemades.keys()):
+            for homemade in (HomemadeIngredient.query
+                             .options(selectinload(HomemadeIngredient.ingredients))
+                             .filter(HomemadeIngredient.id.in_(chunk))):
+                self.homemades[homemade.id] = homemade
+                cached = self._cached_homemade_cost(homemade)
+                if cached is not None:
+                    self._homemade_costs[homemade.id] = cached
+                    continue
+                product_ids.update(item.product_id for item in homemade.ingredients)
+        return self.load_products(product_ids)
+
+    def load_products(self, product_ids):
+        for chunk in chunked(set(product_ids) - self.products.keys()):
+            for product in Product.query.filter(Product.id.in_(chunk)):
+                self.products[product.id] = product
+        return self
+
+    # -------------------------
+    # Lookups
+    # -------------------------
+    def ingredient(self, line):
+        """The Product, HomemadeIngredient or Recipe a recipe line points at"""
+        kind, ref_id = line.ingredient_ref()
+        if kind == 'Product':
+            return self.products.get(ref_id)
+        if kind == 'Homemade':
+            return self.homemades.get(ref_id)
+        if kind == 'Recipe':
+            return self.recipes.get(ref_id)
+        return None
+
+    # -------------------------
+    # Costs
+    # -------------------------
+    def item_cost(self, item):
+        """Cost of one HomemadeIngredientItem"""
+        product = self.products.get(item.product_id)
+        if not product:
+            return 0.0
+        return round(product_unit_cost(product) * (item.quantity or 0), 2)
+
+    def homemade_cost(self, homemade_id):
+        """(batch cost, cost per unit) of a secondary ingredient"""
+        if homemade_id not in self._homemade_costs:
+            homemade = self.homemades.get(homemade_id)
+            if not homemade:
+                return 0.0, 0.0
+            total = round(sum(self.item_cost(i) for i in homemade.ingredients), 2)
+            if homemade.total_volume_ml and homemade.total_volume_ml > 0:
+                per_unit = round(total / homemade.total_volume_ml, 4)
+            else:
+                per_unit = 0.0
+            self._homemade_costs[homemade_id] = (total, per_unit)
+        return self._homemade_costs[homemade_id]
+
+    def line_cost(self, line, _visiting=None):
+        """Cost of one RecipeIngredient row"""
+        qty = line.get_quantity()
+        if qty is None or qty <= 0:
+            return 0.0
+        kind, ref_id = line.ingredient_ref()
+        if kind == 'Product':
+            product = self.products.get(ref_id)
+            return round(product_unit_cost(product) * qty, 2) if product else 0.0
+        if kind == 'Homemade':
+            return round(self.homemade_cost(ref_id)[1] * qty, 2)
+        if kind == 'Recipe':
+            return round(self.recipe_cost(ref_id, _visiting) * qty, 2)
+        return 0.0
+
+    def recipe_cost(self, recipe_id, _visiting=None):
+        """Total cost of a recipe including nested recipes"""
+        if recipe_id in self._recipe_costs:
+            return self._recipe_costs[recipe_id]
+        recipe = self.recipes.get(recipe_id)
+        if not recipe:
+            return 0.0
+        visiting = _visiting if _visiting is not None else set()
+        if recipe_id in visiting:
+            logging.error(f"Recipe {recipe_id} includes itself; costing it as 0.0")
+            return 0.0
+        visiting.add(recipe_id)
+        total = round(sum(self.line_cost(line, visiting) for line in recipe.ingredients), 2)
+        visiting.discard(recipe_id)
+        self._recipe_costs[recipe_id] = total
+        return total
+
+    def cost_map(self, recipe_ids=None):
+        """{recipe_id: {'total_cost', 'cost_percentage'}} for loaded recipes"""
+        ids = self.recipes.keys() if recipe_ids is None else recipe_ids
+        result = {}
+        for recipe_id in ids:
+            recipe = self.recipes.get(recipe_id)
+            if not recipe:
+                continue
+            total = self.recipe_cost(recipe_id)
+            result[recipe_id] = {
+                'total_cost': total,
+                'cost_percentage': cost_percentage(recipe, total),
+            }
+        return result
+
+
+def build_cost_map(recipes):
+    """Cost map for the given Recipe objects (ingredients eagerly loaded)"""
+    recipes = list(recipes)
+    engine = CostingEngine().load_recipes(recipes)
+    return engine.cost_map([r.id for r in recipes])
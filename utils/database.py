@@ -0,0 +1,23 @@
+"""
+Database engine setup
+Applies the configured SQLITE_PRAGMAS to every new SQLite connection. PRAGMAs
+such as busy_timeout and cache_size only last for one connection, so they are
+set from a connect event rather than once at startup.
+"""
+from sqlalchemy import event
+from extensions import db
+
+
+def configure_engine(app):
+    """Register the connect hook for app's engine; call inside an app context before the first query"""
+    pragmas = app.config.get('SQLITE_PRAGMAS')
+    engine = db.engine
+    if not pragmas or engine.dialect.name != 'sqlite':
+        return
+
+    @event.listens_for(engine, 'connect')
+    def set_sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas.items():
+            cursor.execute(f'PRAGMA {name} = {value}')
+        cursor.close()
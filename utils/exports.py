@@ -0,0 +1,170 @@
+"""
+Streaming exports
+CSV and XLSX downloads of the master list, secondary ingredient costings and
+recipe costings. Rows are fetched EXPORT_BATCH_SIZE at a time through a
+server-side cursor (yield_per) and the response body is a generator, so an
+export never holds the whole table in memory. XLSX is written with openpyxl
+in write-only mode, which spools rows to a temporary file that is then
+streamed out.
+"""
+import csv
+import io
+import os
+import tempfile
+from datetime import datetime
+from flask import Response, stream_with_context
+from sqlalchemy import select, func, case, or_, and_
+from extensions import db
+from models import HomemadeIngredient, Recipe
+from utils.master_list import master_list_query
+
+EXPORT_BATCH_SIZE = 1000
+STREAM_CHUNK_SIZE = 64 * 1024
+XLSX_MIMETYPE = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+
+
+class ExportDataset:
+    """A titled select plus (header, column label) pairs giving the file's columns in order"""
+
+    def __init__(self, title, columns, query):
+        self.title = title
+        self.columns = columns
+        self.query = query
+
+    @property
+    def headers(self):
+        return [header for header, _ in self.columns]
+
+    def rows(self):
+        labels = [label for _, label in self.columns]
+        result = db.session.execute(self.query.execution_options(yield_per=EXPORT_BATCH_SIZE))
+        for row in result.mappings():
+            yield [_cell(row[label]) for label in labels]
+
+
+def _cell(value):
+    if isinstance(value, float):
+        return round(value, 4)
+    return value
+
+
+# -------------------------
+# Datasets
+# -------------------------
+def master_list_export(category='', level='', search='', sort='description', direction='asc'):
+    """The master list with the same filters and order as the page"""
+    return ExportDataset('Master List', [
+        ('UNIQUE ITEM #', 'unique_item_number'),
+        ('CODE', 'code'),
+        ('DESCRIPTION', 'description'),
+        ('SUPPLIER', 'supplier'),
+        ('CATEGORY', 'category'),
+        ('SUB CATEGORY', 'sub_category'),
+        ('ITEM LEVEL', 'item_level'),
+        ('QUANTITY', 'quantity'),
+        ('COST/UNIT (AED)', 'cost_per_unit'),
+    ], master_list_query(category, level, search, sort, direction))
+
+
+def secondary_export():
+    """Secondary ingredients with their batch cost and cost per unit"""
+    return ExportDataset('Secondary Ingredients', [
+        ('CODE', 'unique_code'),
+        ('NAME', 'name'),
+        ('BATCH VOLUME', 'total_volume_ml'),
+        ('UNIT', 'unit'),
+        ('BATCH COST (AED)', 'cached_cost'),
+        ('COST/UNIT (AED)', 'cached_cost_per_unit'),
+    ], select(
+        HomemadeIngredient.unique_code, HomemadeIngredient.name, HomemadeIngredient.total_volume_ml,
+        HomemadeIngredient.unit, HomemadeIngredient.cached_cost, HomemadeIngredient.cached_cost_per_unit,
+    ).order_by(func.lower(HomemadeIngredient.name), HomemadeIngredient.id))
+
+
+def recipe_export(recipe_type=None, category_labels=None):
+    """
+    Recipes with cost, cost % and the selling price with and without fees,
+    optionally narrowed to a recipe type or to a category's db labels
+    """
+    fees = (func.coalesce(Recipe.vat_percentage, 0.0) + func.coalesce(Recipe.service_charge_percentage, 0.0)
+            + func.coalesce(Recipe.government_fees_percentage, 0.0))
+    # Same rule as utils.costing.base_selling_price
+    base_price = case((Recipe.selling_price > 0, Recipe.selling_price / (1 + fees / 100.0)), else_=None)
+    query = select(
+        Recipe.recipe_code, Recipe.title, Recipe.recipe_type, Recipe.type, Recipe.item_level,
+        Recipe.cached_total_cost, Recipe.selling_price, Recipe.vat_percentage, Recipe.service_charge_percentage,
+        Recipe.government_fees_percentage, base_price.label('base_price'), Recipe.cached_cost_percentage,
+    ).order_by(Recipe.recipe_type, Recipe.type, func.lower(Recipe.title), Recipe.id)
+    if recipe_type:
+        query = query.where(Recipe.recipe_type == recipe_type)
+    if category_labels:
+        # Same match as the category pages: type first, recipe_type when type is blank
+        query = query.where(or_(
+            Recipe.type.in_(category_labels),
+            and_(or_(Recipe.type.is_(None), Recipe.type == ''), Recipe.recipe_type.in_(category_labels)),
+        ))
+    return ExportDataset('Recipes', [
+        ('CODE', 'recipe_code'),
+        ('TITLE', 'title'),
+        ('RECIPE TYPE', 'recipe_type'),
+        ('CATEGORY', 'type'),
+        ('ITEM LEVEL', 'item_level'),
+        ('COST (AED)', 'cached_total_cost'),
+        ('SELLING PRICE INCL. FEES (AED)', 'selling_price'),
+        ('VAT %', 'vat_percentage'),
+        ('SERVICE CHARGE %', 'service_charge_percentage'),
+        ('GOVERNMENT FEES %', 'government_fees_percentage'),
+        ('SELLING PRICE EXCL. FEES (AED)', 'base_price'),
+        ('COST %', 'cached_cost_percentage'),
+    ], query)
+
+
+# -------------------------
+# Writers
+# -------------------------
+def csv_stream(dataset):
+    buffer = io.StringIO()
+    # The BOM makes Excel read the file as UTF-8; the importer accepts it too
+    buffer.write('\ufeff')
+    writer = csv.writer(buffer)
+    writer.writerow(dataset.headers)
+    for row in dataset.rows():
+        writer.writerow(row)
+        if buffer.tell() >= STREAM_CHUNK_SIZE:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+
+def xlsx_stream(dataset):
+    from openpyxl import Workbook
+
+    handle, path = tempfile.mkstemp(suffix='.xlsx')
+    os.close(handle)
+    try:
+        workbook = Workbook(write_only=True)
+        sheet = workbook.create_sheet(dataset.title)
+        sheet.append(dataset.headers)
+        for row in dataset.rows():
+            sheet.append(row)
+        workbook.save(path)
+        with open(path, 'rb') as saved:
+            while True:
+                chunk = saved.read(STREAM_CHUNK_SIZE)
+                if not chunk:
+                    break
+                yield chunk
+    finally:
+        os.remove(path)
+
+
+def export_response(dataset, fmt, name):
+    """A streamed download of dataset as fmt ('csv' or 'xlsx'), named name-YYYYMMDD"""
+    filename = f"{name}-{datetime.now().strftime('%Y%m%d')}.{fmt}"
+    if fmt == 'xlsx':
+        body, mimetype = xlsx_stream(dataset), XLSX_MIMETYPE
+    else:
+        body, mimetype = csv_stream(dataset), 'text/csv; charset=utf-8'
+    return Response(stream_with_context(body), mimetype=mimetype,
+                    headers={'Content-Disposition': f'attachment; filename="{filename}"'})
@@ -1,11 +1,19 @@
 """
 File upload utilities
+Uploads are stored under the SHA-256 of their bytes, sharded by the first
+two pairs of hex digits (uploads/3f/a9/3fa9...e1.jpg), and image_path holds
+that path. The same photo uploaded twice, for a product or a recipe, is
+stored once, and a stored file never changes, so it is served with
+immutable caching (see main.uploaded_file).
 """
+import hashlib
 import os
+import re
 import uuid
-from datetime import datetime
-from werkzeug.utils import secure_filename
-from flask import current_app
+from flask import current_app, url_for
+
+# <shard>/<shard>/<sha256>[.<variant>].<ext>, relative to the upload folder
+CONTENT_ADDRESSED = re.compile(r'^[0-9a-f]{2}/[0-9a-f]{2}/([0-9a-f]{64})((?:\.[a-z]+)+)$')
 
 
 def allowed_file(filename):
@@ -14,22 +22,131 @@ def allowed_file(filename):
            filename.rsplit('.', 1)[1].lower() in current_app.config['ALLOWED_EXTENSIONS']
 
 
-def save_uploaded_file(file, folder):
-    """Save uploaded file and return the relative path"""
-    if file and allowed_file(file.filename):
-        # Create upload directory if it doesn't exist
-        upload_dir = os.path.join(current_app.config['UPLOAD_FOLDER'], folder)
-        os.makedirs(upload_dir, exist_ok=True)
-        
-        # Generate unique filename
-        filename = secure_filename(file.filename)
-        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S_')
-        filename = timestamp + filename
-        
-        filepath = os.path.join(upload_dir, filename)
-        file.save(filepath)
-        
-        # Return relative path from static folder
-        return os.path.join('uploads', folder, filename)
-    return None
+def content_path(data, extension):
+    """Path (relative to the static folder) where bytes with this content are stored"""
+    digest = hashlib.sha256(data).hexdigest()
+    return f'uploads/{digest[:2]}/{digest[2:4]}/{digest}.{extension}'
+
+
+def write_file(full_path, data):
+    """Write under a temporary name and rename, so a half-written file is never served"""
+    temp_path = f'{full_path}.{uuid.uuid4().hex}.tmp'
+    with open(temp_path, 'wb') as output:
+        output.write(data)
+    os.replace(temp_path, full_path)
+
+
+def store_upload(data, extension, background=True):
+    """
+    Store image bytes under their content hash and return the relative path,
+    or None if the bytes are not a readable image.
+    The original is on disk before this returns; the variants and the
+    metadata-free original are made in the image pool, or right away when
+    background is False.
+    """
+    from utils.images import pillow_available, image_format, queue_image, process_image, variant_paths, FORMAT_EXTENSIONS
+
+    if pillow_available():
+        detected = image_format(data)
+        if detected is None:
+            return None
+        extension = FORMAT_EXTENSIONS[detected]
+    extension = 'jpg' if extension == 'jpeg' else extension
+
+    image_path = content_path(data, extension)
+    full_path = os.path.join(current_app.static_folder, image_path)
+    if os.path.exists(full_path):
+        # Stored before; the file and its variants are shared. Touching them
+        # keeps `flask gc-uploads` from collecting them before the new row commits
+        for path in [image_path] + variant_paths(image_path):
+            try:
+                os.utime(os.path.join(current_app.static_folder, path))
+            except FileNotFoundError:
+                pass
+        return image_path
+    os.makedirs(os.path.dirname(full_path), exist_ok=True)
+    write_file(full_path, data)
+    if not pillow_available():
+        current_app.logger.warning(f'Pillow is not installed; storing {image_path} without processing it')
+    elif background:
+        # Resized variants and the stripped original are written by the image pool
+        queue_image(data, image_path)
+    else:
+        process_image(data, current_app.static_folder, image_path)
+    return image_path
+
+
+def save_uploaded_file(file):
+    """Store an uploaded image under its content hash and return the relative path"""
+    if not (file and allowed_file(file.filename)):
+        return None
+    image_path = store_upload(file.read(), file.filename.rsplit('.', 1)[1].lower())
+    if image_path is None:
+        current_app.logger.warning(f'Rejected upload {file.filename}: not a readable image')
+    return image_path
+
+
+def is_content_addressed(image_path):
+    upload_prefix = os.path.relpath(current_app.config['UPLOAD_FOLDER'], current_app.static_folder) + '/'
+    return image_path.startswith(upload_prefix) and bool(CONTENT_ADDRESSED.match(image_path[len(upload_prefix):]))
+
+
+def store_existing_upload(image_path):
+    """
+    Store a file saved before content addressing (uploads/products/<timestamp>_x.jpg)
+    under its content hash and return the new path; None if it is missing or
+    not a readable image. The old file is left for remove_upload_files.
+    """
+    full_path = os.path.join(current_app.static_folder, image_path)
+    if not os.path.isfile(full_path):
+        return None
+    with open(full_path, 'rb') as original:
+        data = original.read()
+    extension = os.path.splitext(image_path)[1].lstrip('.').lower() or 'jpg'
+    return store_upload(data, extension, background=False)
+
+
+def upload_url(image_path):
+    """URL of a stored upload, served by main.uploaded_file"""
+    upload_prefix = os.path.relpath(current_app.config['UPLOAD_FOLDER'], current_app.static_folder) + '/'
+    if image_path.startswith(upload_prefix):
+        return url_for('main.uploaded_file', filename=image_path[len(upload_prefix):])
+    return url_for('static', filename=image_path)
+
+
+def remove_upload_files(paths):
+    """
+    Delete uploaded files given by their stored paths (relative to the static
+    folder) unless a product or recipe still refers to them. Paths outside
+    the upload folder are ignored. Returns the number of files removed.
+    """
+    from sqlalchemy import select, union
+    from extensions import db
+    from models import Product, Recipe
+    from utils.images import variant_paths
 
+    paths = set(path for path in paths if path)
+    if not paths:
+        return 0
+    in_use = set(db.session.scalars(union(
+        select(Product.image_path).where(Product.image_path.in_(paths)),
+        select(Recipe.image_path).where(Recipe.image_path.in_(paths)),
+    )))
+    upload_root = os.path.realpath(current_app.config['UPLOAD_FOLDER'])
+    removed = 0
+    for path in paths - in_use:
+        full_path = os.path.realpath(os.path.join(current_app.static_folder, path))
+        if not full_path.startswith(upload_root + os.sep):
+            current_app.logger.warning(f'Not removing {path}: outside the upload folder')
+            continue
+        # Resized variants go with their original
+        for file_path in [path] + variant_paths(path):
+            try:
+                os.remove(os.path.join(current_app.static_folder, file_path))
+                if file_path == path:
+                    removed += 1
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                current_app.logger.warning(f'Could not remove {file_path}: {str(e)}')
+    return removed
@@ -0,0 +1,180 @@
+"""
+Image pipeline
+Product and recipe photos are decoded once and saved as a metadata-free
+original plus a thumbnail and a display size, each as WebP with a JPEG
+fallback, next to the original:
+
+    uploads/3f/a9/3fa9...e1.jpg
+    uploads/3f/a9/3fa9...e1.thumb.webp  (and .thumb.jpg)
+    uploads/3f/a9/3fa9...e1.display.webp  (and .display.jpg)
+
+image_path still names the original, and the variant paths are derived from
+it. The request validates the image and writes the uploaded bytes as the
+original before it returns; decoding, resizing and encoding run in a thread
+pool (Pillow releases the GIL while it works), so the variants appear, and
+the metadata-free original replaces the upload, shortly after the page
+returns. If that fails the uploaded original is still served. Templates use
+responsive_image() / image_srcset(), which fall back to the original when
+an image has no variants. Pillow is in requirements.txt; if it is missing,
+uploads are stored as they arrive and the app logs a warning at startup.
+"""
+import io
+import os
+from concurrent.futures import ThreadPoolExecutor
+from markupsafe import Markup, escape
+from flask import current_app
+from utils.file_upload import write_file, upload_url
+
+# Variant name -> longest edge in pixels (smaller images are not enlarged)
+VARIANTS = {'thumb': 240, 'display': 1200}
+FORMATS = {'webp': ('WEBP', {'quality': 80, 'method': 4}),
+           'jpg': ('JPEG', {'quality': 82, 'optimize': True, 'progressive': True})}
+# Accepted upload formats -> stored extension
+FORMAT_EXTENSIONS = {'JPEG': 'jpg', 'PNG': 'png', 'GIF': 'gif', 'WEBP': 'webp'}
+
+_executor = None
+
+
+def _pillow():
+    try:
+        from PIL import Image, ImageOps
+    except ImportError:
+        return None
+    return Image, ImageOps
+
+
+def pillow_available():
+    return _pillow() is not None
+
+
+def _pool():
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=current_app.config.get('IMAGE_WORKERS', 2),
+                                       thread_name_prefix='image')
+    return _executor
+
+
+def variant_path(image_path, variant, extension):
+    """Path of one variant of a stored image, e.g. uploads/3f/a9/<hash>.thumb.webp"""
+    stem = os.path.splitext(image_path)[0]
+    return f'{stem}.{variant}.{extension}'
+
+
+def variant_paths(image_path):
+    return [variant_path(image_path, variant, extension) for variant in VARIANTS for extension in FORMATS]
+
+
+def _write(image, full_path, image_format, options):
+    output = io.BytesIO()
+    image.save(output, image_format, **options)
+    write_file(full_path, output.getvalue())
+
+
+def _flatten(image, Image):
+    """RGB copy for JPEG, with any transparency composited onto white"""
+    if image.mode in ('RGBA', 'LA') or (image.mode == 'P' and 'transparency' in image.info):
+        rgba = image.convert('RGBA')
+        background = Image.new('RGB', rgba.size, (255, 255, 255))
+        background.paste(rgba, mask=rgba.getchannel('A'))
+        return background
+    return image.convert('RGB')
+
+
+def process_image(data, static_folder, image_path, keep_original=False):
+    """
+    Decode image bytes once and write every variant under static_folder, then
+    replace the original with the stripped re-encode (an atomic rename, so
+    the original is served throughout). Runs in the pool; raises on
+    undecodable data, leaving the original as uploaded.
+    """
+    Image, ImageOps = _pillow()
+    full_path = os.path.join(static_folder, image_path)
+    with Image.open(io.BytesIO(data)) as source:
+        source_format = source.format
+        # Apply the camera's EXIF orientation before the EXIF block is dropped
+        image = ImageOps.exif_transpose(source)
+        image.load()
+    if image.mode not in ('RGB', 'RGBA'):
+        image = image.convert('RGBA' if image.mode in ('LA', 'P', 'PA') else 'RGB')
+
+    for variant, edge in VARIANTS.items():
+        resized = image.copy()
+        resized.thumbnail((edge, edge), Image.LANCZOS)
+        for extension, (image_format, options) in FORMATS.items():
+            output = resized if image_format == 'WEBP' else _flatten(resized, Image)
+            _write(output, os.path.join(static_folder, variant_path(image_path, variant, extension)),
+                   image_format, options)
+
+    if keep_original:
+        return
+    if source_format == 'GIF':
+        # Kept byte for byte so animations survive; GIFs carry no camera metadata
+        return
+    if source_format == 'JPEG':
+        # Saved without exif/icc_profile arguments, so location and camera data are dropped
+        _write(_flatten(image, Image), full_path, 'JPEG', {'quality': 92, 'optimize': True})
+    else:
+        _write(image, full_path, source_format, {})
+
+
+def _process_in_background(app, data, image_path):
+    try:
+        process_image(data, app.static_folder, image_path)
+    except Exception as e:
+        app.logger.error(f'Could not process image {image_path}: {str(e)}', exc_info=True)
+
+
+def image_format(data):
+    """'JPEG', 'PNG', 'GIF' or 'WEBP' for intact image bytes, or None if the bytes are not such an image"""
+    Image, _ = _pillow()
+    try:
+        with Image.open(io.BytesIO(data)) as image:
+            detected = image.format
+            # Checks the file's structure (chunk CRCs, truncation) without decoding the pixels
+            image.verify()
+    except Exception:
+        return None
+    return detected if detected in FORMAT_EXTENSIONS else None
+
+
+def queue_image(data, image_path):
+    """Write the variants of image_path (relative to the static folder) and strip its original in the pool"""
+    _pool().submit(_process_in_background, current_app._get_current_object(), data, image_path)
+
+
+def _existing(image_path, extension):
+    """(url, width) for the variants of image_path in one format that exist on disk"""
+    found = []
+    for variant, edge in VARIANTS.items():
+        path = variant_path(image_path, variant, extension)
+        if os.path.exists(os.path.join(current_app.static_folder, path)):
+            found.append((upload_url(path), edge))
+    return found
+
+
+def image_srcset(image_path, extension='webp'):
+    """srcset attribute value for an image's variants in one format ('' when it has none)"""
+    if not image_path:
+        return ''
+    return ', '.join(f'{url} {width}w' for url, width in _existing(image_path, extension))
+
+
+def responsive_image(image_path, alt='', sizes='(max-width: 600px) 100vw, 600px', css_class=''):
+    """
+    <picture> with the WebP variants, JPEG fallbacks and lazy loading; a plain
+    <img> of the original for images without variants; '' without an image.
+    """
+    if not image_path:
+        return Markup('')
+    attributes = f'alt="{escape(alt)}" loading="lazy" decoding="async"'
+    if css_class:
+        attributes += f' class="{escape(css_class)}"'
+    jpegs = _existing(image_path, 'jpg')
+    if not jpegs:
+        return Markup(f'<img src="{upload_url(image_path)}" {attributes}>')
+    jpeg_srcset = ', '.join(f'{url} {width}w' for url, width in jpegs)
+    webp_srcset = image_srcset(image_path, 'webp')
+    source = f'<source type="image/webp" srcset="{webp_srcset}" sizes="{escape(sizes)}">' if webp_srcset else ''
+    return Markup(f'<picture>{source}<img src="{jpegs[-1][0]}" srcset="{jpeg_srcset}" '
+                  f'sizes="{escape(sizes)}" {attributes}></picture>')
@@ -0,0 +1,175 @@
+"""
+Ingredient option catalog
+The product and secondary ingredient options offered by the recipe and
+secondary ingredient forms, built once per catalog version from two column
+selects and kept in memory. Forms fetch pages of options on demand through
+the typeahead endpoint instead of embedding the whole catalog in the HTML.
+"""
+import threading
+from bisect import bisect_left
+from itertools import islice
+from sqlalchemy import select
+from extensions import db
+from models import Product, HomemadeIngredient
+from utils.catalog_version import current_version
+from utils.cost_cache import homemade_cost_map
+
+DEFAULT_PAGE_SIZE = 20
+MAX_PAGE_SIZE = 100
+
+_cache_lock = threading.Lock()
+_cache = {'catalog': None}
+
+
+def _option_label(description, code):
+    return f"{description} ({code})" if code else description
+
+
+def _search_keys(option):
+    """
+    (key, word number) pairs an option can be prefix-matched on: its code
+    (word number -1) and each word of its description, so the index grows
+    with the number of words rather than their square
+    """
+    keys = {(word, start) for start, word in enumerate(option['description'].lower().split())}
+    if option['code']:
+        keys.add((option['code'].lower(), -1))
+    return keys
+
+
+def _matches(option, start, prefix):
+    """Whether the code (start -1), or the description from word start onwards, begins with prefix"""
+    if start < 0:
+        return option['code'].lower().startswith(prefix)
+    return ' '.join(option['description'].lower().split()[start:]).startswith(prefix)
+
+
+class IngredientCatalog:
+    """Options sorted by description, with prefix indexes per ingredient type"""
+
+    def __init__(self, version, options):
+        self.version = version
+        self.etag = f"ingredient-options-{version}"
+        self.options = options
+        self._by_ref = {(opt['type'], opt['id']): opt for opt in options}
+        self._by_label = {}
+        for opt in options:
+            self._by_label.setdefault(opt['label'].lower(), opt)
+        for opt in options:
+            self._by_label.setdefault(opt['description'].lower(), opt)
+
+        # Per type (None = all types): the options, and sorted (key, position, word number) entries into them
+        self._lists = {None: options}
+        for opt in options:
+            self._lists.setdefault(opt['type'], []).append(opt)
+        self._indexes = {
+            ingredient_type: sorted(
+                (key, position, start) for position, opt in enumerate(typed) for key, start in _search_keys(opt)
+            )
+            for ingredient_type, typed in self._lists.items()
+        }
+
+    def get(self, ingredient_type, ingredient_id):
+        return self._by_ref.get((ingredient_type, ingredient_id))
+
+    def options_for(self, refs):
+        """Options for (type, id) pairs, skipping any that are not in the catalog"""
+        options = []
+        for ingredient_type, ingredient_id in refs:
+            option = self.get(ingredient_type, ingredient_id)
+            if option and option not in options:
+                options.append(option)
+        return options
+
+    def find_label(self, label):
+        """Option whose label or description matches, ignoring case and a trailing '(code)'"""
+        key = (label or '').strip().lower()
+        if not key:
+            return None
+        return self._by_label.get(key) or self._by_label.get(key.split('(')[0].strip())
+
+    def search(self, query='', ingredient_type=None, offset=0, limit=DEFAULT_PAGE_SIZE):
+        """
+        One page of options whose code, or the description from any word
+        onwards, starts with query. Returns (options, has_more); cost is
+        O(log n + offset + limit) for one word. Longer queries are looked up by
+        their first word and the rest is checked against each candidate.
+        """
+        options = self._lists.get(ingredient_type, [])
+        prefix = ' '.join((query or '').lower().split())
+        if not prefix:
+            return options[offset:offset + limit], len(options) > offset + limit
+
+        first = prefix.split(' ', 1)[0]
+        index = self._indexes.get(ingredient_type, [])
+        page = []
+        seen = set()
+        skipped = 0
+        for key, position, start in islice(index, bisect_left(index, (first,)), None):
+            if not key.startswith(first):
+                break
+            if position in seen or (first != prefix and not _matches(options[position], start, prefix)):
+                continue
+            seen.add(position)
+            if skipped < offset:
+                skipped += 1
+                continue
+            if len(page) == limit:
+                return page, True
+            page.append(options[position])
+        return page, False
+
+
+def build_ingredient_catalog(version):
+    options = []
+    rows = db.session.execute(
+        select(Product.id, Product.description, Product.barbuddy_code, Product.selling_unit,
+               Product.cost_per_unit, Product.ml_in_bottle)
+    ).all()
+    for product_id, description, code, unit, cost, ml_in_bottle in rows:
+        description = description or ''
+        code = code or ''
+        options.append({
+            'label': _option_label(description, code),
+            'description': description,
+            'code': code,
+            'id': product_id,
+            'type': 'Product',
+            'unit': unit or 'ml',
+            'cost_per_unit': cost or 0.0,
+            'container_volume': ml_in_bottle or (1 if (unit or '').lower() == 'ml' else 0),
+        })
+
+    rows = db.session.execute(
+        select(HomemadeIngredient.id, HomemadeIngredient.name, HomemadeIngredient.unique_code,
+               HomemadeIngredient.unit, HomemadeIngredient.cached_cost_per_unit)
+        .where(HomemadeIngredient.unique_code.isnot(None))
+    ).all()
+    uncached = [row[0] for row in rows if row[4] is None]
+    fallback = homemade_cost_map(HomemadeIngredient.query.filter(HomemadeIngredient.id.in_(uncached))) if uncached else {}
+    for homemade_id, name, code, unit, cost_per_unit in rows:
+        name = name or ''
+        options.append({
+            'label': _option_label(name, code),
+            'description': name,
+            'code': code,
+            'id': homemade_id,
+            'type': 'Secondary',
+            'unit': unit or 'ml',
+            # Already per ml/gram of the batch
+            'cost_per_unit': cost_per_unit if cost_per_unit is not None else fallback[homemade_id][1],
+            'container_volume': 1,
+        })
+
+    options.sort(key=lambda opt: (opt['description'].lower(), opt['type'], opt['id']))
+    return IngredientCatalog(version, options)
+
+
+def ingredient_catalog():
+    """The option catalog for the current catalog version, rebuilt after any catalog write"""
+    version = current_version()
+    with _cache_lock:
+        catalog = _cache['catalog']
+        if catalog is None or catalog.version != version:
+            catalog = _cache['catalog'] = build_ingredient_catalog(version)
+        return catalog
@@ -0,0 +1,228 @@
+"""
+Background jobs
+A small queue kept in the database's job table, so long imports and
+recalculations run in a `flask worker` process instead of a web request,
+with nothing extra to deploy. Requests enqueue() a job and return at once;
+the worker claims queued jobs one at a time and records progress that the
+browser polls as JSON.
+
+Job rows are written through their own short connections, never the ORM
+session, so progress is visible while a job runs. Handlers should report
+progress between their own commits: on SQLite a progress write waits for
+any open write transaction.
+"""
+import json
+import os
+from datetime import datetime, timedelta
+from flask import current_app
+from sqlalchemy import select, update
+from extensions import db
+from models import Job
+
+QUEUED, RUNNING, DONE, FAILED = 'queued', 'running', 'done', 'failed'
+POLL_INTERVAL = 1.0
+# A running job that has not reported progress for this long is assumed lost
+STALE_AFTER = timedelta(minutes=30)
+
+_HANDLERS = {}
+
+
+def job_handler(kind):
+    """Register func(payload, progress) as the handler for a job kind; it returns a JSON-able result"""
+    def register(func):
+        _HANDLERS[kind] = func
+        return func
+    return register
+
+
+def enqueue(kind, payload, user_id=None):
+    """Add a job to the queue and return it. The caller commits."""
+    if kind not in _HANDLERS:
+        raise ValueError(f'Unknown job kind: {kind}')
+    job = Job(kind=kind, status=QUEUED, payload=json.dumps(payload), progress=0, created_by=user_id)
+    db.session.add(job)
+    db.session.flush()
+    return job
+
+
+def enqueue_if_due(kind, payload, every):
+    """
+    Queue a job of kind unless one is waiting or running, or the last one
+    was queued less than every (a timedelta) ago. Commits; returns the job or None.
+    """
+    last = db.session.execute(
+        select(Job.status, Job.created_at).where(Job.kind == kind).order_by(Job.id.desc()).limit(1)
+    ).first()
+    if last and (last.status in (QUEUED, RUNNING) or last.created_at > datetime.utcnow() - every):
+        db.session.rollback()
+        return None
+    job = enqueue(kind, payload)
+    db.session.commit()
+    return job
+
+
+def _set(job_id, **values):
+    values['updated_at'] = datetime.utcnow()
+    with db.engine.begin() as conn:
+        conn.execute(update(Job).where(Job.id == job_id).values(**values))
+
+
+class JobProgress:
+    """Callable handed to handlers: progress(done, total=None, message=None)"""
+
+    def __init__(self, job_id):
+        self.job_id = job_id
+
+    def __call__(self, done, total=None, message=None):
+        values = {'progress': done}
+        if total is not None:
+            values['total'] = total
+        if message is not None:
+            values['message'] = message
+        _set(self.job_id, **values)
+
+
+def claim_next_job():
+    """
+    Mark the oldest queued job as running and return its id, or None when
+    the queue is empty. The conditional UPDATE makes the claim atomic, so
+    several workers can share one queue.
+    """
+    now = datetime.utcnow()
+    with db.engine.begin() as conn:
+        conn.execute(
+            update(Job)
+            .where(Job.status == RUNNING, Job.updated_at < now - STALE_AFTER)
+            .values(status=FAILED, message='The worker stopped before the job finished.', finished_at=now)
+        )
+    while True:
+        with db.engine.begin() as conn:
+            job_id = conn.execute(
+                select(Job.id).where(Job.status == QUEUED).order_by(Job.id).limit(1)
+            ).scalar()
+            if job_id is None:
+                return None
+            claimed = conn.execute(
+                update(Job).where(Job.id == job_id, Job.status == QUEUED)
+                .values(status=RUNNING, started_at=now, updated_at=now)
+            ).rowcount
+        if claimed:
+            return job_id
+
+
+def run_job(job_id):
+    """Run a claimed job to completion and return its final status"""
+    with db.engine.connect() as conn:
+        kind, payload = conn.execute(select(Job.kind, Job.payload).where(Job.id == job_id)).one()
+    try:
+        handler = _HANDLERS.get(kind)
+        if handler is None:
+            raise ValueError(f'Unknown job kind: {kind}')
+        result = handler(json.loads(payload or '{}'), JobProgress(job_id)) or {}
+        db.session.commit()
+    except Exception as exc:
+        db.session.rollback()
+        current_app.logger.error(f'Job {job_id} ({kind}) failed: {str(exc)}', exc_info=True)
+        _set(job_id, status=FAILED, message=str(exc), finished_at=datetime.utcnow())
+        return FAILED
+    finally:
+        db.session.remove()
+    _set(job_id, status=DONE, result=json.dumps(result), message=result.get('message'),
+         finished_at=datetime.utcnow())
+    return DONE
+
+
+def job_state(job):
+    """JSON-ready view of a job for the polling endpoint"""
+    return {
+        'id': job.id,
+        'kind': job.kind,
+        'status': job.status,
+        'progress': job.progress,
+        'total': job.total,
+        'message': job.message,
+        'result': json.loads(job.result) if job.result else None,
+        'created_at': job.created_at.isoformat() if job.created_at else None,
+        'finished_at': job.finished_at.isoformat() if job.finished_at else None,
+    }
+
+
+# -------------------------
+# Handlers
+# -------------------------
+def _remove(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+@job_handler('import_products')
+def import_products_job(payload, progress):
+    """Bulk product upload; payload: path of the saved file and its original filename"""
+    from utils.product_import import import_products
+
+    path = payload['path']
+    try:
+        with open(path, 'rb') as handle:
+            report = import_products(handle, payload['filename'], progress=progress)
+    finally:
+        _remove(path)
+    return {'created': report.created, 'skipped': report.skipped,
+            'errors': report.error_lines(), 'message': report.summary()}
+
+
+@job_handler('apply_price_list')
+def apply_price_list_job(payload, progress):
+    """Confirmed price list update; payload: path of the saved file"""
+    from utils.product_import import diff_price_list, apply_price_list
+
+    path = payload['path']
+    try:
+        progress(0, 2, 'Comparing with the master list')
+        with open(path, 'rb') as handle:
+            diff = diff_price_list(handle, path)
+        # End the read transaction so the progress write is not kept waiting
+        db.session.commit()
+        progress(1, 2, 'Saving changes')
+        created, updated = apply_price_list(diff)
+    finally:
+        _remove(path)
+    message = (f'Price list applied: {created} new products, {updated} prices updated, '
+               f'{diff.unchanged} unchanged. Skipped {diff.report.skipped} rows.')
+    return {'created': created, 'updated': updated, 'unchanged': diff.unchanged,
+            'skipped': diff.report.skipped, 'errors': diff.report.error_lines(), 'message': message}
+
+
+@job_handler('import_recipes')
+def import_recipes_job(payload, progress):
+    """Bulk recipe upload; payload: path of the saved file, its original filename and the owning user"""
+    from utils.recipe_import import import_recipes
+
+    path = payload['path']
+    try:
+        with open(path, 'rb') as handle:
+            report = import_recipes(handle, payload['filename'], payload['user_id'], progress=progress)
+    finally:
+        _remove(path)
+    return {'created': report.created, 'skipped': report.skipped, 'errors': report.error_lines(),
+            'unresolved': report.unresolved_lines(), 'message': report.summary()}
+
+
+@job_handler('remove_upload_files')
+def remove_upload_files_job(payload, progress):
+    """Image files of deleted rows; payload: their stored paths"""
+    from utils.file_upload import remove_upload_files
+
+    removed = remove_upload_files(payload['paths'])
+    return {'removed': removed, 'message': f'Removed {removed} unused upload file(s).'}
+
+
+@job_handler('gc_uploads')
+def gc_uploads_job(payload, progress):
+    """Scheduled upload clean-up; payload: quarantine flag and minimum file age in seconds"""
+    from utils.upload_gc import collect_uploads, DEFAULT_MIN_AGE
+
+    report = collect_uploads(quarantine=payload.get('quarantine', False),
+                             min_age=payload.get('min_age', DEFAULT_MIN_AGE))
+    return report.as_dict()
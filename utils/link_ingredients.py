@@ -8,6 +8,7 @@ sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 from extensions import db
 from models import HomemadeIngredient, HomemadeIngredientItem, Product
+from utils.cost_cache import refresh_costs
 from app import create_app
 
 def link_ingredient_to_secondary(secondary_id, product_id, quantity, unit='ml'):
@@ -58,6 +59,7 @@ def link_ingredient_to_secondary(secondary_id, product_id, quantity, unit='ml'):
             db.session.add(item)
             print(f"Created new link: {secondary.name} -> {product.description} ({quantity} {unit})")
         
+        refresh_costs(homemade_ids=[secondary_id])
         db.session.commit()
         return True
     except Exception as e:
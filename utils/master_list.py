@@ -0,0 +1,192 @@
+"""
+Ingredients master list queries
+Products and secondary ingredients are listed through a single UNION ALL
+query with the category/level/search filters applied inside each branch, and
+paged with keyset cursors on (sort key, kind, id) instead of OFFSET. Each
+branch is limited to one page before the union, so deep pages cost the same
+as the first and, with the sort column indexed, each branch is a range scan
+that stops after a page of rows however large the catalog is.
+"""
+import base64
+import json
+from sqlalchemy import select, union_all, literal, func, tuple_, null, Float, String
+from extensions import db
+from models import Product, HomemadeIngredient
+
+DEFAULT_PER_PAGE = 100
+MAX_PER_PAGE = 500
+
+SORT_COLUMNS = ('description', 'code', 'unique_item_number', 'supplier', 'sub_category', 'quantity', 'cost_per_unit')
+# Sorted case-insensitively
+TEXT_SORTS = {'description', 'code', 'unique_item_number', 'supplier', 'sub_category'}
+
+SECONDARY_SUB_CATEGORY = 'Secondary Ingredient'
+SECONDARY_LEVEL = 'Secondary'
+
+
+def _or_default(column, default):
+    return func.coalesce(func.nullif(column, ''), default)
+
+
+def _product_rows(category, level, search):
+    sub_category = _or_default(Product.sub_category, 'Other')
+    item_level = _or_default(Product.item_level, 'Primary')
+    query = select(
+        Product.id.label('id'),
+        literal('product', String).label('kind'),
+        Product.image_path.label('image'),
+        _or_default(Product.unique_item_number, 'N/A').label('unique_item_number'),
+        _or_default(Product.barbuddy_code, 'N/A').label('code'),
+        Product.description.label('description'),
+        _or_default(Product.supplier, 'N/A').label('supplier'),
+        _or_default(Product.category, 'Product').label('category'),
+        sub_category.label('sub_category'),
+        item_level.label('item_level'),
+        Product.ml_in_bottle.label('quantity'),
+        func.coalesce(Product.cost_per_unit, 0.0).label('cost_per_unit'),
+    )
+    if category:
+        if category.lower() == 'other':
+            # Also matches blank sub categories, which are shown as Other
+            query = query.where(func.lower(sub_category) == 'other')
+        else:
+            # The spellings of the category in the table, so the filter is a lookup on the sub_category index
+            spellings = select(Product.sub_category).where(
+                func.lower(Product.sub_category) == category.lower()).distinct()
+            query = query.where(Product.sub_category.in_(spellings))
+    if level:
+        query = query.where(item_level == level)
+    if search:
+        query = query.where(Product.description.icontains(search, autoescape=True))
+    return query
+
+
+def _secondary_rows(category, level, search):
+    """None when the filters exclude secondary ingredients altogether"""
+    if category and category.lower() != SECONDARY_SUB_CATEGORY.lower():
+        return None
+    if level and level != SECONDARY_LEVEL:
+        return None
+    code = _or_default(HomemadeIngredient.unique_code, 'N/A')
+    query = select(
+        HomemadeIngredient.id.label('id'),
+        literal('secondary', String).label('kind'),
+        null().label('image'),
+        code.label('unique_item_number'),
+        code.label('code'),
+        HomemadeIngredient.name.label('description'),
+        literal('In-House', String).label('supplier'),
+        literal('Secondary', String).label('category'),
+        literal(SECONDARY_SUB_CATEGORY, String).label('sub_category'),
+        literal(SECONDARY_LEVEL, String).label('item_level'),
+        HomemadeIngredient.total_volume_ml.label('quantity'),
+        func.coalesce(HomemadeIngredient.cached_cost_per_unit, literal(0.0, Float)).label('cost_per_unit'),
+    )
+    if search:
+        query = query.where(HomemadeIngredient.name.icontains(search, autoescape=True))
+    return query
+
+
+def _sort_key(rows, sort):
+    key = rows.c[sort]
+    if sort in TEXT_SORTS:
+        return func.lower(key)
+    if sort == 'quantity':
+        return func.coalesce(key, 0.0)
+    return key
+
+
+def master_list_query(category='', level='', search='', sort='description', direction='asc'):
+    """Every master list row matching the filters, in display order, as one unpaged select (for exports)"""
+    if sort not in SORT_COLUMNS:
+        sort = 'description'
+    search = (search or '').strip()
+    branches = [branch for branch in (_product_rows(category, level, search), _secondary_rows(category, level, search))
+                if branch is not None]
+    rows = (union_all(*branches) if len(branches) > 1 else branches[0]).subquery('master_rows')
+    order = (_sort_key(rows, sort), rows.c.kind, rows.c.id)
+    if direction == 'desc':
+        order = tuple(column.desc() for column in order)
+    return select(rows).order_by(*order)
+
+
+def encode_cursor(row):
+    """Opaque token for a row's position; the sort key is the value computed by the query"""
+    raw = json.dumps([row['sort_key'], row['kind'], row['id']]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(token):
+    """(sort value, kind, id) or None if the token is missing or malformed"""
+    if not token:
+        return None
+    try:
+        value, kind, row_id = json.loads(base64.urlsafe_b64decode(token + '=' * (-len(token) % 4)))
+        return value, str(kind), int(row_id)
+    except (ValueError, TypeError):
+        return None
+
+
+class MasterListPage:
+    def __init__(self, rows, next_cursor, prev_cursor):
+        self.rows = rows
+        self.next_cursor = next_cursor
+        self.prev_cursor = prev_cursor
+
+
+def master_list_page(category='', level='', search='', sort='description', direction='asc',
+                     after=None, before=None, per_page=DEFAULT_PER_PAGE):
+    """
+    One page of master list rows (dicts) after or before a cursor from a
+    previous page. Ties on the sort column are broken by kind and id.
+    """
+    if sort not in SORT_COLUMNS:
+        sort = 'description'
+    descending = direction == 'desc'
+    search = (search or '').strip()
+
+    after_key = decode_cursor(after)
+    before_key = decode_cursor(before) if not after_key else None
+    # Paging backwards walks the order in reverse and flips the page afterwards
+    reverse = bool(before_key) != descending
+
+    def ordered(rows, key):
+        if reverse:
+            return (key.desc(), rows.c.kind.desc(), rows.c.id.desc())
+        return (key, rows.c.kind, rows.c.id)
+
+    # Keyset predicate, order and limit go inside each branch, so each one
+    # stops after a page of rows and the union only merges two short lists
+    branches = []
+    for branch in (_product_rows(category, level, search), _secondary_rows(category, level, search)):
+        if branch is None:
+            continue
+        rows = branch.subquery()
+        key = _sort_key(rows, sort)
+        position = tuple_(key, rows.c.kind, rows.c.id)
+        query = select(rows, key.label('sort_key'))
+        if after_key:
+            query = query.where(position < tuple_(*after_key) if descending else position > tuple_(*after_key))
+        elif before_key:
+            query = query.where(position > tuple_(*before_key) if descending else position < tuple_(*before_key))
+        branches.append(query.order_by(*ordered(rows, key)).limit(per_page + 1))
+
+    if len(branches) == 1:
+        query = branches[0]
+    else:
+        merged = union_all(*(select(branch.subquery()) for branch in branches)).subquery('master_rows')
+        query = select(merged).order_by(*ordered(merged, merged.c.sort_key)).limit(per_page + 1)
+
+    fetched = [dict(row._mapping) for row in db.session.execute(query)]
+    more = len(fetched) > per_page
+    page = fetched[:per_page]
+    if before_key:
+        page.reverse()
+
+    has_next = more if not before_key else True
+    has_prev = bool(after_key) or (bool(before_key) and more)
+    return MasterListPage(
+        page,
+        encode_cursor(page[-1]) if page and has_next else None,
+        encode_cursor(page[0]) if page and has_prev else None,
+    )
@@ -0,0 +1,184 @@
+"""
+Schema migrations
+An ordered list of numbered migrations, applied once by `flask migrate`
+(at deploy, or after pulling changes) and recorded in the schema_version
+table. Requests and app startup do no schema work; startup only logs a
+warning when migrations are pending.
+
+`flask migrate` first creates any missing tables from the models, so a new
+database gets the current schema directly and the migrations below find
+nothing to change. Migrations bring older databases up to date and must
+therefore be safe to run on a schema that already has their changes. They
+use the SQLAlchemy inspector rather than PRAGMA so they run on SQLite and
+PostgreSQL alike.
+"""
+from flask import current_app
+from sqlalchemy import inspect, select, text
+from extensions import db
+from models import SchemaVersion
+
+MIGRATIONS = []
+
+
+class Migration:
+    def __init__(self, version, name, func):
+        self.version = version
+        self.name = name
+        self.func = func
+
+
+def migration(version, name):
+    """Register func() as migration number version; versions must be added in increasing order"""
+    def register(func):
+        if MIGRATIONS and version <= MIGRATIONS[-1].version:
+            raise ValueError(f'Migration {version} is out of order')
+        MIGRATIONS.append(Migration(version, name, func))
+        return func
+    return register
+
+
+def _columns(table):
+    return {column['name'] for column in inspect(db.session.connection()).get_columns(table)}
+
+
+def _add_columns(table, columns):
+    """ALTER TABLE ... ADD COLUMN for each (name, definition) the table does not have yet"""
+    existing = _columns(table)
+    for name, definition in columns:
+        if name not in existing:
+            db.session.execute(text(f'ALTER TABLE {table} ADD COLUMN {name} {definition}'))
+
+
+# -------------------------
+# Migrations
+# -------------------------
+@migration(1, 'columns added before schema versioning')
+def add_legacy_columns():
+    _add_columns('recipe', [
+        ('item_level', "VARCHAR(20) DEFAULT 'Primary'"),
+        ('selling_price', 'FLOAT DEFAULT 0'),
+        ('vat_percentage', 'FLOAT DEFAULT 0'),
+        ('service_charge_percentage', 'FLOAT DEFAULT 0'),
+        ('government_fees_percentage', 'FLOAT DEFAULT 0'),
+        ('garnish', 'TEXT'),
+        ('cached_total_cost', 'FLOAT'),
+        ('cached_cost_percentage', 'FLOAT'),
+    ])
+    _add_columns('product', [
+        ('item_level', "VARCHAR(20) DEFAULT 'Primary'"),
+        ('cached_unit_cost', 'FLOAT'),
+    ])
+    _add_columns('homemade_ingredient', [
+        ('cached_cost', 'FLOAT'),
+        ('cached_cost_per_unit', 'FLOAT'),
+    ])
+    _add_columns('recipe_ingredient', [
+        ('ingredient_type', 'VARCHAR(20)'),
+        ('ingredient_id', 'INTEGER'),
+        ('quantity', 'FLOAT'),
+        ('unit', "VARCHAR(20) DEFAULT 'ml'"),
+    ])
+    _add_columns('homemade_ingredient_item', [
+        ('quantity', 'FLOAT DEFAULT 0'),
+        ('unit', "VARCHAR(20) DEFAULT 'ml'"),
+    ])
+    # Indexes for the where-used graph (reverse ingredient lookups)
+    db.session.execute(text(
+        'CREATE INDEX IF NOT EXISTS ix_recipe_ingredient_ingredient ON recipe_ingredient (ingredient_type, ingredient_id)'))
+    db.session.execute(text(
+        'CREATE INDEX IF NOT EXISTS ix_homemade_ingredient_item_product_id ON homemade_ingredient_item (product_id)'))
+
+
+@migration(2, 'fill ingredient lines saved in the legacy format')
+def backfill_legacy_ingredient_lines():
+    db.session.execute(text(
+        'UPDATE recipe_ingredient SET ingredient_id = product_id WHERE ingredient_id IS NULL AND product_id IS NOT NULL'))
+    db.session.execute(text(
+        'UPDATE recipe_ingredient SET ingredient_type = product_type WHERE ingredient_type IS NULL AND product_type IS NOT NULL'))
+    db.session.execute(text('UPDATE recipe_ingredient SET quantity = quantity_ml WHERE quantity IS NULL'))
+    db.session.execute(text("UPDATE recipe_ingredient SET unit = 'ml' WHERE unit IS NULL"))
+    db.session.execute(text(
+        'UPDATE homemade_ingredient_item SET quantity_ml = COALESCE(quantity, 0) WHERE quantity_ml IS NULL'))
+
+
+@migration(3, 'catalog version counter')
+def add_catalog_version():
+    from utils.catalog_version import ensure_catalog_version
+    ensure_catalog_version()
+
+
+@migration(4, 'full-text search index')
+def add_search_index():
+    from utils.search import ensure_search_index
+    ensure_search_index()
+
+
+@migration(5, 'fill the cost cache')
+def fill_cost_cache():
+    from utils.cost_cache import backfill_cost_cache
+    backfill_cost_cache()
+
+
+@migration(6, 'indexes for list and lookup queries')
+def add_query_indexes():
+    for statement in (
+        'CREATE INDEX IF NOT EXISTS ix_recipe_ingredient_recipe_id ON recipe_ingredient (recipe_id)',
+        'CREATE INDEX IF NOT EXISTS ix_homemade_ingredient_item_homemade_id ON homemade_ingredient_item (homemade_id)',
+        'CREATE INDEX IF NOT EXISTS ix_recipe_type ON recipe (type)',
+        'CREATE INDEX IF NOT EXISTS ix_recipe_recipe_type ON recipe (recipe_type)',
+        'CREATE INDEX IF NOT EXISTS ix_product_sub_category ON product (sub_category)',
+        'CREATE INDEX IF NOT EXISTS ix_product_description ON product (lower(description))',
+    ):
+        db.session.execute(text(statement))
+
+
+@migration(7, 'code sequences')
+def add_code_sequences():
+    from utils.code_sequences import seed_code_sequences
+    seed_code_sequences()
+
+
+# -------------------------
+# Runner
+# -------------------------
+def applied_versions():
+    """Versions recorded in schema_version (empty before the first `flask migrate`)"""
+    if not inspect(db.engine).has_table(SchemaVersion.__tablename__):
+        return set()
+    return set(db.session.scalars(select(SchemaVersion.version)))
+
+
+def pending_migrations():
+    applied = applied_versions()
+    return [item for item in MIGRATIONS if item.version not in applied]
+
+
+def run_migrations(log=None):
+    """
+    Create missing tables, then apply pending migrations in order, each in
+    its own transaction together with its schema_version row. Returns the
+    migrations applied.
+    """
+    db.create_all()
+    applied = []
+    for item in pending_migrations():
+        if log:
+            log(f'Applying {item.version}: {item.name}')
+        try:
+            item.func()
+            db.session.add(SchemaVersion(version=item.version, name=item.name))
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        applied.append(item)
+    return applied
+
+
+def warn_if_outdated():
+    """Log a warning at startup when the database is behind the code"""
+    pending = pending_migrations()
+    if pending:
+        current_app.logger.warning(
+            f'{len(pending)} database migration(s) pending ({", ".join(str(item.version) for item in pending)}). '
+            'Run `flask --app app migrate`.')
@@ -0,0 +1,141 @@
+"""
+Bulk product delete
+Deletes master list products by id, or all of them, with set-based
+statements. One query outer-joins the products to their uses in secondary
+ingredients and recipes: products nobody uses are deleted with chunked
+DELETE ... WHERE id IN (...) statements, and products still in use are kept
+and reported, so no recipe is left pointing at a missing product. Because
+only unused products go, no cached cost changes.
+
+Image files of deleted products are removed afterwards by a background job
+queued in the same transaction.
+"""
+from sqlalchemy import select, delete, func, case, literal, exists, union_all, or_
+from extensions import db
+from models import Product, HomemadeIngredientItem, RecipeIngredient
+from utils.costing import chunked
+from utils.search import remove_documents
+
+DELETE_CHUNK_SIZE = 500
+
+
+class DeleteReport:
+    def __init__(self):
+        self.deleted = 0
+        # One dict per product kept because it is in use
+        self.blocked = []
+        self.files_queued = 0
+
+    def summary(self):
+        message = f'Successfully deleted {self.deleted} product(s) from the master list.'
+        if self.blocked:
+            message += (f' {len(self.blocked)} product(s) were kept because secondary ingredients'
+                        f' or recipes still use them.')
+        return message
+
+    def blocked_lines(self, limit=20):
+        lines = []
+        for product in self.blocked[:limit]:
+            uses = []
+            if product['secondaries']:
+                uses.append(f"{product['secondaries']} secondary ingredient(s)")
+            if product['recipes']:
+                uses.append(f"{product['recipes']} recipe(s)")
+            lines.append(f"{product['code']} {product['description']}: used by {' and '.join(uses)}")
+        if len(self.blocked) > limit:
+            lines.append(f'... and {len(self.blocked) - limit} more.')
+        return lines
+
+
+def _product_uses(product_ids=None):
+    """(product id, user kind, user id) for every secondary ingredient line and recipe line naming a product"""
+    secondary = select(
+        HomemadeIngredientItem.product_id.label('product_id'), literal('secondary').label('kind'),
+        HomemadeIngredientItem.homemade_id.label('parent_id'),
+    )
+    # Same reference rule as RecipeIngredient.ingredient_ref, including legacy product_type rows
+    recipe = select(
+        RecipeIngredient.ingredient_id, literal('recipe'), RecipeIngredient.recipe_id,
+    ).where(RecipeIngredient.ingredient_type == 'Product')
+    legacy = select(
+        RecipeIngredient.product_id, literal('recipe'), RecipeIngredient.recipe_id,
+    ).where(or_(RecipeIngredient.ingredient_type.is_(None), RecipeIngredient.ingredient_type == ''),
+            RecipeIngredient.product_type == 'Product')
+    if product_ids is not None:
+        secondary = secondary.where(HomemadeIngredientItem.product_id.in_(product_ids))
+        recipe = recipe.where(RecipeIngredient.ingredient_id.in_(product_ids))
+        legacy = legacy.where(RecipeIngredient.product_id.in_(product_ids))
+    return union_all(secondary, recipe, legacy).subquery('product_uses')
+
+
+def _is_unused():
+    """NOT EXISTS guard repeated in the DELETE, so a product picked up by a recipe meanwhile is not removed"""
+    return ~or_(
+        exists().where(HomemadeIngredientItem.product_id == Product.id),
+        exists().where(RecipeIngredient.ingredient_type == 'Product', RecipeIngredient.ingredient_id == Product.id),
+        exists().where(or_(RecipeIngredient.ingredient_type.is_(None), RecipeIngredient.ingredient_type == ''),
+                       RecipeIngredient.product_type == 'Product', RecipeIngredient.product_id == Product.id),
+    )
+
+
+def _classify(product_ids, report):
+    """Split products into (deletable ids, their image paths), recording the ones in use on the report"""
+    uses = _product_uses(product_ids)
+    counts = select(
+        uses.c.product_id,
+        func.count(func.distinct(case((uses.c.kind == 'secondary', uses.c.parent_id)))).label('secondaries'),
+        func.count(func.distinct(case((uses.c.kind == 'recipe', uses.c.parent_id)))).label('recipes'),
+    ).group_by(uses.c.product_id).subquery('product_use_counts')
+    query = select(
+        Product.id, Product.barbuddy_code, Product.description, Product.image_path,
+        counts.c.secondaries, counts.c.recipes,
+    ).outerjoin(counts, counts.c.product_id == Product.id)
+    if product_ids is not None:
+        query = query.where(Product.id.in_(product_ids))
+
+    deletable, image_paths = [], []
+    for row in db.session.execute(query.order_by(Product.id)):
+        if row.secondaries is None:
+            deletable.append(row.id)
+            if row.image_path:
+                image_paths.append(row.image_path)
+        else:
+            report.blocked.append({'id': row.id, 'code': row.barbuddy_code, 'description': row.description,
+                                   'secondaries': row.secondaries, 'recipes': row.recipes})
+    return deletable, image_paths
+
+
+def delete_products(product_ids=None, user_id=None):
+    """
+    Delete the given products (all products when product_ids is None) that
+    no secondary ingredient or recipe uses, and return a DeleteReport. Queues
+    a job that removes their image files. The caller commits.
+    """
+    from utils.jobs import enqueue
+
+    report = DeleteReport()
+    deletable, image_paths = [], []
+    if product_ids is None:
+        deletable, image_paths = _classify(None, report)
+    else:
+        for chunk in chunked(sorted(set(product_ids)), DELETE_CHUNK_SIZE):
+            chunk_ids, chunk_paths = _classify(chunk, report)
+            deletable.extend(chunk_ids)
+            image_paths.extend(chunk_paths)
+
+    for chunk in chunked(deletable, DELETE_CHUNK_SIZE):
+        result = db.session.execute(
+            delete(Product).where(Product.id.in_(chunk), _is_unused())
+            .execution_options(synchronize_session=False)
+        )
+        if result.rowcount != len(chunk):
+            # A product started being used after it was checked; it stays
+            kept = set(db.session.scalars(select(Product.id).where(Product.id.in_(chunk))))
+            chunk = [product_id for product_id in chunk if product_id not in kept]
+        remove_documents(Product, chunk)
+        report.deleted += len(chunk)
+
+    if image_paths:
+        enqueue('remove_upload_files', {'paths': image_paths}, user_id=user_id)
+        report.files_queued = len(image_paths)
+    return report
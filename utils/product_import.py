@@ -0,0 +1,445 @@
+"""
+Bulk product import
+Reads the master list from .xlsx (openpyxl read-only mode), .csv (pandas in
+chunks) or .parquet (pyarrow, batch by batch) one block of rows at a time,
+and validates and inserts products in fixed-size chunks, each written with
+one executemany insert and committed on its own, so memory stays flat however
+large the file is. Every format goes through the same header normalization
+and row validation. Rows that cannot be imported are reported with their
+spreadsheet row number.
+"""
+import os
+from types import SimpleNamespace
+from flask import current_app
+from sqlalchemy import insert, select, update
+from extensions import db
+from models import Product
+from utils.code_sequences import allocate_codes
+from utils.costing import chunked, product_unit_cost
+from utils.search import index_documents
+
+CHUNK_SIZE = 1000
+REQUIRED_COLUMNS = ['DESCRIPTION', 'SUPPLIER', 'CATEGORY', 'COST/UNIT (AED)']
+
+
+class ProductImportError(ValueError):
+    """The file as a whole cannot be imported (unreadable, missing columns)"""
+
+
+class RowError(ValueError):
+    """A single row is invalid; the import carries on without it"""
+
+
+class ImportReport:
+    def __init__(self):
+        self.created = 0
+        self.errors = []
+
+    @property
+    def skipped(self):
+        return len(self.errors)
+
+    def add_error(self, row_number, message):
+        self.errors.append((row_number, message))
+
+    def summary(self):
+        return f'Imported {self.created} products successfully. Skipped {self.skipped} rows.'
+
+    def error_lines(self, limit=20):
+        lines = [f'Row {row_number}: {message}' for row_number, message in self.errors[:limit]]
+        if len(self.errors) > limit:
+            lines.append(f'... and {len(self.errors) - limit} more rows with errors.')
+        return lines
+
+
+# -------------------------
+# Reading
+# -------------------------
+def normalized_columns(header):
+    """Upper-cased, stripped header name -> column position"""
+    return {str(name).upper().strip(): index for index, name in enumerate(header) if name is not None}
+
+
+def _is_blank(value):
+    return value is None or (isinstance(value, str) and not value.strip()) or value != value  # NaN
+
+
+def _open_xlsx(file):
+    try:
+        from openpyxl import load_workbook
+    except ImportError:
+        raise ProductImportError('openpyxl is required for bulk upload. Please install it via pip install openpyxl.')
+    try:
+        workbook = load_workbook(file, read_only=True, data_only=True)
+    except Exception as exc:
+        raise ProductImportError(f'Failed to read Excel file: {exc}')
+    sheet = workbook.active
+
+    def rows():
+        try:
+            yield from sheet.iter_rows(values_only=True)
+        finally:
+            workbook.close()
+    # max_row comes from the sheet's stored dimensions and may be missing
+    return sheet.max_row, rows()
+
+
+def _open_xls(file):
+    # Legacy .xls has no streaming reader; pandas (with xlrd) loads it whole
+    try:
+        import pandas as pd
+        frame = pd.read_excel(file, header=None, dtype=object)
+    except Exception as exc:
+        raise ProductImportError(f'Failed to read Excel file: {exc}')
+    return len(frame), frame.itertuples(index=False, name=None)
+
+
+def _open_csv(file):
+    try:
+        import pandas as pd
+    except ImportError:
+        raise ProductImportError('pandas is required for CSV uploads. Please install it via pip install pandas.')
+    try:
+        # Everything as text, so codes keep their leading zeros; blanks stay ''
+        reader = pd.read_csv(file, header=None, dtype=str, keep_default_na=False, encoding='utf-8-sig',
+                             chunksize=CHUNK_SIZE, skip_blank_lines=False)
+    except Exception as exc:
+        raise ProductImportError(f'Failed to read CSV file: {exc}')
+
+    def rows():
+        read = 0
+        try:
+            for chunk in reader:
+                for values in chunk.itertuples(index=False, name=None):
+                    read += 1
+                    yield values
+        except (ValueError, pd.errors.ParserError) as exc:
+            raise ProductImportError(f'Failed to read CSV file after row {read}: {exc}')
+        finally:
+            reader.close()
+    return None, rows()
+
+
+def _open_parquet(file):
+    try:
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise ProductImportError('pyarrow is required for Parquet uploads. Please install the requirements via pip install -r requirements.txt.')
+    try:
+        parquet = pq.ParquetFile(file)
+    except Exception as exc:
+        raise ProductImportError(f'Failed to read Parquet file: {exc}')
+
+    def rows():
+        # The header row comes from the schema, as it would from a sheet
+        yield parquet.schema_arrow.names
+        for batch in parquet.iter_batches(batch_size=CHUNK_SIZE):
+            yield from zip(*(column.to_pylist() for column in batch.columns))
+    return parquet.metadata.num_rows + 1, rows()  # + the header row
+
+
+READERS = {'.xlsx': _open_xlsx, '.xls': _open_xls, '.csv': _open_csv, '.parquet': _open_parquet}
+SUPPORTED_EXTENSIONS = tuple(READERS)
+
+
+def read_sheet(file, filename, required=REQUIRED_COLUMNS):
+    """
+    (columns, rows, total) for an uploaded .xlsx, .xls, .csv or .parquet
+    file: the normalized header, an iterator of (row number, values) for the
+    data rows with completely empty rows left out, and the number of data rows
+    the file declares (an estimate, or None when unknown). Raises
+    ProductImportError when any of the required columns is missing.
+    """
+    extension = os.path.splitext(filename.lower())[1]
+    if extension not in READERS:
+        raise ProductImportError(f'Only {", ".join(SUPPORTED_EXTENSIONS)} files are supported for bulk upload.')
+    total, rows = READERS[extension](file)
+    rows = iter(rows)
+    header = next(rows, None)
+    if header is None:
+        raise ProductImportError('The file is empty.')
+    columns = normalized_columns(header)
+    missing = [column for column in required if column not in columns]
+    if missing:
+        if hasattr(rows, 'close'):
+            rows.close()
+        raise ProductImportError(f'Missing required columns: {", ".join(missing)}')
+
+    def data_rows():
+        for row_number, values in enumerate(rows, start=2):
+            if not all(_is_blank(value) for value in values):
+                yield row_number, values
+    return columns, data_rows(), (total - 1 if total else None)
+
+
+# -------------------------
+# Validation
+# -------------------------
+def _cell(columns, values, name):
+    index = columns.get(name)
+    if index is None or index >= len(values):
+        return None
+    return values[index]
+
+
+def clean_str(value, default=''):
+    if _is_blank(value):
+        return default
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    return str(value).strip()
+
+
+def _number(value, column):
+    if _is_blank(value):
+        return None
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        raise RowError(f'{column} "{value}" is not a number')
+
+
+def parse_product_row(columns, values):
+    """Product column values for one spreadsheet row; raises RowError if it is invalid"""
+    def text_value(name, default=''):
+        return clean_str(_cell(columns, values, name), default)
+
+    description = text_value('DESCRIPTION')
+    if not description:
+        raise RowError('DESCRIPTION is required')
+
+    item_level = text_value('ITEM LEVEL', 'Primary')
+    if item_level.lower() not in ('primary', 'secondary'):
+        item_level = 'Primary'
+
+    cost_per_unit = _number(_cell(columns, values, 'COST/UNIT (AED)'), 'COST/UNIT (AED)')
+    return {
+        'description': description,
+        'supplier': text_value('SUPPLIER', 'N/A') or 'N/A',
+        'category': text_value('CATEGORY') or 'Other',
+        'sub_category': text_value('SUB CATEGORY', 'Other') or 'Other',
+        'item_level': item_level,
+        'selling_unit': text_value('UNIT', 'each') or 'each',
+        'cost_per_unit': cost_per_unit or 0.0,
+        'ml_in_bottle': _number(_cell(columns, values, 'QUANTITY'), 'QUANTITY'),
+        'unique_item_number': text_value('UNIQUE ITEM #'),
+        'barbuddy_code': text_value('CODE'),
+    }
+
+
+# -------------------------
+# Writing
+# -------------------------
+class ProductImporter:
+    """
+    Existing unique item numbers and codes are loaded once into sets, so
+    duplicate checks are hash lookups rather than queries. A value repeated
+    within the file is a row error; one that already exists in the database
+    is replaced by a code from the ITEM or BB sequence, as before.
+    """
+
+    def __init__(self, report):
+        self.report = report
+        self.numbers = set(db.session.scalars(
+            select(Product.unique_item_number).where(Product.unique_item_number.isnot(None))))
+        self.codes = set(db.session.scalars(select(Product.barbuddy_code)))
+        self.number_rows = {}
+        self.code_rows = {}
+
+    def claim(self, row_number, fields):
+        """Check a row's codes against the file so far; raises RowError for repeats"""
+        for key, label, seen, existing in (
+            ('unique_item_number', 'UNIQUE ITEM #', self.number_rows, self.numbers),
+            ('barbuddy_code', 'CODE', self.code_rows, self.codes),
+        ):
+            value = fields[key]
+            if not value:
+                continue
+            if value in seen:
+                raise RowError(f'{label} "{value}" is already used on row {seen[value]}')
+            if value in existing:
+                fields[key] = ''
+        # Only mark values once the whole row is accepted
+        for key, seen, existing in (('unique_item_number', self.number_rows, self.numbers),
+                                    ('barbuddy_code', self.code_rows, self.codes)):
+            if fields[key]:
+                seen[fields[key]] = row_number
+                existing.add(fields[key])
+
+    def write(self, rows):
+        """Fill in missing codes and cached costs and insert rows with one executemany; returns the new ids"""
+        missing_numbers = [fields for fields in rows if not fields['unique_item_number']]
+        for fields, code in zip(missing_numbers, allocate_codes('ITEM', len(missing_numbers), self.numbers)):
+            fields['unique_item_number'] = code
+        missing_codes = [fields for fields in rows if not fields['barbuddy_code']]
+        for fields, code in zip(missing_codes, allocate_codes('BB', len(missing_codes), self.codes)):
+            fields['barbuddy_code'] = code
+        for fields in rows:
+            # New products have no dependents, so their cached cost is all there is to refresh
+            fields['image_path'] = None
+            fields['cached_unit_cost'] = product_unit_cost(SimpleNamespace(**fields))
+
+        # render_nulls keeps rows with and without blanks in one executemany
+        db.session.execute(insert(Product).execution_options(render_nulls=True), rows)
+        # Every row has a unique item number by now, which finds the new ids
+        # in a few IN queries (cheaper than RETURNING across executemany
+        # batches); chunked keeps each IN list under QUERY_CHUNK_SIZE
+        product_ids = []
+        for numbers in chunked(fields['unique_item_number'] for fields in rows):
+            product_ids.extend(db.session.scalars(select(Product.id).where(Product.unique_item_number.in_(numbers))))
+        index_documents(Product, product_ids)
+        return product_ids
+
+    def insert(self, chunk):
+        """Insert one chunk of (row number, fields) and commit it"""
+        try:
+            product_ids = self.write([fields for _, fields in chunk])
+            db.session.commit()
+            self.report.created += len(product_ids)
+        except Exception as exc:
+            db.session.rollback()
+            current_app.logger.error('Failed to save rows %s-%s: %s', chunk[0][0], chunk[-1][0], exc, exc_info=True)
+            for row_number, _ in chunk:
+                self.report.add_error(row_number, f'not saved ({exc})')
+
+
+def import_products(file, filename, chunk_size=CHUNK_SIZE, progress=None):
+    """
+    Stream products from an uploaded spreadsheet into the master list and
+    return an ImportReport. Each chunk is committed separately, so a failed
+    chunk does not undo the ones before it; progress(rows read, total rows)
+    is called after each one. Raises ProductImportError when the file cannot
+    be read at all.
+    """
+    columns, rows, total = read_sheet(file, filename)
+    report = ImportReport()
+    importer = ProductImporter(report)
+    chunk = []
+    rows_read = 0
+    for row_number, values in rows:
+        rows_read += 1
+        try:
+            fields = parse_product_row(columns, values)
+            importer.claim(row_number, fields)
+        except RowError as exc:
+            report.add_error(row_number, str(exc))
+            continue
+        chunk.append((row_number, fields))
+        if len(chunk) >= chunk_size:
+            importer.insert(chunk)
+            chunk = []
+            if progress:
+                progress(rows_read, total)
+    if chunk:
+        importer.insert(chunk)
+    if progress:
+        progress(rows_read, rows_read)
+    if report.errors:
+        current_app.logger.warning('Bulk upload skipped %s rows: %s', report.skipped, report.errors[:50])
+    return report
+
+
+# -------------------------
+# Price list updates (upsert)
+# -------------------------
+PRICE_TOLERANCE = 1e-6
+
+
+class PriceListDiff:
+    """
+    A supplier price list compared with the master list. new holds the row
+    fields to insert, changed one dict per product whose price differs,
+    missing the products of the file's suppliers that the file leaves out.
+    """
+
+    def __init__(self):
+        self.report = ImportReport()
+        self.new = []
+        self.changed = []
+        self.unchanged = 0
+        self.missing = []
+        self.importer = None
+
+    @property
+    def has_changes(self):
+        return bool(self.new or self.changed)
+
+
+def diff_price_list(file, filename):
+    """
+    Match each spreadsheet row to an existing product by UNIQUE ITEM #, or
+    CODE when the number is blank or unknown, with dict lookups over the
+    whole master list (a hash join), and sort rows into new, changed price
+    and unchanged. Nothing is written. Raises ProductImportError when the
+    file cannot be read.
+    """
+    columns, rows, _ = read_sheet(file, filename)
+    diff = PriceListDiff()
+    diff.importer = importer = ProductImporter(diff.report)
+
+    existing = db.session.execute(select(
+        Product.id, Product.unique_item_number, Product.barbuddy_code, Product.description,
+        Product.supplier, Product.cost_per_unit,
+    )).all()
+    by_number = {row.unique_item_number: row for row in existing if row.unique_item_number}
+    by_code = {row.barbuddy_code: row for row in existing if row.barbuddy_code}
+    matched_rows = {}
+    suppliers = set()
+
+    for row_number, values in rows:
+        try:
+            fields = parse_product_row(columns, values)
+            product = by_number.get(fields['unique_item_number']) or by_code.get(fields['barbuddy_code'])
+            if product is None:
+                importer.claim(row_number, fields)
+            elif product.id in matched_rows:
+                raise RowError(f'matches the same product as row {matched_rows[product.id]}')
+        except RowError as exc:
+            diff.report.add_error(row_number, str(exc))
+            continue
+
+        suppliers.add(fields['supplier'].lower())
+        if product is None:
+            diff.new.append(fields)
+            continue
+        matched_rows[product.id] = row_number
+        old_price = product.cost_per_unit or 0.0
+        if abs(fields['cost_per_unit'] - old_price) > PRICE_TOLERANCE:
+            diff.changed.append({
+                'id': product.id, 'code': product.barbuddy_code, 'description': product.description,
+                'old_price': old_price, 'new_price': fields['cost_per_unit'],
+            })
+        else:
+            diff.unchanged += 1
+
+    diff.missing = [
+        row for row in existing
+        if row.id not in matched_rows and (row.supplier or 'N/A').lower() in suppliers
+    ]
+    return diff
+
+
+def apply_price_list(diff):
+    """
+    Write a PriceListDiff in one transaction: one bulk UPDATE of the changed
+    prices, executemany inserts of the new products and a vectorized recost
+    of everything the new prices feed into. Missing products are left alone.
+    Returns (created, updated).
+    """
+    from utils.recost import recost_catalog
+
+    try:
+        if diff.changed:
+            db.session.execute(update(Product), [
+                {'id': change['id'], 'cost_per_unit': change['new_price']} for change in diff.changed
+            ])
+        created = 0
+        for start in range(0, len(diff.new), CHUNK_SIZE):
+            created += len(diff.importer.write(diff.new[start:start + CHUNK_SIZE]))
+        if diff.changed:
+            recost_catalog()
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    return created, len(diff.changed)
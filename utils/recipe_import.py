@@ -0,0 +1,243 @@
+"""
+Bulk recipe import
+Reads recipes from the same spreadsheet formats as the product import. A row
+with a RECIPE name starts a recipe and may carry its first ingredient; the
+rows below it with a blank RECIPE are its other ingredient lines. Ingredients
+are given by INGREDIENT CODE: a product's code (BB...) or a secondary
+ingredient's code (SEC-...).
+
+Codes are resolved against dicts of the whole catalog loaded once, each
+batch's recipe codes are reserved as one block from the REC sequence, and
+each batch is written with two executemany inserts (recipes, then their
+lines) and committed on its own. Costs are cached from the loaded ingredient costs, so
+nothing is queried per row. A recipe with any invalid line or unknown code is
+skipped as a whole, and every unknown code is listed in the report.
+"""
+from types import SimpleNamespace
+from flask import current_app
+from sqlalchemy import insert, select
+from extensions import db
+from models import Product, HomemadeIngredient, Recipe, RecipeIngredient
+from utils.code_sequences import allocate_codes
+from utils.constants import resolve_recipe_category
+from utils.costing import product_unit_cost, cost_percentage
+from utils.cost_cache import homemade_cost_map
+from utils.product_import import (
+    ImportReport, RowError, read_sheet, clean_str, _cell, _number,
+)
+from utils.search import index_documents
+
+RECIPE_BATCH_SIZE = 200
+REQUIRED_COLUMNS = ['RECIPE', 'INGREDIENT CODE', 'QUANTITY']
+
+
+class RecipeImportReport(ImportReport):
+    def __init__(self):
+        super().__init__()
+        # Unknown ingredient code -> spreadsheet rows it appears on
+        self.unresolved = {}
+
+    def add_unresolved(self, code, row_number):
+        self.unresolved.setdefault(code, []).append(row_number)
+
+    def summary(self):
+        message = f'Imported {self.created} recipes successfully. Skipped {self.skipped} recipes or rows with errors.'
+        if self.unresolved:
+            message += f' {len(self.unresolved)} ingredient codes were not found.'
+        return message
+
+    def unresolved_lines(self, limit=20):
+        codes = sorted(self.unresolved)
+        lines = [f'{code} (rows {", ".join(map(str, self.unresolved[code][:10]))})' for code in codes[:limit]]
+        if len(codes) > limit:
+            lines.append(f'... and {len(codes) - limit} more codes.')
+        return lines
+
+
+def parse_recipe_header(columns, values):
+    """Recipe column values from the row that starts a recipe; raises RowError if it is invalid"""
+    def text_value(name, default=''):
+        return clean_str(_cell(columns, values, name), default)
+
+    def number_value(name):
+        return _number(_cell(columns, values, name), name) or 0.0
+
+    category = text_value('CATEGORY', 'cocktails') or 'cocktails'
+    canonical, config = resolve_recipe_category(category)
+    if not canonical:
+        raise RowError(f'CATEGORY "{category}" is not one of Cocktails, Mocktails or Beverages')
+    item_level = text_value('ITEM LEVEL', 'Primary')
+    if item_level.lower() not in ('primary', 'secondary'):
+        item_level = 'Primary'
+    return {
+        'title': text_value('RECIPE'),
+        'method': text_value('METHOD'),
+        'garnish': text_value('GARNISH'),
+        'recipe_type': 'Beverage',
+        'type': config['db_labels'][0],
+        'item_level': item_level,
+        'selling_price': number_value('SELLING PRICE'),
+        'vat_percentage': number_value('VAT %'),
+        'service_charge_percentage': number_value('SERVICE CHARGE %'),
+        'government_fees_percentage': number_value('GOVERNMENT FEES %'),
+    }
+
+
+class RecipeImporter:
+    """
+    Product and secondary ingredient codes are loaded once into dicts of
+    (type, id, unit, unit cost, container volume), so resolving an
+    ingredient line is a dict lookup rather than a query.
+    """
+
+    def __init__(self, report, user_id):
+        self.report = report
+        self.user_id = user_id
+        self.ingredients = {}
+        for row in db.session.execute(select(
+            Product.id, Product.barbuddy_code, Product.selling_unit, Product.cost_per_unit, Product.ml_in_bottle,
+        )):
+            if row.barbuddy_code:
+                self.ingredients[row.barbuddy_code.upper()] = (
+                    'Product', row.id, row.selling_unit or 'ml', product_unit_cost(row), row.ml_in_bottle)
+        rows = db.session.execute(select(
+            HomemadeIngredient.id, HomemadeIngredient.unique_code, HomemadeIngredient.unit,
+            HomemadeIngredient.cached_cost_per_unit,
+        ).where(HomemadeIngredient.unique_code.isnot(None))).all()
+        # Secondaries whose cache column is empty are costed through the engine, not at 0
+        uncached = [row.id for row in rows if row.cached_cost_per_unit is None]
+        fallback = homemade_cost_map(HomemadeIngredient.query.filter(HomemadeIngredient.id.in_(uncached))) if uncached else {}
+        for row in rows:
+            cost_per_unit = row.cached_cost_per_unit if row.cached_cost_per_unit is not None else fallback[row.id][1]
+            self.ingredients.setdefault(row.unique_code.upper(), (
+                'Homemade', row.id, row.unit or 'ml', cost_per_unit, None))
+
+    def parse_line(self, row_number, columns, values):
+        """RecipeIngredient values (plus its cost) for one ingredient line; raises RowError if it is invalid"""
+        code = clean_str(_cell(columns, values, 'INGREDIENT CODE'))
+        if not code:
+            raise RowError('INGREDIENT CODE is required')
+        ingredient = self.ingredients.get(code.upper())
+        if ingredient is None:
+            self.report.add_unresolved(code, row_number)
+            raise RowError(f'no product or secondary ingredient has the code "{code}"')
+        kind, ingredient_id, default_unit, unit_cost, container_volume = ingredient
+
+        quantity = _number(_cell(columns, values, 'QUANTITY'), 'QUANTITY')
+        if not quantity or quantity <= 0:
+            raise RowError('QUANTITY must be greater than zero')
+        unit = clean_str(_cell(columns, values, 'UNIT'), default_unit) or default_unit
+        # Same conversion as the add recipe form
+        quantity_ml = quantity
+        if kind == 'Product' and unit != 'ml' and container_volume and container_volume > 0:
+            quantity_ml = quantity * container_volume
+        return {
+            'ingredient_type': kind,
+            'ingredient_id': ingredient_id,
+            'quantity': quantity,
+            'unit': unit,
+            'quantity_ml': quantity_ml,
+            'product_type': kind,
+            'product_id': ingredient_id,
+            'cost': round(unit_cost * quantity, 2),
+        }
+
+    def write(self, recipes):
+        """Allocate codes, cache costs and insert a batch of recipes and their lines; returns the new ids"""
+        codes = allocate_codes('REC', len(recipes))
+        rows = []
+        for recipe, code in zip(recipes, codes):
+            fields = dict(recipe['fields'], recipe_code=code, user_id=self.user_id, image_path=None)
+            total = round(sum(line['cost'] for line in recipe['lines']), 2)
+            fields['cached_total_cost'] = total
+            fields['cached_cost_percentage'] = cost_percentage(SimpleNamespace(**fields), total)
+            rows.append(fields)
+        db.session.execute(insert(Recipe).execution_options(render_nulls=True), rows)
+        # Recipe codes are unique, which finds the new ids in one query
+        recipe_ids = dict(db.session.execute(
+            select(Recipe.recipe_code, Recipe.id).where(Recipe.recipe_code.in_(codes))).all())
+        db.session.execute(insert(RecipeIngredient).execution_options(render_nulls=True), [
+            {key: value for key, value in line.items() if key != 'cost'} | {'recipe_id': recipe_ids[code]}
+            for recipe, code in zip(recipes, codes)
+            for line in recipe['lines']
+        ])
+        index_documents(Recipe, list(recipe_ids.values()))
+        return list(recipe_ids.values())
+
+    def insert(self, batch):
+        """Insert one batch of recipes and commit it"""
+        try:
+            recipe_ids = self.write(batch)
+            db.session.commit()
+            self.report.created += len(recipe_ids)
+        except Exception as exc:
+            db.session.rollback()
+            current_app.logger.error('Failed to save recipes from rows %s-%s: %s',
+                                     batch[0]['row'], batch[-1]['row'], exc, exc_info=True)
+            for recipe in batch:
+                self.report.add_error(recipe['row'], f'{recipe["fields"]["title"]}: not saved ({exc})')
+
+
+def import_recipes(file, filename, user_id, batch_size=RECIPE_BATCH_SIZE, progress=None):
+    """
+    Import recipes from an uploaded spreadsheet for user_id and return a
+    RecipeImportReport. Each batch is committed separately; progress(rows
+    read, total rows) is called after each one. Raises ProductImportError
+    when the file cannot be read at all.
+    """
+    columns, rows, total = read_sheet(file, filename, required=REQUIRED_COLUMNS)
+    report = RecipeImportReport()
+    importer = RecipeImporter(report, user_id)
+    batch = []
+    current = None
+    rows_read = 0
+
+    def finish(recipe):
+        if recipe['error']:
+            row_number, message = recipe['error']
+            report.add_error(row_number, f'{recipe["fields"]["title"] or "recipe"}: {message}')
+        elif not recipe['lines']:
+            report.add_error(recipe['row'], f'{recipe["fields"]["title"]}: has no ingredient lines')
+        else:
+            batch.append(recipe)
+
+    for row_number, values in rows:
+        rows_read += 1
+        if clean_str(_cell(columns, values, 'RECIPE')):
+            if current:
+                finish(current)
+            current = {'row': row_number, 'fields': {'title': clean_str(_cell(columns, values, 'RECIPE'))},
+                       'lines': [], 'error': None}
+            try:
+                current['fields'] = parse_recipe_header(columns, values)
+            except RowError as exc:
+                current['error'] = (row_number, str(exc))
+            if not clean_str(_cell(columns, values, 'INGREDIENT CODE')):
+                continue
+        elif current is None:
+            report.add_error(row_number, 'ingredient line before the first RECIPE row')
+            continue
+
+        # Lines of a recipe that already failed are still checked, so every unknown code is reported
+        try:
+            line = importer.parse_line(row_number, columns, values)
+        except RowError as exc:
+            if not current['error']:
+                current['error'] = (row_number, str(exc))
+            continue
+        current['lines'].append(line)
+
+        if len(batch) >= batch_size:
+            importer.insert(batch)
+            batch = []
+            if progress:
+                progress(rows_read, total)
+    if current:
+        finish(current)
+    if batch:
+        importer.insert(batch)
+    if progress:
+        progress(rows_read, rows_read)
+    if report.errors:
+        current_app.logger.warning('Recipe upload skipped %s recipes or rows: %s', report.skipped, report.errors[:50])
+    return report
@@ -0,0 +1,330 @@
+"""
+Vectorized whole-catalog repricing
+Builds sparse bill-of-materials arrays (secondary x product and
+recipe-line x ingredient) straight from the tables and costs the whole
+catalog with NumPy in a handful of array operations, then writes the cost
+cache back with bulk UPDATEs. Used by `flask recost` after supplier price
+list imports, where recosting through the ORM methods takes minutes.
+"""
+import logging
+import numpy as np
+from sqlalchemy import func, select, update
+from extensions import db
+from models import Product, HomemadeIngredient, HomemadeIngredientItem, Recipe, RecipeIngredient
+
+# Nested recipes are resolved one level per pass; deeper than this means a cycle
+MAX_NESTING_PASSES = 100
+
+
+def id_positions(sorted_ids, ids):
+    """Index of each id in sorted_ids, or -1 where it is missing"""
+    if len(sorted_ids) == 0:
+        return np.full(len(ids), -1, dtype=np.int64)
+    pos = np.searchsorted(sorted_ids, ids)
+    pos = np.minimum(pos, len(sorted_ids) - 1)
+    return np.where(sorted_ids[pos] == ids, pos, -1)
+
+
+def _gather(values, positions):
+    """values[positions] with 0.0 wherever the position is missing"""
+    return np.where(positions >= 0, values[np.maximum(positions, 0)], 0.0)
+
+
+def _round(values, ndigits):
+    """
+    np.round with the results of Python's round(): np.round scales by 10**ndigits
+    first, which can flip values sitting on a half, so those are redone exactly.
+    """
+    values = np.asarray(values, dtype=np.float64)
+    result = np.round(values, ndigits)
+    scaled = values * 10 ** ndigits
+    near_half = np.abs(scaled - np.floor(scaled) - 0.5) < 1e-6
+    if near_half.any():
+        result[near_half] = [round(float(v), ndigits) for v in values[near_half]]
+    return result
+
+
+def _float_array(values):
+    return np.array([v if v is not None else np.nan for v in values], dtype=np.float64)
+
+
+class CatalogCosts:
+    """Vectorized cost results for the whole catalog, aligned to the id arrays"""
+
+    def __init__(self, product_ids, unit_costs, homemade_ids, homemade_costs, homemade_unit_costs,
+                 recipe_ids, recipe_costs, recipe_cost_percentages):
+        self.product_ids = product_ids
+        self.unit_costs = unit_costs
+        self.homemade_ids = homemade_ids
+        self.homemade_costs = homemade_costs
+        self.homemade_unit_costs = homemade_unit_costs
+        self.recipe_ids = recipe_ids
+        self.recipe_costs = recipe_costs
+        # NaN where the recipe has no selling price
+        self.recipe_cost_percentages = recipe_cost_percentages
+
+
+class CatalogArrays:
+    """
+    The catalog's bill of materials as id-sorted NumPy arrays, loaded once by
+    load_catalog() and costed any number of times with evaluate(). Costing is
+    pure array work, so repricing under hypothetical prices takes milliseconds.
+    """
+
+    def __init__(self, product_ids, prices, per_recipe_unit, ml_in_bottle,
+                 homemade_ids, volumes, item_rows, item_cols, item_qty,
+                 recipe_ids, recipe_types, line_rows, line_kinds, line_cols, line_qty,
+                 selling_prices, base_prices):
+        self.product_ids = product_ids
+        # Live cost_per_unit of every product
+        self.prices = prices
+        self.per_recipe_unit = per_recipe_unit
+        self.ml_in_bottle = ml_in_bottle
+        self.homemade_ids = homemade_ids
+        self.volumes = volumes
+        self.item_rows = item_rows
+        self.item_cols = item_cols
+        self.item_qty = item_qty
+        self.recipe_ids = recipe_ids
+        self.recipe_types = recipe_types
+        self.line_rows = line_rows
+        self.line_kinds = line_kinds
+        # Position of each line's ingredient in the id array for its kind
+        self.line_cols = line_cols
+        self.line_qty = line_qty
+        self.selling_prices = selling_prices
+        self.base_prices = base_prices
+
+    def prices_with(self, price_overrides):
+        """Copy of the live price vector with {product_id: cost_per_unit} applied"""
+        prices = self.prices.copy()
+        if price_overrides:
+            override_pos = id_positions(self.product_ids, np.array(list(price_overrides.keys()), dtype=np.int64))
+            override_values = np.array(list(price_overrides.values()), dtype=np.float64)
+            found = override_pos >= 0
+            prices[override_pos[found]] = override_values[found]
+        return prices
+
+    def evaluate(self, prices=None):
+        """
+        Cost every product, secondary ingredient and recipe. prices is a
+        cost_per_unit vector aligned to product_ids (the live prices by default).
+        Rounding matches the calculate_* methods in models.py: every ingredient
+        line is rounded to 2 dp before summing.
+        """
+        if prices is None:
+            prices = self.prices
+
+        # Products: per-unit cost vector
+        divide = ~self.per_recipe_unit & (self.ml_in_bottle > 0)
+        unit_costs = np.where(divide, prices / np.where(divide, self.ml_in_bottle, 1.0), prices)
+
+        # Secondary ingredients: sparse secondary x product matrix times unit costs
+        item_costs = _round(_gather(unit_costs, self.item_cols) * self.item_qty, 2)
+        keep = self.item_rows >= 0
+        homemade_costs = _round(
+            np.bincount(self.item_rows[keep], weights=item_costs[keep], minlength=len(self.homemade_ids)), 2
+        )
+        has_volume = self.volumes > 0
+        homemade_unit_costs = np.where(
+            has_volume, _round(homemade_costs / np.where(has_volume, self.volumes, 1.0), 4), 0.0
+        )
+
+        # Recipes: sparse recipe-line x ingredient arrays
+        is_product = self.line_kinds == 'Product'
+        is_homemade = self.line_kinds == 'Homemade'
+        is_recipe = self.line_kinds == 'Recipe'
+        line_costs = np.zeros(len(self.line_rows), dtype=np.float64)
+        line_costs[is_product] = _round(
+            _gather(unit_costs, self.line_cols[is_product]) * self.line_qty[is_product], 2
+        )
+        line_costs[is_homemade] = _round(
+            _gather(homemade_unit_costs, self.line_cols[is_homemade]) * self.line_qty[is_homemade], 2
+        )
+        nested_cols = self.line_cols[is_recipe]
+        nested_qty = self.line_qty[is_recipe]
+
+        keep = self.line_rows >= 0
+        rows = self.line_rows[keep]
+        recipe_costs = _round(np.bincount(rows, weights=line_costs[keep], minlength=len(self.recipe_ids)), 2)
+        if is_recipe.any():
+            # Each pass resolves one more level of nesting; stop once nothing changes
+            for _ in range(MAX_NESTING_PASSES):
+                line_costs[is_recipe] = _round(_gather(recipe_costs, nested_cols) * nested_qty, 2)
+                updated = _round(np.bincount(rows, weights=line_costs[keep], minlength=len(self.recipe_ids)), 2)
+                if np.array_equal(updated, recipe_costs):
+                    break
+                recipe_costs = updated
+            else:
+                logging.error("Recipe nesting did not settle; the catalog contains a recipe cycle")
+
+        priced = self.selling_prices > 0
+        cost_percentages = np.full(len(self.recipe_ids), np.nan)
+        cost_percentages[priced] = _round(recipe_costs[priced] / self.base_prices[priced] * 100, 2)
+
+        return CatalogCosts(self.product_ids, unit_costs, self.homemade_ids, homemade_costs, homemade_unit_costs,
+                            self.recipe_ids, recipe_costs, cost_percentages)
+
+
+def load_catalog():
+    """Read the bill of materials of the whole catalog into CatalogArrays"""
+
+    # -------------------------
+    # Products
+    # -------------------------
+    rows = db.session.execute(
+        select(Product.id, Product.cost_per_unit, Product.selling_unit, Product.ml_in_bottle).order_by(Product.id)
+    ).all()
+    product_ids = np.array([r[0] for r in rows], dtype=np.int64)
+    prices = np.nan_to_num(_float_array([r[1] for r in rows]))
+    per_recipe_unit = np.array([r[2] in ('ml', 'grams', 'pieces') for r in rows], dtype=bool)
+    ml_in_bottle = np.nan_to_num(_float_array([r[3] for r in rows]))
+
+    # -------------------------
+    # Secondary ingredients
+    # -------------------------
+    rows = db.session.execute(
+        select(HomemadeIngredient.id, HomemadeIngredient.total_volume_ml).order_by(HomemadeIngredient.id)
+    ).all()
+    homemade_ids = np.array([r[0] for r in rows], dtype=np.int64)
+    volumes = np.nan_to_num(_float_array([r[1] for r in rows]))
+    items = db.session.execute(
+        select(HomemadeIngredientItem.homemade_id, HomemadeIngredientItem.product_id, HomemadeIngredientItem.quantity)
+        .order_by(HomemadeIngredientItem.id)
+    ).all()
+    item_rows = id_positions(homemade_ids, np.array([i[0] for i in items], dtype=np.int64))
+    item_cols = id_positions(product_ids, np.array([i[1] for i in items], dtype=np.int64))
+    item_qty = np.nan_to_num(_float_array([i[2] for i in items]))
+
+    # -------------------------
+    # Recipes
+    # -------------------------
+    rows = db.session.execute(
+        select(Recipe.id, Recipe.selling_price, Recipe.vat_percentage, Recipe.service_charge_percentage,
+               Recipe.government_fees_percentage,
+               # Category, falling back to recipe_type on rows saved before type was set
+               func.coalesce(func.nullif(Recipe.type, ''), Recipe.recipe_type)).order_by(Recipe.id)
+    ).all()
+    recipe_ids = np.array([r[0] for r in rows], dtype=np.int64)
+    recipe_types = np.array([r[5] for r in rows], dtype=object)
+    lines = db.session.execute(
+        select(RecipeIngredient.recipe_id, RecipeIngredient.ingredient_type, RecipeIngredient.ingredient_id,
+               RecipeIngredient.product_type, RecipeIngredient.product_id,
+               RecipeIngredient.quantity, RecipeIngredient.quantity_ml)
+        .order_by(RecipeIngredient.id)
+    ).all()
+    kinds = []
+    refs = []
+    quantities = []
+    for line in lines:
+        # Same resolution as RecipeIngredient.ingredient_ref()
+        if line[1]:
+            kinds.append(line[1])
+            refs.append(line[2] if line[2] is not None else -1)
+        elif line[3]:
+            kinds.append('Product' if line[3] == 'Product' else 'Homemade')
+            refs.append(line[4] if line[4] is not None else -1)
+        else:
+            kinds.append(None)
+            refs.append(-1)
+        quantities.append(line[5] if line[5] is not None else (line[6] if line[6] is not None else 0.0))
+    kinds = np.array(kinds, dtype=object)
+    refs = np.array(refs, dtype=np.int64)
+    line_rows = id_positions(recipe_ids, np.array([line[0] for line in lines], dtype=np.int64))
+    line_qty = np.array(quantities, dtype=np.float64)
+    line_qty = np.where(line_qty > 0, line_qty, 0.0)
+    line_cols = np.full(len(lines), -1, dtype=np.int64)
+    for kind, ids in (('Product', product_ids), ('Homemade', homemade_ids), ('Recipe', recipe_ids)):
+        mask = kinds == kind
+        line_cols[mask] = id_positions(ids, refs[mask])
+
+    selling_prices = np.nan_to_num(_float_array([r[1] for r in rows]))
+    fees = (
+        np.nan_to_num(_float_array([r[2] for r in rows]))
+        + np.nan_to_num(_float_array([r[3] for r in rows]))
+        + np.nan_to_num(_float_array([r[4] for r in rows]))
+    )
+    base_prices = np.where(fees > 0, selling_prices / (1 + fees / 100), selling_prices)
+
+    return CatalogArrays(product_ids, prices, per_recipe_unit, ml_in_bottle,
+                         homemade_ids, volumes, item_rows, item_cols, item_qty,
+                         recipe_ids, recipe_types, line_rows, kinds, line_cols, line_qty,
+                         selling_prices, base_prices)
+
+
+def compute_catalog_costs(price_overrides=None):
+    """
+    Cost every product, secondary ingredient and recipe in one vectorized pass.
+    price_overrides maps product id -> hypothetical cost_per_unit and is applied
+    in memory only.
+    """
+    catalog = load_catalog()
+    return catalog.evaluate(catalog.prices_with(price_overrides))
+
+
+def _changed(new_values, old_values):
+    """Mask of positions whose value differs, treating NaN as NULL"""
+    both_null = np.isnan(new_values) & np.isnan(old_values)
+    return ~both_null & ~(new_values == old_values)
+
+
+def _none_if_nan(value):
+    return None if value != value else float(value)
+
+
+def recost_catalog():
+    """
+    Recompute and store the cached cost of every product, secondary ingredient
+    and recipe. Only rows whose cached value changed are written, with one
+    bulk UPDATE per table. Returns {'products', 'secondary', 'recipes'} counts
+    of rows updated. The caller commits.
+    """
+
+    db.session.flush()
+    costs = compute_catalog_costs()
+
+    old = db.session.execute(select(Product.cached_unit_cost).order_by(Product.id)).scalars().all()
+    changed = _changed(costs.unit_costs, _float_array(old))
+    product_updates = [
+        {'id': int(pid), 'cached_unit_cost': float(value)}
+        for pid, value in zip(costs.product_ids[changed], costs.unit_costs[changed])
+    ]
+
+    old = db.session.execute(
+        select(HomemadeIngredient.cached_cost, HomemadeIngredient.cached_cost_per_unit).order_by(HomemadeIngredient.id)
+    ).all()
+    changed = (
+        _changed(costs.homemade_costs, _float_array([r[0] for r in old]))
+        | _changed(costs.homemade_unit_costs, _float_array([r[1] for r in old]))
+    )
+    homemade_updates = [
+        {'id': int(hid), 'cached_cost': float(total), 'cached_cost_per_unit': float(per_unit)}
+        for hid, total, per_unit in zip(costs.homemade_ids[changed], costs.homemade_costs[changed],
+                                        costs.homemade_unit_costs[changed])
+    ]
+
+    old = db.session.execute(
+        select(Recipe.cached_total_cost, Recipe.cached_cost_percentage).order_by(Recipe.id)
+    ).all()
+    changed = (
+        _changed(costs.recipe_costs, _float_array([r[0] for r in old]))
+        | _changed(costs.recipe_cost_percentages, _float_array([r[1] for r in old]))
+    )
+    recipe_updates = [
+        {'id': int(rid), 'cached_total_cost': float(total), 'cached_cost_percentage': _none_if_nan(pct)}
+        for rid, total, pct in zip(costs.recipe_ids[changed], costs.recipe_costs[changed],
+                                   costs.recipe_cost_percentages[changed])
+    ]
+
+    # ORM bulk UPDATE by primary key (executemany)
+    if product_updates:
+        db.session.execute(update(Product), product_updates)
+    if homemade_updates:
+        db.session.execute(update(HomemadeIngredient), homemade_updates)
+    if recipe_updates:
+        db.session.execute(update(Recipe), recipe_updates)
+    return {
+        'products': len(product_updates),
+        'secondary': len(homemade_updates),
+        'recipes': len(recipe_updates),
+    }
@@ -0,0 +1,216 @@
+"""
+Response cache
+Rendered HTML fragments of the recipe list pages, keyed on the catalog
+version (utils.catalog_version), so any product, secondary ingredient or
+recipe write retires every entry at once without explicit invalidation.
+Fragments hold no per-user content; the page around them (navigation,
+flashed messages) is still rendered for each request.
+
+Pages built from cached fragments also answer conditional GETs: the ETag
+combines the catalog version, the templates, the user and the query
+string, and a matching If-None-Match gets a 304 before any work is done.
+
+Backends, chosen with RESPONSE_CACHE:
+    memory      per worker process, least recently used entries evicted past
+                RESPONSE_CACHE_MAX_BYTES (the default)
+    filesystem  files in RESPONSE_CACHE_DIR shared by every gunicorn worker
+                on the host, oldest evicted past RESPONSE_CACHE_MAX_BYTES
+    none        no caching and no ETags
+"""
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from flask import current_app, request, session, g
+from flask_login import current_user
+from markupsafe import Markup
+from utils.catalog_version import current_version
+from utils.file_upload import write_file
+
+# Filesystem cache: check the directory size every this many writes
+PRUNE_EVERY = 50
+
+
+class MemoryCache:
+    """Least recently used dict of encoded fragments, bounded by their total size"""
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            value = self._entries.get(key)
+            if value is None:
+                return None
+            self._entries.move_to_end(key)
+        return value.decode('utf-8')
+
+    def set(self, key, html):
+        value = html.encode('utf-8')
+        if len(value) > self.max_bytes:
+            return
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self.size -= len(previous)
+            self._entries[key] = value
+            self.size += len(value)
+            while self.size > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.size -= len(evicted)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+
+class FileSystemCache:
+    """
+    One file per fragment, named by the key's hash. Writes go through a
+    temporary file and a rename, so workers never read a partial entry. Hits
+    refresh the file's mtime, and pruning removes the least recently used
+    files until the directory is back under max_bytes.
+    """
+
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._writes = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.directory, hashlib.sha256(key.encode('utf-8')).hexdigest() + '.html')
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as cached:
+                value = cached.read()
+            os.utime(path)
+        except OSError:
+            return None
+        return value.decode('utf-8')
+
+    def set(self, key, html):
+        value = html.encode('utf-8')
+        if len(value) > self.max_bytes:
+            return
+        write_file(self._path(key), value)
+        self._writes += 1
+        if self._writes % PRUNE_EVERY == 1:
+            self.prune()
+
+    def prune(self):
+        entries = []
+        with os.scandir(self.directory) as scan:
+            for entry in scan:
+                if entry.name.endswith('.html'):
+                    try:
+                        stat = entry.stat()
+                    except OSError:
+                        continue
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total -= size
+
+    def clear(self):
+        for name in os.listdir(self.directory):
+            if name.endswith('.html'):
+                os.remove(os.path.join(self.directory, name))
+
+
+def _template_fingerprint(app):
+    """Short hash of the template files' names, sizes and mtimes, so a deploy retires old entries"""
+    digest = hashlib.sha1()
+    template_root = os.path.join(app.root_path, app.template_folder)
+    for directory, subdirectories, files in sorted(os.walk(template_root)):
+        for name in sorted(files):
+            stat = os.stat(os.path.join(directory, name))
+            digest.update(f'{os.path.relpath(os.path.join(directory, name), template_root)}'
+                          f':{stat.st_size}:{stat.st_mtime_ns};'.encode('utf-8'))
+    return digest.hexdigest()[:10]
+
+
+def init_response_cache(app):
+    """Create the configured backend and store it on the app"""
+    backend = app.config.get('RESPONSE_CACHE', 'memory')
+    max_bytes = int(app.config.get('RESPONSE_CACHE_MAX_BYTES', 32 * 1024 * 1024))
+    if backend == 'memory':
+        cache = MemoryCache(max_bytes)
+    elif backend == 'filesystem':
+        cache = FileSystemCache(app.config['RESPONSE_CACHE_DIR'], max_bytes)
+    elif backend in ('none', '', None):
+        cache = None
+    else:
+        raise ValueError(f"Unknown RESPONSE_CACHE backend '{backend}': use memory, filesystem or none")
+    app.extensions['response_cache'] = {'cache': cache, 'fingerprint': _template_fingerprint(app)}
+    return cache
+
+
+def _state():
+    return current_app.extensions['response_cache']
+
+
+def _version():
+    """Catalog version for this request, read once"""
+    if 'catalog_version' not in g:
+        g.catalog_version = current_version()
+    return g.catalog_version
+
+
+def cached_fragment(name, render, *key_parts):
+    """
+    HTML from render() for this catalog version, from the cache when present.
+    key_parts must cover every input the fragment depends on besides the
+    catalog (filters, category).
+    """
+    state = _state()
+    cache = state['cache']
+    if cache is None:
+        return Markup(render())
+    key = '|'.join([name, state['fingerprint'], str(_version())] + [str(part) for part in key_parts])
+    html = cache.get(key)
+    if html is None:
+        html = render()
+        cache.set(key, html)
+    return Markup(html)
+
+
+def page_etag(name):
+    """
+    ETag for a page built from cached fragments, or None when it must not be
+    revalidated: caching is off, or flashed messages are waiting to be shown.
+    """
+    state = _state()
+    if state['cache'] is None or session.get('_flashes'):
+        return None
+    user_id = current_user.get_id() if current_user.is_authenticated else ''
+    query = hashlib.sha1(request.query_string).hexdigest()[:10]
+    return f'{name}-{_version()}-{state["fingerprint"]}-{user_id}-{query}'
+
+
+def not_modified(etag):
+    """304 for a request whose If-None-Match already holds etag, else None"""
+    if etag and request.if_none_match.contains(etag):
+        response = current_app.response_class(status=304)
+        return revalidate(response, etag)
+    return None
+
+
+def revalidate(response, etag):
+    """Mark a page response so browsers keep it but check back every time"""
+    if etag:
+        response.set_etag(etag)
+        response.headers['Cache-Control'] = 'private, no-cache'
+    return response
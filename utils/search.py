@@ -0,0 +1,280 @@
+"""
+Full-text search
+One search document per Product, HomemadeIngredient and Recipe, kept in an
+SQLite FTS5 table (or a tsvector column with a GIN index on PostgreSQL).
+Session hooks update documents in the same transaction as the rows they
+describe; bulk Core inserts call index_documents() themselves.
+
+Each document is keyed by id * 4 + kind, so it can be replaced or removed
+with a primary-key lookup instead of a scan of the index.
+"""
+import re
+from sqlalchemy import event, inspect, select, text
+from extensions import db
+from models import Product, HomemadeIngredient, Recipe
+from utils.costing import chunked
+
+PRODUCT, SECONDARY, RECIPE = 1, 2, 3
+KINDS = {PRODUCT: 'Product', SECONDARY: 'Secondary', RECIPE: 'Recipe'}
+KIND_CODES = {name: code for code, name in KINDS.items()}
+MODEL_KINDS = {Product: PRODUCT, HomemadeIngredient: SECONDARY, Recipe: RECIPE}
+
+# Attributes that feed each kind of document
+INDEXED_FIELDS = {
+    Product: ('description', 'supplier', 'barbuddy_code', 'unique_item_number'),
+    HomemadeIngredient: ('name', 'unique_code'),
+    Recipe: ('title', 'garnish', 'method', 'recipe_code'),
+}
+
+DEFAULT_LIMIT = 20
+MAX_LIMIT = 100
+WRITE_BATCH_SIZE = 1000
+# bm25 weights for the code, title and body columns
+FTS_WEIGHTS = (10.0, 5.0, 1.0)
+# Queries with fewer letters match whole words rather than prefixes, so one
+# or two typed letters do not expand to most of the catalog
+MIN_PREFIX_QUERY_LENGTH = 3
+
+_TOKEN = re.compile(r'\w+', re.UNICODE)
+
+
+def _dialect():
+    return db.engine.dialect.name
+
+
+def document_key(kind, ref_id):
+    return ref_id * 4 + kind
+
+
+def _join(*parts):
+    return ' '.join(part for part in parts if part)
+
+
+def product_document(product_id, description, supplier, barbuddy_code, unique_item_number):
+    return {'doc_key': document_key(PRODUCT, product_id), 'code': _join(barbuddy_code, unique_item_number),
+            'title': description or '', 'body': supplier or ''}
+
+
+def secondary_document(homemade_id, name, unique_code):
+    return {'doc_key': document_key(SECONDARY, homemade_id), 'code': unique_code or '',
+            'title': name or '', 'body': ''}
+
+
+def recipe_document(recipe_id, title, garnish, method, recipe_code):
+    return {'doc_key': document_key(RECIPE, recipe_id), 'code': recipe_code or '',
+            'title': title or '', 'body': _join(garnish, method)}
+
+
+_BUILDERS = {PRODUCT: product_document, SECONDARY: secondary_document, RECIPE: recipe_document}
+
+
+def _document_for(obj):
+    model = type(obj)
+    fields = INDEXED_FIELDS[model]
+    return _BUILDERS[MODEL_KINDS[model]](obj.id, *(getattr(obj, field) for field in fields))
+
+
+# -------------------------
+# Index storage
+# -------------------------
+def ensure_search_index():
+    """Create the search table if needed and fill it when it is new"""
+    with db.engine.begin() as conn:
+        if _dialect() == 'postgresql':
+            exists = conn.execute(text("SELECT to_regclass('search_document')")).scalar()
+            if not exists:
+                conn.execute(text("""
+                    CREATE TABLE search_document (
+                        doc_key BIGINT PRIMARY KEY,
+                        code TEXT NOT NULL DEFAULT '',
+                        title TEXT NOT NULL DEFAULT '',
+                        body TEXT NOT NULL DEFAULT '',
+                        document tsvector GENERATED ALWAYS AS (
+                            setweight(to_tsvector('simple', code), 'A') ||
+                            setweight(to_tsvector('simple', title), 'B') ||
+                            setweight(to_tsvector('simple', body), 'C')
+                        ) STORED
+                    )
+                """))
+                conn.execute(text("CREATE INDEX ix_search_document ON search_document USING GIN (document)"))
+        else:
+            exists = conn.execute(text(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'search_index'"
+            )).scalar()
+            if not exists:
+                # Prefix indexes keep short typeahead prefixes fast
+                conn.execute(text(
+                    "CREATE VIRTUAL TABLE search_index USING fts5("
+                    "code, title, body, tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3')"
+                ))
+                # Weighted bm25 as the built-in rank, so ORDER BY rank uses it
+                conn.execute(text(
+                    "INSERT INTO search_index (search_index, rank) VALUES ('rank', 'bm25({}, {}, {})')"
+                    .format(*FTS_WEIGHTS)
+                ))
+    if not exists:
+        rebuild_search_index()
+        db.session.commit()
+
+
+def _write(conn, documents, deleted_keys, replace=True):
+    """Replace documents and remove deleted keys through conn; replace=False for an empty index"""
+    documents = list(documents)
+    if _dialect() == 'postgresql':
+        if deleted_keys:
+            conn.execute(text("DELETE FROM search_document WHERE doc_key = :key"),
+                         [{'key': key} for key in deleted_keys])
+        for start in range(0, len(documents), WRITE_BATCH_SIZE):
+            conn.execute(text(
+                "INSERT INTO search_document (doc_key, code, title, body) VALUES (:doc_key, :code, :title, :body) "
+                "ON CONFLICT (doc_key) DO UPDATE SET code = EXCLUDED.code, title = EXCLUDED.title, body = EXCLUDED.body"
+            ), documents[start:start + WRITE_BATCH_SIZE])
+    else:
+        keys = set(deleted_keys)
+        if replace:
+            keys.update(doc['doc_key'] for doc in documents)
+        if keys:
+            conn.execute(text("DELETE FROM search_index WHERE rowid = :key"), [{'key': key} for key in keys])
+        for start in range(0, len(documents), WRITE_BATCH_SIZE):
+            conn.execute(text(
+                "INSERT INTO search_index (rowid, code, title, body) VALUES (:doc_key, :code, :title, :body)"
+            ), documents[start:start + WRITE_BATCH_SIZE])
+
+
+def _load_documents(model, ids=None):
+    kind = MODEL_KINDS[model]
+    columns = [model.id] + [getattr(model, field) for field in INDEXED_FIELDS[model]]
+    query = select(*columns)
+    if ids is not None:
+        query = query.where(model.id.in_(ids))
+    return [_BUILDERS[kind](*row) for row in db.session.execute(query)]
+
+
+def index_documents(model, ids):
+    """(Re)index rows of a model by id, e.g. after bulk Core inserts. The caller commits."""
+    documents = []
+    for chunk in chunked(ids):
+        documents.extend(_load_documents(model, chunk))
+    _write(db.session.connection(), documents, ())
+
+
+def remove_documents(model, ids):
+    """Drop rows of a model from the index by id, e.g. after bulk deletes. The caller commits."""
+    kind = MODEL_KINDS[model]
+    _write(db.session.connection(), (), [document_key(kind, ref_id) for ref_id in ids])
+
+
+def rebuild_search_index():
+    """Reindex every product, secondary ingredient and recipe. The caller commits."""
+    conn = db.session.connection()
+    if _dialect() == 'postgresql':
+        conn.execute(text("DELETE FROM search_document"))
+    else:
+        conn.execute(text("DELETE FROM search_index"))
+    count = 0
+    for model in MODEL_KINDS:
+        documents = _load_documents(model)
+        _write(conn, documents, (), replace=False)
+        count += len(documents)
+    return count
+
+
+# -------------------------
+# Incremental updates
+# -------------------------
+def _changed(obj):
+    state = inspect(obj)
+    return any(state.attrs[field].history.has_changes() for field in INDEXED_FIELDS[type(obj)])
+
+
+def _index_on_flush(session, flush_context):
+    # Still the pre-flush new/dirty/deleted sets here, with ids assigned
+    documents = {}
+    deleted = set()
+    for obj in session.new:
+        if type(obj) in MODEL_KINDS:
+            doc = _document_for(obj)
+            documents[doc['doc_key']] = doc
+    for obj in session.dirty:
+        if type(obj) in MODEL_KINDS and _changed(obj):
+            doc = _document_for(obj)
+            documents[doc['doc_key']] = doc
+    for obj in session.deleted:
+        if type(obj) in MODEL_KINDS:
+            deleted.add(document_key(MODEL_KINDS[type(obj)], obj.id))
+    if documents or deleted:
+        _write(session.connection(), documents.values(), deleted)
+
+
+def register_search_hooks():
+    """Keep search documents in step with unit-of-work writes (idempotent)"""
+    if not event.contains(db.session, 'after_flush', _index_on_flush):
+        event.listen(db.session, 'after_flush', _index_on_flush)
+
+
+# -------------------------
+# Queries
+# -------------------------
+def _tokens(query):
+    return [token.lower() for token in _TOKEN.findall(query or '')][:10]
+
+
+def _term(token, prefix, postgres=False):
+    """One query word, matched as a prefix or as a whole word"""
+    if postgres:
+        return f'{token}:*' if prefix else token
+    # Quoted so user input cannot form FTS5 syntax
+    return f'"{token}"*' if prefix else f'"{token}"'
+
+
+def _ranked_sqlite(conn, match, kind_code, limit):
+    kind_filter = " AND rowid % 4 = :kind" if kind_code else ""
+    return conn.execute(text(
+        "SELECT rowid, code, title, -rank AS score FROM search_index WHERE search_index MATCH :q"
+        + kind_filter + " ORDER BY rank LIMIT :limit"
+    ), {'q': match, 'kind': kind_code, 'limit': limit}).all()
+
+
+def _ranked_postgresql(conn, query, excluded, kind_code, limit):
+    kind_filter = " AND doc_key % 4 = :kind" if kind_code else ""
+    exclude_filter = " AND NOT document @@ to_tsquery('simple', :excluded)" if excluded else ""
+    return conn.execute(text(
+        "SELECT doc_key, code, title, ts_rank(document, q) AS score"
+        " FROM search_document, to_tsquery('simple', :q) q"
+        " WHERE document @@ q" + exclude_filter + kind_filter + " ORDER BY score DESC LIMIT :limit"
+    ), {'q': query, 'excluded': excluded, 'kind': kind_code, 'limit': limit}).all()
+
+
+def search(query, kind=None, limit=DEFAULT_LIMIT):
+    """
+    Ranked matches for every word of query as a prefix (or as a whole word
+    for queries under MIN_PREFIX_QUERY_LENGTH letters), best first. Returns dicts with
+    type, id, code, title and score; kind narrows to 'Product', 'Secondary'
+    or 'Recipe'. Documents with every word in their code or title rank ahead
+    of those that need the body text (supplier, garnish, method); each group
+    is ranked in full by weighted bm25 (ts_rank on PostgreSQL), and the body
+    group is only searched when the first does not fill the page.
+    """
+    tokens = _tokens(query)
+    if not tokens:
+        return []
+    kind_code = KIND_CODES.get(kind)
+    prefix = len(''.join(tokens)) >= MIN_PREFIX_QUERY_LENGTH
+    conn = db.session.connection()
+    if _dialect() == 'postgresql':
+        # Weights A and B are the code and title
+        heading = ' & '.join(f'{_term(token, prefix, postgres=True)}AB' for token in tokens)
+        rows = _ranked_postgresql(conn, heading, None, kind_code, limit)
+        if len(rows) < limit:
+            anywhere = ' & '.join(_term(token, prefix, postgres=True) for token in tokens)
+            rows += _ranked_postgresql(conn, anywhere, heading, kind_code, limit - len(rows))
+    else:
+        terms = ' '.join(_term(token, prefix) for token in tokens)
+        heading = f'{{code title}}: ({terms})'
+        rows = _ranked_sqlite(conn, heading, kind_code, limit)
+        if len(rows) < limit:
+            rows += _ranked_sqlite(conn, f'({terms}) NOT ({heading})', kind_code, limit - len(rows))
+    return [
+        {'type': KINDS[key % 4], 'id': key // 4, 'code': code, 'title': title, 'score': round(float(score), 4)}
+        for key, code, title, score in rows
+    ]
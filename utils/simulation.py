@@ -0,0 +1,152 @@
+"""
+What-if price simulation
+Reprices the whole recipe catalog under hypothetical product prices without
+touching the database. The catalog's bill of materials is loaded into arrays
+once per catalog version (utils.catalog_version) and kept in memory, so each
+simulation is pure NumPy work over the cached arrays.
+"""
+import re
+import threading
+import numpy as np
+from sqlalchemy import func, or_
+from extensions import db
+from models import Product, Recipe
+from utils.catalog_version import current_version
+from utils.recost import load_catalog, id_positions
+
+DEFAULT_LIMIT = 50
+
+_cache_lock = threading.Lock()
+_cache = {'version': None, 'catalog': None, 'baseline': None}
+
+_CHANGE_PATTERN = re.compile(r'^\s*([+-]?\d+(?:\.\d+)?)\s*(%?)\s*$')
+
+
+class SimulationError(ValueError):
+    """An override that cannot be applied"""
+
+
+def _catalog():
+    """(CatalogArrays, baseline CatalogCosts) for the current catalog version"""
+    version = current_version()
+    with _cache_lock:
+        if _cache['version'] != version or _cache['catalog'] is None:
+            catalog = load_catalog()
+            _cache.update(version=version, catalog=catalog, baseline=catalog.evaluate())
+        return _cache['catalog'], _cache['baseline']
+
+
+def parse_change(text):
+    """'+18%' / '-5%' -> {'percent': ...}; '12.50' -> {'price': 12.5}"""
+    match = _CHANGE_PATTERN.match(str(text or ''))
+    if not match:
+        raise SimulationError(f"Invalid price change '{text}': use +18%, -5% or a new price such as 12.50")
+    value = float(match.group(1))
+    return {'percent': value} if match.group(2) else {'price': value}
+
+
+def _matching_product_ids(override):
+    """Product ids selected by an override's product_id, code or supplier"""
+    query = db.session.query(Product.id)
+    if override.get('product_id') is not None:
+        query = query.filter(Product.id == int(override['product_id']))
+    elif override.get('code'):
+        code = str(override['code']).strip()
+        query = query.filter(or_(Product.barbuddy_code == code, Product.unique_item_number == code))
+    elif override.get('supplier'):
+        query = query.filter(func.lower(Product.supplier) == str(override['supplier']).strip().lower())
+    else:
+        raise SimulationError('Each override needs a product_id, code or supplier')
+    return np.array([row[0] for row in query], dtype=np.int64)
+
+
+def simulated_prices(catalog, overrides):
+    """Live price vector with the overrides applied in order (percentages compound)"""
+    prices = catalog.prices.copy()
+    for override in overrides or ():
+        if not isinstance(override, dict):
+            raise SimulationError(f"Invalid override {override!r}")
+        positions = id_positions(catalog.product_ids, _matching_product_ids(override))
+        positions = positions[positions >= 0]
+        if len(positions) == 0:
+            raise SimulationError(f"No products match {override}")
+        if override.get('price') is None and override.get('percent') is None:
+            raise SimulationError(f"Override {override} needs a percent or price")
+        try:
+            price = float(override['price']) if override.get('price') is not None else None
+            percent = float(override['percent']) if price is None else None
+        except (TypeError, ValueError):
+            raise SimulationError(f"Invalid percent or price in {override}")
+        if price is not None:
+            prices[positions] = price
+        else:
+            prices[positions] *= 1 + percent / 100
+    return np.maximum(prices, 0.0)
+
+
+def _number(value):
+    return None if value != value else float(value)
+
+
+def simulate(overrides, threshold=None, recipe_type=None, limit=DEFAULT_LIMIT):
+    """
+    Reprice every recipe with the overrides applied and rank the changes.
+
+    overrides is a list of dicts selecting products by 'product_id', 'code'
+    (BarBuddy code or unique item #) or 'supplier', each with a 'percent'
+    change or an absolute 'price'. With a threshold (cost %), only recipes
+    whose cost % moves across it are returned. Results are ranked by the
+    change in cost % (then total cost), largest increase first.
+    """
+    catalog, baseline = _catalog()
+    simulated = catalog.evaluate(simulated_prices(catalog, overrides))
+
+    base_pct = baseline.recipe_cost_percentages
+    new_pct = simulated.recipe_cost_percentages
+    cost_delta = simulated.recipe_costs - baseline.recipe_costs
+    pct_delta = np.nan_to_num(new_pct - base_pct)
+
+    selected = cost_delta != 0
+    if recipe_type:
+        selected &= catalog.recipe_types == recipe_type
+    crossing = np.zeros(len(catalog.recipe_ids), dtype=bool)
+    if threshold is not None:
+        priced = ~np.isnan(base_pct)
+        crossing[priced] = (base_pct[priced] > threshold) != (new_pct[priced] > threshold)
+        selected &= crossing
+
+    positions = np.flatnonzero(selected)
+    # Largest cost % increase first, ties broken by the cost change
+    order = np.lexsort((-cost_delta[positions], -pct_delta[positions]))
+    affected = len(positions)
+    positions = positions[order][:limit] if limit else positions[order]
+
+    recipe_ids = [int(rid) for rid in catalog.recipe_ids[positions]]
+    recipes = {}
+    if recipe_ids:
+        for row in db.session.query(Recipe.id, Recipe.recipe_code, Recipe.title).filter(
+            Recipe.id.in_(recipe_ids)
+        ):
+            recipes[row[0]] = row
+
+    results = []
+    for pos, recipe_id in zip(positions, recipe_ids):
+        row = recipes.get(recipe_id)
+        results.append({
+            'id': recipe_id,
+            'code': row[1] if row else None,
+            'title': row[2] if row else None,
+            'type': catalog.recipe_types[pos],
+            'total_cost': float(baseline.recipe_costs[pos]),
+            'simulated_total_cost': float(simulated.recipe_costs[pos]),
+            'cost_percentage': _number(base_pct[pos]),
+            'simulated_cost_percentage': _number(new_pct[pos]),
+            'cost_percentage_change': round(float(pct_delta[pos]), 2),
+            'crosses_threshold': bool(crossing[pos]),
+        })
+    return {
+        'recipes_evaluated': len(catalog.recipe_ids),
+        'recipes_affected': affected,
+        'threshold': threshold,
+        'results': results,
+    }
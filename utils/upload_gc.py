@@ -0,0 +1,133 @@
+"""
+Upload garbage collection
+Finds files in the upload folder that no product or recipe refers to. The
+referenced image paths (and their resized variants) are read with one
+query into a set; the upload tree is then walked one directory at a time
+with os.scandir, so neither the listing nor the table is held twice. Orphans
+are deleted, or moved to the quarantine folder (outside the web root) for
+later inspection. Files younger than min_age are left alone, since a
+request may have stored a file whose row is not committed yet.
+
+Backs `flask gc-uploads` and the scheduled gc_uploads job.
+"""
+import os
+import shutil
+import time
+from flask import current_app
+from sqlalchemy import select, union
+from extensions import db
+from models import Product, Recipe
+from utils.images import variant_paths
+
+DEFAULT_MIN_AGE = 60 * 60
+SAMPLE_SIZE = 20
+
+
+class GcReport:
+    def __init__(self, dry_run, quarantine):
+        self.dry_run = dry_run
+        self.quarantine = quarantine
+        self.scanned = 0
+        self.scanned_bytes = 0
+        self.orphans = 0
+        self.orphan_bytes = 0
+        # Orphans younger than min_age, left for a later run
+        self.recent = 0
+        self.errors = []
+        self.sample = []
+
+    def summary(self):
+        if self.dry_run:
+            action = 'Would quarantine' if self.quarantine else 'Would delete'
+        else:
+            action = 'Quarantined' if self.quarantine else 'Deleted'
+        message = (f'{action} {self.orphans} orphaned upload(s), {self.orphan_bytes / 1024 / 1024:.1f} MB, '
+                   f'of {self.scanned} file(s) scanned.')
+        if self.recent:
+            message += f' {self.recent} newer unreferenced file(s) were left for a later run.'
+        if self.errors:
+            message += f' {len(self.errors)} file(s) could not be removed.'
+        return message
+
+    def as_dict(self):
+        return {'scanned': self.scanned, 'orphans': self.orphans, 'orphan_bytes': self.orphan_bytes,
+                'recent': self.recent, 'sample': self.sample, 'errors': self.errors[:SAMPLE_SIZE],
+                'message': self.summary()}
+
+
+def referenced_paths():
+    """Every stored image path a product or recipe uses, with its variants"""
+    paths = set(db.session.scalars(union(
+        select(Product.image_path).where(Product.image_path.isnot(None)),
+        select(Recipe.image_path).where(Recipe.image_path.isnot(None)),
+    )))
+    for path in list(paths):
+        paths.update(variant_paths(path))
+    return paths
+
+
+def _files(directory):
+    """DirEntry of every file below directory, one directory listing at a time"""
+    with os.scandir(directory) as entries:
+        subdirectories = []
+        for entry in entries:
+            if entry.name.startswith('.'):
+                continue
+            if entry.is_dir(follow_symlinks=False):
+                subdirectories.append(entry.path)
+            elif entry.is_file(follow_symlinks=False):
+                yield entry
+    for subdirectory in subdirectories:
+        yield from _files(subdirectory)
+
+
+def _prune_empty_directories(root):
+    for directory, subdirectories, files in os.walk(root, topdown=False):
+        if directory != root and not os.listdir(directory):
+            os.rmdir(directory)
+
+
+def collect_uploads(dry_run=False, quarantine=False, min_age=DEFAULT_MIN_AGE):
+    """Delete (or quarantine) unreferenced upload files and return a GcReport"""
+    report = GcReport(dry_run, quarantine)
+    referenced = referenced_paths()
+    # End the read transaction; the walk below can take a while
+    db.session.commit()
+
+    upload_root = current_app.config['UPLOAD_FOLDER']
+    static_folder = current_app.static_folder
+    quarantine_root = current_app.config['UPLOAD_QUARANTINE_FOLDER']
+    cutoff = time.time() - min_age
+    if not os.path.isdir(upload_root):
+        return report
+
+    for entry in _files(upload_root):
+        stat = entry.stat(follow_symlinks=False)
+        report.scanned += 1
+        report.scanned_bytes += stat.st_size
+        path = os.path.relpath(entry.path, static_folder).replace(os.sep, '/')
+        if path in referenced:
+            continue
+        if stat.st_mtime > cutoff:
+            report.recent += 1
+            continue
+        report.orphans += 1
+        report.orphan_bytes += stat.st_size
+        if len(report.sample) < SAMPLE_SIZE:
+            report.sample.append(path)
+        if dry_run:
+            continue
+        try:
+            if quarantine:
+                target = os.path.join(quarantine_root, os.path.relpath(entry.path, upload_root))
+                os.makedirs(os.path.dirname(target), exist_ok=True)
+                shutil.move(entry.path, target)
+            else:
+                os.remove(entry.path)
+        except OSError as e:
+            report.errors.append(f'{path}: {str(e)}')
+
+    if not dry_run:
+        _prune_empty_directories(upload_root)
+    current_app.logger.info(report.summary())
+    return report
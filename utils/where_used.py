@@ -0,0 +1,157 @@
+"""
+Where-used graph
+Reverse dependency lookups from products to the secondary ingredients and
+recipes that use them, and from recipes to the recipes nesting them. The
+edges are the HomemadeIngredientItem and RecipeIngredient rows themselves,
+kept indexed on their reverse-lookup columns so each hop is one indexed query.
+"""
+from extensions import db
+from models import Product, HomemadeIngredient, HomemadeIngredientItem, Recipe, RecipeIngredient
+from utils.costing import chunked
+
+
+def homemades_using_products(product_ids):
+    """{homemade_id} of secondary ingredients containing any of the products"""
+    ids = set()
+    for chunk in chunked(product_ids):
+        rows = db.session.query(HomemadeIngredientItem.homemade_id).filter(
+            HomemadeIngredientItem.product_id.in_(chunk)
+        )
+        ids.update(row[0] for row in rows)
+    return ids
+
+
+def recipe_edges(ingredient_type, ingredient_ids):
+    """(recipe_id, ingredient_id) pairs for recipes using any of the ingredients"""
+    edges = set()
+    for chunk in chunked(ingredient_ids):
+        rows = db.session.query(RecipeIngredient.recipe_id, RecipeIngredient.ingredient_id).filter(
+            RecipeIngredient.ingredient_type == ingredient_type,
+            RecipeIngredient.ingredient_id.in_(chunk)
+        )
+        edges.update((row[0], row[1]) for row in rows)
+    return edges
+
+
+class DependencyPlan:
+    """Every node affected by a change, with recipes in dependency order"""
+
+    def __init__(self, product_ids, homemade_ids, recipe_ids, recipe_order):
+        self.product_ids = product_ids
+        self.homemade_ids = homemade_ids
+        self.recipe_ids = recipe_ids
+        # Nested recipes come before the recipes that include them
+        self.recipe_order = recipe_order
+
+
+def _topological_order(recipe_ids, nesting):
+    """Order recipes so every nested recipe precedes its parents (Kahn's algorithm)"""
+    pending_children = {recipe_id: 0 for recipe_id in recipe_ids}
+    parents_of = {}
+    for parent_id, child_id in nesting:
+        if parent_id in pending_children and child_id in pending_children and parent_id != child_id:
+            pending_children[parent_id] += 1
+            parents_of.setdefault(child_id, []).append(parent_id)
+    ready = sorted(r for r, count in pending_children.items() if count == 0)
+    order = []
+    while ready:
+        recipe_id = ready.pop()
+        order.append(recipe_id)
+        for parent_id in parents_of.get(recipe_id, ()):
+            pending_children[parent_id] -= 1
+            if pending_children[parent_id] == 0:
+                ready.append(parent_id)
+    # Anything left is part of a cycle; keep it so it is still recosted
+    seen = set(order)
+    order.extend(sorted(r for r in recipe_ids if r not in seen))
+    return order
+
+
+def dependency_plan(product_ids=(), homemade_ids=(), recipe_ids=()):
+    """Expand changed rows to every secondary ingredient and recipe whose cost depends on them"""
+    product_ids = set(product_ids)
+    homemade_ids = set(homemade_ids) | homemades_using_products(product_ids)
+    recipe_ids = set(recipe_ids)
+    recipe_ids.update(recipe_id for recipe_id, _ in recipe_edges('Product', product_ids))
+    recipe_ids.update(recipe_id for recipe_id, _ in recipe_edges('Homemade', homemade_ids))
+
+    nesting = set()
+    frontier = set(recipe_ids)
+    while frontier:
+        edges = recipe_edges('Recipe', frontier)
+        nesting |= edges
+        parents = {parent_id for parent_id, _ in edges} - recipe_ids
+        recipe_ids |= parents
+        frontier = parents
+    return DependencyPlan(product_ids, homemade_ids, recipe_ids, _topological_order(recipe_ids, nesting))
+
+
+def recipe_cycle(recipe_id, nested_ids):
+    """
+    Return the id of a nested recipe that would make `recipe_id` include
+    itself (directly or through other recipes), or None if the nesting is safe.
+    """
+    nested_ids = set(nested_ids)
+    if not nested_ids:
+        return None
+    if recipe_id in nested_ids:
+        return recipe_id
+    # Every recipe that already includes recipe_id, plus recipe_id itself
+    ancestors = dependency_plan(recipe_ids=[recipe_id]).recipe_ids
+    conflicts = nested_ids & ancestors
+    return min(conflicts) if conflicts else None
+
+
+def where_used(ingredient):
+    """
+    Describe everything that uses a Product, HomemadeIngredient or Recipe.
+    Returns a dict with the secondary ingredients and recipes affected by it,
+    recipes listed in dependency order.
+    """
+    if isinstance(ingredient, Product):
+        plan = dependency_plan(product_ids=[ingredient.id])
+        target = {'type': 'Product', 'id': ingredient.id, 'code': ingredient.barbuddy_code, 'name': ingredient.description}
+    elif isinstance(ingredient, HomemadeIngredient):
+        plan = dependency_plan(homemade_ids=[ingredient.id])
+        plan.homemade_ids.discard(ingredient.id)
+        target = {'type': 'Secondary', 'id': ingredient.id, 'code': ingredient.unique_code, 'name': ingredient.name}
+    elif isinstance(ingredient, Recipe):
+        plan = dependency_plan(recipe_ids=[ingredient.id])
+        plan.recipe_ids.discard(ingredient.id)
+        plan.recipe_order = [r for r in plan.recipe_order if r != ingredient.id]
+        target = {'type': 'Recipe', 'id': ingredient.id, 'code': ingredient.recipe_code, 'name': ingredient.title}
+    else:
+        raise TypeError(f"Unsupported ingredient type: {type(ingredient).__name__}")
+
+    homemades = {}
+    for chunk in chunked(plan.homemade_ids):
+        for homemade in HomemadeIngredient.query.filter(HomemadeIngredient.id.in_(chunk)):
+            homemades[homemade.id] = homemade
+    recipes = {}
+    for chunk in chunked(plan.recipe_ids):
+        for recipe in Recipe.query.filter(Recipe.id.in_(chunk)):
+            recipes[recipe.id] = recipe
+
+    return {
+        'ingredient': target,
+        'secondary_ingredients': [
+            {'id': h.id, 'code': h.unique_code, 'name': h.name}
+            for h in sorted(homemades.values(), key=lambda h: h.name or '')
+        ],
+        'recipes': [
+            {'id': r.id, 'code': r.recipe_code, 'title': r.title}
+            for r in (recipes.get(recipe_id) for recipe_id in plan.recipe_order)
+            if r
+        ],
+    }
+
+
+def find_by_code(code):
+    """Look up a Product (barbuddy code or unique item #), secondary ingredient or recipe by code"""
+    code = (code or '').strip()
+    return (
+        Product.query.filter_by(barbuddy_code=code).first()
+        or Product.query.filter_by(unique_item_number=code).first()
+        or HomemadeIngredient.query.filter_by(unique_code=code).first()
+        or Recipe.query.filter_by(recipe_code=code).first()
+    )